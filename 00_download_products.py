@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
-import wget
-import os
+import sys
 from constants import *
+from pipeline import download_products
 
 '''
 The content of the GMI dataset is described by the File Specification for GPM Products:
@@ -38,21 +38,9 @@ surfacePrecipitation  The monthly mean of the instantaneous precipitation rate a
 '''
 
 
-# Create the data directory if it doesn't exist
-if not os.path.exists(DATA_DIR):
-  os.makedirs(DATA_DIR)
+# download the data that hasn't already been downloaded
+# the downloads run concurrently, interrupted downloads are resumed and completed downloads are checked against the manifest
+failed = download_products(DATA_DIR, DATA_URLS)
 
-# a function to download the data that hasn't already been downloaded
-def download_data(urls):
-  for url in urls:
-    data_filename = os.path.basename(url)
-    download_file_path = os.path.join(DATA_DIR, data_filename)
-
-    if not os.path.exists(download_file_path):
-      print(f"downloading {data_filename}")
-      wget.download(url, download_file_path)
-    else:
-      print(f"already downloaded: {data_filename}")
-
-# download the data
-download_data(DATA_URLS)
+if failed:
+  sys.exit(f'{len(failed)} downloads failed, run the script again to resume them')
@@ -1,60 +1,39 @@
 #!/usr/bin/env python
 
-import h5py
-import numpy as np
-import tensorflow as tf
-from sklearn.preprocessing import StandardScaler
+import os
+import sys
 
 from constants import *
-from plot_utils import plot_rr
-
-# open and read the TB data file
+from pipeline import predict_precipitation, map_prediction
+from output_utils import write_prediction, prediction_filename
+
+# load the model, open and read the TB data file and make predictions
+# the inputs are standardized with the mean and variance calculated on the training dataset
+# only the scans that cross the area of interest are read
+# the swath is streamed through the model in batches and the missing pixels are left as NaN in the predicted swath
+# the predictions are cached, running the script again with the same granule and model skips the reading and the inference
 gmi_file_path = f'{DATA_DIR}/{DATA_FILENAME_TB}'
-hf = h5py.File(gmi_file_path,'r')
-
-# fetch model input values
-lat_S1 = hf['S1/Latitude'][:]
-lon_S1 = hf['S1/Longitude'][:]
-TB_S1 = hf['S1/Tc'][:]
-TB_S2 = hf['S2/Tc'][:]
-
-# close the the TB data file
-hf.close()
-
-# merge the two TB data sources into a single data object
-TB = np.concatenate((TB_S1, TB_S2,), axis=2)
-TB = np.reshape(TB, (2963*221, 13))
-TB[np.any(TB<=0, axis=1),:] = np.NaN # NaN the missing values
-
-# scaling: standardize features by removing the mean and scaling to unit variance
-scaler = StandardScaler()
-
-# mean and variance are calculated on the input dataset
-# todo: however, variance are calculated might have to be calculated on the same dataset used to train the model?
-scaler.fit_transform(TB)
-
-# load the model
-model = tf.keras.models.load_model(f'{MODELS_DIR}/{MODEL_FILENAME}')
-
-# check its architecture
-model.summary()
+prediction = predict_precipitation(gmi_file_path,
+  lat_bounds = LAT_BOUNDS_IONIAN_SEA,
+  lon_bounds = LON_BOUNDS_IONIAN_SEA,
+  cache_dir = CACHE_DIR,
+  verbose = True)
 
-# make predictions
-rr_predictions = model.predict(TB)
+# there is nothing to write or plot if the granule does not cross the area of interest
+if prediction is None:
+  sys.exit(f'{gmi_file_path} does not cross the area of interest')
 
-# plot the predicted precipitation on a map (reshape it first so it can be plotted)
-rr_predictions = np.reshape(rr_predictions, (2963, 221))
+# write the predictions into an HDF5 file with the layout of the 2A GPROF product
+# the file is chunked by scans and compressed, and can be read and mapped like the GPROF granule of 02_map_products_precipitation.py
+os.makedirs(PREDICTIONS_DIR, exist_ok=True)
+write_prediction(f'{PREDICTIONS_DIR}/{prediction_filename(gmi_file_path)}', prediction, {'source_granule': DATA_FILENAME_TB})
 
 # plot the estimated precipitation on a map
-plot_rr(
-  RR = rr_predictions,
-  lat = lat_S1,
-  lon = lon_S1,
+map_prediction(prediction,
   lat_bounds = LAT_BOUNDS_IONIAN_SEA,
   lon_bounds = LON_BOUNDS_IONIAN_SEA,
   colorAxisMin = 0,
   colorAxisMax = 40,
-  title = "Estimated Surface Precipitation",
   #show = False,
   #filepath = "figures/fig7_aoi_sea_rr_estimated.png"
 )
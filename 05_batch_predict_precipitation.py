@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import argparse
+import glob
+import json
+import os
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from constants import *
+from profile_utils import profiler, enable_profiling, PROFILE_ENV
+
+'''
+Predict the surface precipitation of many 1C GMI granules, e.g. to reprocess an archive of orbits.
+
+The granules are given as directories and/or glob patterns and are distributed over a pool of worker processes.
+Each worker loads the model once and then predicts the granules it is given. The predictions of each granule
+are written into their own HDF5 file with the layout of the 2A GPROF product (see output_utils) and a run manifest records the timings and failures of each granule.
+Nothing is plotted so the batch can run headless.
+
+With --ensemble the granules are predicted by an ensemble of models (see ensemble_utils) evaluated in one pass,
+and the output files also have the standard deviation and the quantiles of the member predictions of each pixel.
+
+Example:
+  python 05_batch_predict_precipitation.py data/ --workers 8 --lat-bounds 34 40 --lon-bounds 14 22
+  python 05_batch_predict_precipitation.py data/ --ensemble models/versions/v* --quantiles 0.1 0.5 0.9
+'''
+
+# the prediction function of the worker process, loaded once by the pool initializer
+predict = None
+
+# the files of the loaded model, its precision and the cache of the worker process
+model_files = None
+model_precision = None
+cache = None
+
+# the ensemble of the worker process and its quantiles, if the granules are predicted by an ensemble
+ensemble = None
+ensemble_quantiles = None
+
+
+def init_worker(models_dir, precision, cache_dir, ensemble_members=None, quantiles=None):
+  ''' Load the model, or the ensemble of models, once in each worker process. '''
+
+  global predict, model_files, model_precision, cache, ensemble, ensemble_quantiles
+
+  if ensemble_members:
+    from ensemble_utils import EnsembleMLP
+    ensemble = EnsembleMLP(ensemble_members, precision=precision)
+    ensemble_quantiles = quantiles
+
+  else:
+    from predict_utils import load_predictor, predictor_files
+    predict = load_predictor(models_dir, precision=precision)
+    model_files = predictor_files(models_dir, precision)
+
+  model_precision = precision
+
+  if cache_dir:
+    from cache_utils import ArrayCache
+    cache = ArrayCache(cache_dir)
+
+
+def predict_file(file_path, output_dir, lat_bounds, lon_bounds, compression_threads, least_significant_digit):
+  ''' Predict a granule in a worker process and write the predictions into the output directory.
+
+  Returns the manifest record of the granule, failures are recorded rather than raised.
+  '''
+
+  from predict_utils import predict_granule
+  from ensemble_utils import predict_ensemble_granule
+  from output_utils import write_prediction, prediction_filename
+
+  record = {
+    'granule': file_path,
+    'output': None,
+    'status': 'ok',
+    'seconds': None,
+    'n_pixels': 0,
+    'n_predicted': 0,
+    'error': None
+  }
+
+  start = time.perf_counter()
+  profiler.reset()
+
+  try:
+    if ensemble is not None:
+      prediction = predict_ensemble_granule(file_path, ensemble, lat_bounds, lon_bounds, cache, ensemble_quantiles)
+    else:
+      prediction = predict_granule(file_path, predict, lat_bounds, lon_bounds, cache, model_files, model_precision)
+
+    if prediction is None:
+      # the granule doesn't cross the area of interest
+      record['status'] = 'skipped'
+
+    else:
+      attributes = {
+        'source_granule': os.path.basename(file_path),
+        'model': ','.join(ensemble.filepaths if ensemble is not None else model_files),
+        'precision': model_precision
+      }
+
+      output_path = os.path.join(output_dir, prediction_filename(file_path))
+      write_prediction(output_path, prediction, attributes, threads=compression_threads, least_significant_digit=least_significant_digit)
+
+      record['output'] = output_path
+      record['n_pixels'] = int(prediction['rr'].size)
+      record['n_predicted'] = int(np.count_nonzero(~np.isnan(prediction['rr'])))
+
+  except Exception as e:
+    record['status'] = 'failed'
+    record['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+  record['seconds'] = time.perf_counter() - start
+
+  # the stages of the granule, merged into the profile of the main process
+  if profiler.enabled:
+    record['profile'] = profiler.snapshot()
+
+  return record
+
+
+def list_granules(inputs):
+  ''' List the granule files given as directories and/or glob patterns. '''
+
+  file_paths = set()
+
+  for path in inputs:
+    if os.path.isdir(path):
+      file_paths.update(glob.glob(os.path.join(path, GMI_TB_FILE_PATTERN)))
+    else:
+      file_paths.update(glob.glob(path))
+
+  return sorted(file_paths)
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Predict the surface precipitation of many 1C GMI granules.')
+  parser.add_argument('inputs', nargs='+', help='directories of 1C GMI granules and/or glob patterns of granule files')
+  parser.add_argument('--output-dir', default=PREDICTIONS_DIR, help='directory where the predictions and the run manifest are written')
+  parser.add_argument('--models-dir', default=MODELS_DIR, help='directory of the trained model')
+  parser.add_argument('--precision', default='float32', choices=['float64', 'float32', 'float16', 'int8'], help='precision of the NumPy inference engine, float16 and int8 simulate the accuracy of reduced precision and are slower than float32 (int8 needs 08_quantization_report.py to be run first)')
+  parser.add_argument('--ensemble', nargs='+', default=None, help='model directories or exported .npz files of the ensemble members (default: predict with the single model of --models-dir)')
+  parser.add_argument('--quantiles', type=float, nargs='*', default=None, help='quantiles of the ensemble member predictions written for each pixel (default: 0.05 0.5 0.95)')
+  parser.add_argument('--cache-dir', default=None, help=f'cache the TBs and the predictions of the granules in this directory, e.g. {CACHE_DIR} (default: no cache)')
+  parser.add_argument('--least-significant-digit', type=int, default=None, help='round the rain rates to this number of decimals so that they compress better (default: lossless)')
+  parser.add_argument('--compression-threads', type=int, default=None, help='number of threads compressing the output of each worker (default: the CPU cores shared by the workers)')
+  parser.add_argument('--profile', default=None, help='write the profile of the stages into this .json or .csv file')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+  parser.add_argument('--lat-bounds', type=float, nargs=2, default=None, help='latitude bounds of the area of interest (default: full granules)')
+  parser.add_argument('--lon-bounds', type=float, nargs=2, default=None, help='longitude bounds of the area of interest (default: full granules)')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  # the workers inherit the environment variable so that they profile their stages too
+  if args.profile:
+    os.environ[PROFILE_ENV] = args.profile
+    enable_profiling(args.profile)
+
+  # create the output directory if it doesn't exist
+  if not os.path.exists(args.output_dir):
+    os.makedirs(args.output_dir)
+
+  if args.ensemble and args.precision == 'int8':
+    raise SystemExit('the ensembles are predicted in float64, float32 or float16')
+
+  from ensemble_utils import ENSEMBLE_QUANTILES, check_quantiles
+  quantiles = ENSEMBLE_QUANTILES if args.quantiles is None else args.quantiles
+
+  try:
+    check_quantiles(quantiles)
+  except ValueError as e:
+    raise SystemExit(str(e))
+
+  compression_threads = args.compression_threads or max(1, os.cpu_count() // args.workers)
+
+  file_paths = list_granules(args.inputs)
+  print(f'predicting {len(file_paths)} granules with {args.workers} workers')
+
+  start = time.perf_counter()
+
+  # fan the granules out over the worker processes, each of them loads the model once
+  with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.models_dir, args.precision, args.cache_dir, args.ensemble, quantiles)) as executor:
+    futures = [executor.submit(predict_file, file_path, args.output_dir, args.lat_bounds, args.lon_bounds, compression_threads, args.least_significant_digit) for file_path in file_paths]
+
+    records = []
+    for future in futures:
+      record = future.result()
+      if 'profile' in record:
+        profiler.merge(record.pop('profile'))
+      records.append(record)
+      print(f"{record['status']}: {os.path.basename(record['granule'])} ({record['seconds']:.2f}s)")
+
+  # write the run manifest
+  manifest = {
+    'models_dir': args.models_dir,
+    'precision': args.precision,
+    'ensemble': args.ensemble,
+    'quantiles': quantiles if args.ensemble else None,
+    'least_significant_digit': args.least_significant_digit,
+    'lat_bounds': args.lat_bounds,
+    'lon_bounds': args.lon_bounds,
+    'workers': args.workers,
+    'seconds': time.perf_counter() - start,
+    'n_granules': len(records),
+    'n_failed': sum(record['status'] == 'failed' for record in records),
+    'granules': records
+  }
+
+  with open(os.path.join(args.output_dir, 'manifest.json'), 'w') as f:
+    json.dump(manifest, f, indent=2)
+
+  print(f"done in {manifest['seconds']:.2f}s, {manifest['n_failed']} failed")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from constants import *
+from feature_store import open_feature_store
+from sweep_utils import grid_search, random_search, run_sweep
+
+'''
+Sweep the hyperparameters of the MLP trained in 03_train_sea_ann.py.
+
+The trials are ranked on a validation split held out of the training split, the test split is left untouched.
+The trials run concurrently in worker processes. By default each worker gets one thread, so as many trials
+as there are CPU cores run at the same time. The results are appended to the models/sweep_results.db SQLite table:
+  sqlite3 models/sweep_results.db "SELECT config, val_mse, val_mae, seconds FROM trials ORDER BY val_mse LIMIT 10"
+
+Example:
+  python 06_sweep_hyperparameters.py --search random --trials 40 --workers 8 --threads 1 --max-seconds 600
+'''
+
+# the hyperparameter values to search
+SEARCH_SPACE = {
+  'layers': [(20, 10), (32, 16), (64, 32), (20,), (32, 16, 8)],
+  'activation': ['sigmoid', 'relu', 'tanh'],
+  'learning_rate': [0.01, 0.003, 0.001, 0.0003],
+  'batch_size': [1000, 4000, 8000],
+  'optimizer': ['adam', 'rmsprop', 'sgd'],
+  'epochs': [1600]
+}
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Sweep the hyperparameters of the MLP.')
+  parser.add_argument('--search', choices=['grid', 'random'], default='random', help='grid search or random search of the search space')
+  parser.add_argument('--trials', type=int, default=20, help='number of trials of the random search')
+  parser.add_argument('--seed', type=int, default=None, help='seed of the random search')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of trials run concurrently')
+  parser.add_argument('--threads', type=int, default=1, help='number of threads of each trial')
+  parser.add_argument('--max-seconds', type=float, default=3600, help='maximum time of each trial, including the reading of the data and the building of the model')
+  parser.add_argument('--db', default=f'{MODELS_DIR}/{SWEEP_RESULTS_FILENAME}', help='path of the SQLite results table')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  # Create the models directory if it doesn't exist
+  if not os.path.exists(MODELS_DIR):
+    os.makedirs(MODELS_DIR)
+
+  if args.search == 'grid':
+    configs = grid_search(SEARCH_SPACE)
+  else:
+    configs = random_search(SEARCH_SPACE, args.trials, args.seed)
+
+  print(f'running {len(configs)} trials with {args.workers} workers of {args.threads} threads')
+
+  # build the feature store once, before the workers memory-map it
+  store_dir = f'{DATA_DIR}/{FEATURE_STORE_DIRNAME}'
+  open_feature_store(f'{DATA_DIR}/{DATA_FILENAME_GMI_DPR_RR}', store_dir)
+
+  results = run_sweep(configs,
+    store_dir = store_dir,
+    db_path = args.db,
+    workers = args.workers,
+    threads_per_trial = args.threads,
+    max_seconds = args.max_seconds)
+
+  # the best trial
+  results = [result for result in results if result['status'] == 'ok']
+  if results:
+    best = min(results, key=lambda result: result['val_mse'])
+    print(f"best trial: {best['config']} val_mse={best['val_mse']:.4f} val_mae={best['val_mae']:.4f}")
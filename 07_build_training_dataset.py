@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from constants import *
+from dataset_utils import pair_granules, build_dataset, MATCH_MAX_DISTANCE_KM
+
+'''
+Build a training dataset from local directories of 1C GMI and 2B-CMB radar granules.
+
+The GMI TBs are matched with the radar surface rain rates orbit by orbit in parallel worker processes, only the
+pixels over ocean with rain are kept, and the matched pixels are appended to a chunked NetCDF file with the same
+'tb' and 'rr' variables as the training dataset used by 03_train_sea_ann.py.
+
+Example:
+  python 07_build_training_dataset.py data/gmi data/cmb --workers 8
+'''
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Build a training dataset from GMI and radar rain rate orbits.')
+  parser.add_argument('gmi_dir', help='directory of the 1C GMI granules')
+  parser.add_argument('radar_dir', help='directory of the 2B-CMB radar granules')
+  parser.add_argument('--output', default=f'{DATA_DIR}/{DATA_FILENAME_GMI_CMB_RR}', help='path of the NetCDF training dataset')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+  parser.add_argument('--max-distance-km', type=float, default=MATCH_MAX_DISTANCE_KM, help='maximum distance between matched GMI and radar pixels')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  pairs = pair_granules(args.gmi_dir, args.radar_dir)
+  print(f'matching {len(pairs)} orbits with {args.workers} workers')
+
+  n_pixels, failed = build_dataset(pairs, args.output, args.workers, args.max_distance_km)
+
+  print(f'{n_pixels} pixels written to {args.output}, {len(failed)} orbits failed')
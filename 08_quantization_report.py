@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import numpy as np
+
+from constants import *
+from feature_store import open_feature_store
+from numpy_mlp import NumpyMLP
+from quantize_utils import quantize_mlp, load_variant, evaluate_variants, CALIBRATION_PIXELS
+
+'''
+Build the int8 post-training quantized model and report the accuracy of the reduced-precision inference variants.
+
+The int8 model is calibrated on a sample of the training split and written next to the exported NumPy model.
+The float64 (full precision), float32, float16 and int8 variants then predict the held-out test split made by
+split_dataset, and the report gives for each of them the MAE/RMSE against the observed rain rates and against the
+full precision predictions, the throughput in pixels per second and the size of the stored weights.
+
+The float16 and int8 variants are accuracy simulations: NumPy has no float16 or int8 matrix multiplication kernels,
+so they are slower than float32 and don't use less memory at runtime (see quantize_utils). The report tells how
+much accuracy reduced-precision inference would lose, float32 remains the variant to predict with.
+
+The model must have been exported for the NumPy inference engine first (03_train_sea_ann.py or numpy_mlp.py).
+
+Example:
+  python 08_quantization_report.py --output models/quantization_report.json
+'''
+
+# the inference variants of the report, the first one is the full precision reference
+VARIANTS = ['float64', 'float32', 'float16', 'int8']
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Quantize the MLP to int8 and report the accuracy of the reduced-precision variants.')
+  parser.add_argument('--models-dir', default=MODELS_DIR, help='directory of the exported NumPy model')
+  parser.add_argument('--calibration-pixels', type=int, default=CALIBRATION_PIXELS, help='number of training pixels used to calibrate the int8 model')
+  parser.add_argument('--output', default=f'{MODELS_DIR}/{QUANTIZATION_REPORT_FILENAME}', help='path of the JSON report')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  numpy_model_path = f'{args.models_dir}/{NUMPY_MODEL_FILENAME}'
+  int8_model_path = f'{args.models_dir}/{INT8_MODEL_FILENAME}'
+
+  # the same split as in 03_train_sea_ann.py
+  store = open_feature_store(f'{DATA_DIR}/{DATA_FILENAME_GMI_DPR_RR}', f'{DATA_DIR}/{FEATURE_STORE_DIRNAME}')
+  X_train, y_train = store.train()
+  X_test, y_test = store.test()
+
+  # calibrate the int8 quantization on an evenly spaced sample of the training split
+  step = max(1, len(X_train) // args.calibration_pixels)
+  quantize_mlp(NumpyMLP(numpy_model_path, precision='float64'), X_train[::step], int8_model_path, source_path=numpy_model_path)
+
+  variants = {precision: load_variant(precision, numpy_model_path, int8_model_path) for precision in VARIANTS}
+  report = evaluate_variants(variants, X_test, y_test, reference=VARIANTS[0])
+
+  print(f'{len(X_test)} test pixels')
+  print(f"{'precision':>10} {'MAE':>8} {'RMSE':>8} {'MAE ref':>10} {'max ref':>10} {'pixels/s':>12} {'vs f32':>7} {'bytes':>7}")
+  for precision, result in report.items():
+    print(f"{precision:>10} {result['truth']['mae']:8.4f} {result['truth']['rmse']:8.4f} "
+      f"{result['vs_reference']['mae']:10.2e} {result['vs_reference']['max_abs_error']:10.2e} "
+      f"{result['pixels_per_second']:12.0f} {result['relative_throughput']:7.2f} {result['model_bytes']:7d}")
+  print('float16 and int8 simulate the accuracy of reduced-precision inference, NumPy computes them slower than float32')
+
+  with open(args.output, 'w') as f:
+    json.dump({
+      'n_test_pixels': len(X_test),
+      'calibration_pixels': len(X_train[::step]),
+      'note': 'float16 and int8 are accuracy simulations, NumPy has no float16 or int8 kernels so they are slower than float32',
+      'variants': report
+    }, f, indent=2)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+
+from constants import *
+from service_utils import serve, HOST, PORT, MAX_BATCH_PIXELS, BATCH_DEADLINE, GRANULE_WORKERS
+
+'''
+Run the local prediction service: the model is loaded once and the predictions of concurrent requests are merged into micro-batches.
+
+Example:
+  python 09_prediction_service.py --port 8765
+  curl -s localhost:8765/predict -d '{"tb": [[180.1, 110.3, 210.5, 160.2, 235.7, 240.1, 195.3, 260.8, 245.2, 270.1, 255.4, 265.3, 262.1]]}'
+  curl -s localhost:8765/predict_granule -d '{"path": "data/1C-R.GPM.GMI.XCAL2016-C.20200916-S130832-E144106.037225.V07A.HDF5", "lat_bounds": [30, 45], "lon_bounds": [10, 25], "output": "predictions/MLP-RR.037225.HDF5"}'
+  curl -s localhost:8765/stats
+'''
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Serve the surface precipitation predictions of the trained model.')
+  parser.add_argument('--models-dir', default=MODELS_DIR, help='directory of the trained model')
+  parser.add_argument('--precision', default='float32', choices=['float64', 'float32', 'float16', 'int8'], help='precision of the NumPy inference engine, float16 and int8 simulate the accuracy of reduced precision and are slower than float32')
+  parser.add_argument('--host', default=HOST, help='host the service listens on')
+  parser.add_argument('--port', type=int, default=PORT, help='port the service listens on')
+  parser.add_argument('--unix-socket', default=None, help='listen on this unix socket path rather than on a TCP port')
+  parser.add_argument('--max-batch-pixels', type=int, default=MAX_BATCH_PIXELS, help='maximum number of pixels of a micro-batch')
+  parser.add_argument('--deadline-ms', type=float, default=BATCH_DEADLINE * 1000, help='maximum time a request waits for its micro-batch to fill up')
+  parser.add_argument('--granule-workers', type=int, default=GRANULE_WORKERS, help='number of threads reading granules')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  asyncio.run(serve(
+    models_dir = args.models_dir,
+    host = args.host,
+    port = args.port,
+    unix_socket = args.unix_socket,
+    precision = args.precision,
+    max_batch_pixels = args.max_batch_pixels,
+    deadline = args.deadline_ms / 1000,
+    granule_workers = args.granule_workers))
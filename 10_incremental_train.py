@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+from constants import *
+from feature_store import open_feature_store
+from model_utils import load_scaler, save_scaler, update_scaler, rescale_model, standardize, fuse_scaler
+from train_utils import load_training_data, split_dataset, sample_rows, next_version_dir, make_dataset
+from profile_utils import profile_stage
+
+'''
+Fine-tune the trained model on new orbits instead of training a new model from scratch.
+
+The existing model and its saved scaler statistics are loaded, and the statistics are updated with the training
+split of the new data only (the statistics of the old data are not recomputed). The first layer of the model is
+adapted to the updated statistics so that the model predicts the same rain rates as before the update, and the model
+is then fine-tuned with a lower learning rate on the new data, optionally mixed with a random sample of the old
+training data so that it doesn't forget the orbits it was trained on (replay).
+
+The new data are NetCDF datasets with the 'tb' and 'rr' variables of the training dataset, e.g. built with
+07_build_training_dataset.py, and are split with split_dataset like the original dataset.
+
+The fine-tuned model is written into a new version directory (models/versions/v001, v002, ...) with its scaler
+statistics, its NumPy inference engine export and a description of how it was trained, so the previous model is
+never overwritten. The version only replaces the models used for prediction with --promote.
+
+Example:
+  python 10_incremental_train.py data/dataset_GMI_CMB_RR.nc --replay-fraction 0.5 --promote
+'''
+
+# the learning rate of the fine-tuning (10 times lower than the one of 03_train_sea_ann.py)
+LEARNING_RATE = 0.0001
+
+# the maximum number of epochs of the fine-tuning and the number of epochs without improvement after which it stops
+EPOCHS = 200
+PATIENCE = 20
+
+# the number of training examples per iteration
+BATCH_SIZE = 8000
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Fine-tune the trained model on new orbits.')
+  parser.add_argument('new_data', nargs='+', help='NetCDF datasets of the new orbits')
+  parser.add_argument('--base', default=MODELS_DIR, help=f'directory of the model to fine-tune ({MODEL_FILENAME} and {SCALER_FILENAME}), e.g. a version directory')
+  parser.add_argument('--replay-data', default=f'{DATA_DIR}/{DATA_FILENAME_GMI_DPR_RR}', help='NetCDF dataset the replayed old pixels are drawn from')
+  parser.add_argument('--replay-fraction', type=float, default=0.5, help='number of replayed old training pixels as a fraction of the new training pixels (0 for no replay)')
+  parser.add_argument('--learning-rate', type=float, default=LEARNING_RATE, help='learning rate of the fine-tuning')
+  parser.add_argument('--epochs', type=int, default=EPOCHS, help='maximum number of epochs of the fine-tuning')
+  parser.add_argument('--seed', type=int, default=None, help='seed of the replay sample')
+  parser.add_argument('--promote', action='store_true', help='also copy the new version into the models directory used for prediction')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  import tensorflow as tf
+  from tensorflow.keras.callbacks import EarlyStopping
+  from numpy_mlp import NumpyMLP, export_npz, verify_export
+
+  # the new data, split as the original dataset
+  with profile_stage('read'):
+    splits = [split_dataset(*load_training_data(filepath)) for filepath in args.new_data]
+
+  X_train = np.concatenate([split[0] for split in splits])
+  X_test = np.concatenate([split[1] for split in splits])
+  y_train = np.concatenate([split[2] for split in splits])
+  y_test = np.concatenate([split[3] for split in splits])
+  n_new = len(X_train)
+  print(f'{n_new} new training pixels, {len(X_test)} new test pixels')
+
+  # update the scaler statistics with the new training pixels only
+  old_scaler = load_scaler(f'{args.base}/{SCALER_FILENAME}')
+  scaler = update_scaler(old_scaler, X_train)
+
+  # load the model and adapt its first layer to the updated statistics
+  model = tf.keras.models.load_model(f'{args.base}/{MODEL_FILENAME}')
+  rescale_model(model, old_scaler, scaler)
+
+  # mix a random sample of the old training pixels into the new training pixels
+  n_replay = int(args.replay_fraction * n_new)
+  if n_replay > 0:
+    replay_filepath = args.replay_data
+    store = open_feature_store(replay_filepath, os.path.splitext(replay_filepath)[0] + '.store')
+    X_replay, y_replay = sample_rows(*store.train(), n_replay, args.seed)
+    n_replay = len(X_replay)
+
+    X_train = np.concatenate([X_train, X_replay])
+    y_train = np.concatenate([y_train, y_replay])
+    print(f'{len(X_replay)} replayed old training pixels')
+
+  X_train_scaled = standardize(X_train, scaler)
+  X_test_scaled = standardize(X_test, scaler)
+
+  # the validation loss of the model before the fine-tuning
+  model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate), loss='mean_squared_error', metrics=['mae'])
+  before = model.evaluate(make_dataset(X_test_scaled, y_test, BATCH_SIZE), verbose=0)
+
+  # fine-tune the model
+  with profile_stage('train', len(X_train_scaled)):
+    history = model.fit(
+      make_dataset(X_train_scaled, y_train, BATCH_SIZE, shuffle=True),
+      epochs = args.epochs,
+      validation_data = make_dataset(X_test_scaled, y_test, BATCH_SIZE),
+      callbacks = [EarlyStopping(monitor='val_loss', patience=PATIENCE, restore_best_weights=True)])
+
+  after = model.evaluate(make_dataset(X_test_scaled, y_test, BATCH_SIZE), verbose=0)
+  print(f'new test data: mse {before[0]:.4f} -> {after[0]:.4f}, mae {before[1]:.4f} -> {after[1]:.4f}')
+
+  # write the new version
+  version_dir = next_version_dir(f'{MODELS_DIR}/{MODEL_VERSIONS_DIRNAME}')
+  os.makedirs(version_dir)
+
+  with profile_stage('save'):
+    model.save(f'{version_dir}/{MODEL_FILENAME}')
+    save_scaler(scaler, f'{version_dir}/{SCALER_FILENAME}')
+    fuse_scaler(model, scaler).save(f'{version_dir}/{FUSED_MODEL_FILENAME}')
+    export_npz(model, f'{version_dir}/{NUMPY_MODEL_FILENAME}', scaler)
+
+  verify_export(model, NumpyMLP(f'{version_dir}/{NUMPY_MODEL_FILENAME}'), X_test, scaler)
+
+  model_info = {
+    'version': os.path.basename(version_dir),
+    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'base': os.path.abspath(args.base),
+    'new_data': [os.path.abspath(filepath) for filepath in args.new_data],
+    'replay_data': os.path.abspath(args.replay_data) if n_replay > 0 else None,
+    'n_new_train_pixels': n_new,
+    'n_replay_pixels': n_replay,
+    'n_samples_seen': scaler['n_samples_seen'],
+    'learning_rate': args.learning_rate,
+    'epochs': len(history.history['loss']),
+    'new_test_mse_before': before[0],
+    'new_test_mae_before': before[1],
+    'new_test_mse': after[0],
+    'new_test_mae': after[1]
+  }
+
+  with open(f'{version_dir}/{MODEL_INFO_FILENAME}', 'w') as f:
+    json.dump(model_info, f, indent=2)
+
+  print(f'model version written into {version_dir}')
+
+  # use the new version for prediction
+  if args.promote:
+    for filename in [MODEL_FILENAME, SCALER_FILENAME, FUSED_MODEL_FILENAME, NUMPY_MODEL_FILENAME, MODEL_INFO_FILENAME]:
+      shutil.copyfile(f'{version_dir}/{filename}', f'{MODELS_DIR}/{filename}')
+
+    # the int8 model of the previous model is out of date, it is quantized again by 08_quantization_report.py
+    if os.path.exists(f'{MODELS_DIR}/{INT8_MODEL_FILENAME}'):
+      os.remove(f'{MODELS_DIR}/{INT8_MODEL_FILENAME}')
+
+    print(f'{os.path.basename(version_dir)} promoted to {MODELS_DIR}')
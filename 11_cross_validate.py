@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import numpy as np
+
+from constants import *
+from cv_utils import assign_folds, cross_validate, FOLD_METHODS
+from feature_store import open_feature_store
+
+'''
+Cross-validate the MLP trained in 03_train_sea_ann.py with k folds trained concurrently.
+
+The single even/odd split of split_dataset gives one estimate of the skill of the model, the cross-validation gives
+the MSE/MAE of each fold and their mean and standard deviation. By default the folds are contiguous blocks of the
+dataset (see cv_utils) and the k folds run at the same time, each with an equal share of the CPU cores.
+
+Example:
+  python 11_cross_validate.py --folds 5 --method block --output models/cv_block.json
+  python 11_cross_validate.py data/dataset_GMI_CMB_RR.nc --folds 5 --method orbit
+'''
+
+# the hyperparameters of the model trained in 03_train_sea_ann.py
+CONFIG = {
+  'layers': (20, 10),
+  'activation': 'sigmoid',
+  'learning_rate': 0.001,
+  'optimizer': 'adam',
+  'batch_size': 8000,
+  'epochs': 1600
+}
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Cross-validate the MLP with folds trained concurrently.')
+  parser.add_argument('data', nargs='?', default=f'{DATA_DIR}/{DATA_FILENAME_GMI_DPR_RR}', help='NetCDF training dataset')
+  parser.add_argument('--folds', type=int, default=5, help='number of folds')
+  parser.add_argument('--method', default='block', choices=FOLD_METHODS, help='how the pixels are assigned to the folds')
+  parser.add_argument('--seed', type=int, default=None, help='seed of the random folds')
+  parser.add_argument('--epochs', type=int, default=CONFIG['epochs'], help='maximum number of epochs of each fold')
+  parser.add_argument('--workers', type=int, default=None, help='number of concurrent folds (default: all the folds)')
+  parser.add_argument('--threads', type=int, default=None, help='number of threads of each fold (default: the CPU cores shared by the workers)')
+  parser.add_argument('--output', default=None, help='path of the JSON report')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  # each fold is early stopped on the next fold and trained on the others
+  if args.folds < 3:
+    raise SystemExit('the cross-validation needs at least 3 folds')
+
+  workers = args.workers or args.folds
+  threads = args.threads or max(1, os.cpu_count() // workers)
+
+  # the workers memory-map the same feature store
+  store_dir = os.path.splitext(args.data)[0] + '.store'
+  store = open_feature_store(args.data, store_dir)
+
+  folds = assign_folds(store, args.folds, args.method, args.seed)
+  config = dict(CONFIG, epochs=args.epochs)
+
+  print(f'{args.folds} {args.method} folds of {np.bincount(folds).tolist()} pixels, {workers} workers of {threads} threads')
+
+  results, summary = cross_validate(store_dir, folds, config, workers, threads)
+
+  print(f"mse {summary['mean_mse']} (std {summary['std_mse']}), mae {summary['mean_mae']} (std {summary['std_mae']})")
+  print(f"{summary['wall_seconds']:.1f}s wall time for {summary['fold_seconds']:.1f}s of fold training")
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'data': args.data, 'method': args.method, 'config': config, 'folds': results, 'summary': summary}, f, indent=2)
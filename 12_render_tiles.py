@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import argparse
+import functools
+import glob
+import os
+
+from constants import *
+from output_utils import read_prediction, PREDICTION_FILE_PREFIX
+from tile_utils import build_pyramid, MIN_ZOOM, MAX_ZOOM, TILE_MAX_DISTANCE_KM
+
+'''
+Render predicted or retrieved rain rates, or a TB channel, into an XYZ web mercator tile pyramid for interactive browsing.
+
+The swaths of all the given files are composited into the pyramid <tiles dir>/<layer>/z/x/y.png. Running the script
+again after adding granules only renders the tiles that the new granules touch, and only reads the granules whose
+size or modification time changed and the ones sharing a tile with them.
+
+The sources are:
+  predictions  the HDF5 predictions written by 05_batch_predict_precipitation.py (the rain rate, or with --variable
+               any other layer of the ensemble predictions, e.g. the rr_std spread)
+  gprof        the surface precipitation of 2A GPROF granules
+  tb           a channel (0 to 12, in the order of the model input) of the TBs of 1C GMI granules
+
+Example:
+  python 12_render_tiles.py predictions/ --source predictions --workers 8
+  python 12_render_tiles.py data/1C-R.GPM.GMI.*.HDF5 --source tb --channel 7 --layer tb_89v
+'''
+
+# the default layer name and color axis range of each source
+SOURCES = {
+  'predictions': {'layer': 'rr', 'vmin': 0, 'vmax': 40},
+  'gprof': {'layer': 'rr_gprof', 'vmin': 0, 'vmax': 40},
+  'tb': {'layer': 'tb', 'vmin': 130, 'vmax': 300}
+}
+
+
+def list_files(inputs, source):
+  ''' List the files given as directories and/or glob patterns. '''
+
+  file_paths = set()
+
+  for path in inputs:
+    if os.path.isdir(path):
+      file_paths.update(glob.glob(os.path.join(path, f'{PREDICTION_FILE_PREFIX}*.HDF5' if source == 'predictions' else '*.HDF5')))
+    else:
+      file_paths.update(glob.glob(path))
+
+  return sorted(file_paths)
+
+
+def read_swath(file_path, source, channel, variable, lat_bounds, lon_bounds):
+  ''' Read the latitude, longitude and values of the swath of a file, or None if it doesn't cross the area of interest. '''
+
+  if source == 'predictions':
+    data = read_prediction(file_path, lat_bounds, lon_bounds)
+    return {'lat': data['lat'], 'lon': data['lon'], 'values': data[variable]} if data else None
+
+  if source == 'gprof':
+    from gmi_utils import read_granule
+
+    data = read_granule(file_path, ['S1/Latitude', 'S1/Longitude', 'S1/surfacePrecipitation'], lat_bounds, lon_bounds)
+    return {'lat': data['S1/Latitude'], 'lon': data['S1/Longitude'], 'values': data['S1/surfacePrecipitation']} if data else None
+
+  from gmi_utils import read_tb
+
+  tb_input = read_tb(file_path, lat_bounds, lon_bounds)
+  if tb_input is None:
+    return None
+
+  lat, lon, TB = tb_input
+  return {'lat': lat, 'lon': lon, 'values': TB[:, :, channel]}
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Render swaths into an XYZ web mercator tile pyramid.')
+  parser.add_argument('inputs', nargs='+', help='directories and/or glob patterns of the files to render')
+  parser.add_argument('--source', default='predictions', choices=list(SOURCES), help='kind of the files to render')
+  parser.add_argument('--channel', type=int, default=7, help='TB channel rendered from the 1C GMI granules (0 to 12)')
+  parser.add_argument('--variable', default='rr', help='layer of the predictions rendered, e.g. rr_std or rr_q95 of ensemble predictions')
+  parser.add_argument('--layer', default=None, help='name of the pyramid (default: the name of the source)')
+  parser.add_argument('--tiles-dir', default=TILES_DIR, help='directory of the pyramids')
+  parser.add_argument('--zooms', type=int, nargs=2, default=[MIN_ZOOM, MAX_ZOOM], help='minimum and maximum zoom levels')
+  parser.add_argument('--vmin', type=float, default=None, help='minimum of the color axis')
+  parser.add_argument('--vmax', type=float, default=None, help='maximum of the color axis')
+  parser.add_argument('--max-distance-km', type=float, default=TILE_MAX_DISTANCE_KM, help='maximum distance between a tile pixel and its swath pixel')
+  parser.add_argument('--lat-bounds', type=float, nargs=2, default=None, help='latitude bounds of the area of interest (default: full granules)')
+  parser.add_argument('--lon-bounds', type=float, nargs=2, default=None, help='longitude bounds of the area of interest (default: full granules)')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  defaults = SOURCES[args.source]
+  layer = args.layer or (args.variable if args.source == 'predictions' else defaults['layer'])
+  vmin = defaults['vmin'] if args.vmin is None else args.vmin
+  vmax = defaults['vmax'] if args.vmax is None else args.vmax
+
+  file_paths = list_files(args.inputs, args.source)
+
+  # the swaths are only read for the files that changed since the last run and the ones sharing a tile with them
+  read_params = {'source': args.source, 'channel': args.channel, 'variable': args.variable, 'lat_bounds': args.lat_bounds, 'lon_bounds': args.lon_bounds}
+  read = functools.partial(read_swath,
+    source = args.source,
+    channel = args.channel,
+    variable = args.variable,
+    lat_bounds = args.lat_bounds,
+    lon_bounds = args.lon_bounds)
+
+  print(f'rendering {len(file_paths)} files into {args.tiles_dir}/{layer} (zoom {args.zooms[0]} to {args.zooms[1]})')
+
+  counts = build_pyramid(file_paths, read, f'{args.tiles_dir}/{layer}',
+    vmin = vmin,
+    vmax = vmax,
+    zooms = range(args.zooms[0], args.zooms[1] + 1),
+    max_distance_km = args.max_distance_km,
+    workers = args.workers,
+    read_params = read_params)
+
+  print(f"{counts['read']} files read, {counts['rendered']} tiles rendered, {counts['unchanged']} unchanged, {counts['deleted']} deleted")
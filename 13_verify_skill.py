@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import time
+
+from constants import *
+from dataset_utils import pair_granules
+from verify_utils import verify, REGIONS, RAIN_THRESHOLDS, GPROF_FILE_PATTERN
+
+'''
+Verify the skill of the model against the GPROF surface precipitation of many orbits, in the full granules and in
+the areas of interest.
+
+The 1C GMI and 2A GPROF granules of the same orbits are paired from their directories, and the predictions of the
+model are compared with the GPROF rain rates pixel by pixel (see verify_utils). The report gives for each region the
+bias, MAE, RMSE and correlation of the predictions, and the POD, FAR and CSI at each rain rate threshold.
+
+Example:
+  python 13_verify_skill.py data/ data/ --workers 8 --output models/skill_gprof.json
+  python 13_verify_skill.py gmi/ gprof/ --predictions-dir predictions/ --region storm 30 45 10 25
+'''
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Verify the predictions of the model against the GPROF surface precipitation.')
+  parser.add_argument('tb_dir', nargs='?', default=DATA_DIR, help='directory of the 1C GMI granules')
+  parser.add_argument('gprof_dir', nargs='?', default=DATA_DIR, help='directory of the 2A GPROF granules')
+  parser.add_argument('--predictions-dir', default=None, help='read the predictions of the granules from the prediction files of this directory when they exist (default: predict every granule)')
+  parser.add_argument('--models-dir', default=MODELS_DIR, help='directory of the trained model')
+  parser.add_argument('--precision', default='float32', choices=['float64', 'float32', 'float16', 'int8'], help='precision of the NumPy inference engine, float16 and int8 simulate the accuracy of reduced precision and are slower than float32')
+  parser.add_argument('--regions', nargs='*', default=list(REGIONS), choices=list(REGIONS), help='named regions to verify')
+  parser.add_argument('--region', nargs=5, action='append', default=[], metavar=('NAME', 'LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'), help='also verify this bounding box (can be repeated)')
+  parser.add_argument('--thresholds', type=float, nargs='+', default=list(RAIN_THRESHOLDS), help='rain rate thresholds in mm/h of the POD, FAR and CSI')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+  parser.add_argument('--output', default=None, help='path of the JSON report')
+
+  return parser.parse_args()
+
+
+def print_report(metrics):
+  ''' Print the skill scores of each region. '''
+
+  for name, region in metrics.items():
+    if region['n'] == 0:
+      print(f'{name}: no verified pixels')
+      continue
+
+    correlation = region['correlation'] if region['correlation'] is not None else float('nan')
+    print(f"{name}: {region['n']} pixels, bias {region['bias']:.3f}, mae {region['mae']:.3f}, rmse {region['rmse']:.3f}, correlation {correlation:.3f}")
+
+    for threshold, scores in region['thresholds'].items():
+      print(f'  >= {threshold} mm/h: ' + ', '.join(f"{score} {scores[score]:.3f}" if scores[score] is not None else f'{score} -' for score in ['pod', 'far', 'csi']))
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  regions = {name: REGIONS[name] for name in args.regions}
+  for name, lat_min, lat_max, lon_min, lon_max in args.region:
+    regions[name] = ([float(lat_min), float(lat_max)], [float(lon_min), float(lon_max)])
+
+  pairs = pair_granules(args.tb_dir, args.gprof_dir, GMI_TB_FILE_PATTERN, GPROF_FILE_PATTERN)
+  print(f'verifying {len(pairs)} orbits in {len(regions)} regions with {args.workers} workers')
+
+  start = time.perf_counter()
+  accumulators, records = verify(pairs, regions, args.thresholds, args.models_dir, args.precision, args.predictions_dir, args.workers)
+  seconds = time.perf_counter() - start
+
+  metrics = {name: accumulator.metrics() for name, accumulator in accumulators.items()}
+  print_report(metrics)
+
+  n_failed = sum(record['status'] == 'failed' for record in records)
+  print(f'done in {seconds:.2f}s, {n_failed} failed')
+
+  if args.output:
+    report = {
+      'models_dir': args.models_dir,
+      'precision': args.precision,
+      'predictions_dir': args.predictions_dir,
+      'regions': regions,
+      'thresholds': args.thresholds,
+      'seconds': seconds,
+      'n_granules': len(records),
+      'n_failed': n_failed,
+      'metrics': metrics,
+      'granules': records
+    }
+
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
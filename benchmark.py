@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+import h5py
+import numpy as np
+
+from constants import *
+from gmi_utils import mask_missing, read_tb
+from model_utils import fit_scaler, standardize
+from numpy_mlp import NumpyMLP
+from predict_utils import predict_swath
+from synthetic_utils import make_granule_tb, make_granule_precipitation, make_random_model
+
+'''
+Benchmark each stage of the prediction pipeline on synthetic GMI granules.
+
+Synthetic 1C and 2A granules with the real group layout are generated for each of the given scan counts, and the
+pipeline stages are timed on them:
+  read         read the S1/S2 geolocation and TB datasets of the full granule
+  mask         NaN the -9999.9 missing values
+  concatenate  merge the S1 and S2 TBs into the 13 channels model input
+  scale        standardize the TBs (only needed by the models without the scaling folded in)
+  predict      stream the swath through the NumPy inference engine
+  read_bbox    read the model input of the Ionian Sea area of interest only
+  read_rr      read the 2A surface precipitation of the full granule
+  plot_rr      render the predictions of the area of interest into an image file (with --plot)
+
+The throughput (pixels per second) and the peak memory allocated by each stage are reported as JSON so that runs
+can be compared. The model is the trained NumPy engine model if given, otherwise a model with random weights.
+
+Example:
+  python benchmark.py --scans 500 2963 --repeat 3 --output bench.json
+'''
+
+
+def measure(stage, n_pixels, results):
+  ''' Time a stage and record its throughput and the peak memory it allocated. '''
+
+  def wrapper(function, *args, **kwargs):
+    tracemalloc.reset_peak()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    value = function(*args, **kwargs)
+
+    seconds = time.perf_counter() - start
+    results[stage] = {
+      'seconds': seconds,
+      'pixels_per_second': n_pixels / seconds if seconds > 0 else None,
+      'peak_memory_bytes': tracemalloc.get_traced_memory()[1] - memory_start
+    }
+
+    return value
+
+  return wrapper
+
+
+def read_datasets(file_path, variables):
+  ''' Read the given datasets of a granule in full. '''
+
+  with h5py.File(file_path, 'r') as hf:
+    return {variable: hf[variable][:] for variable in variables}
+
+
+def mask_datasets(data):
+  ''' NaN the missing values of the datasets. '''
+
+  return {variable: mask_missing(values, variable) for variable, values in data.items()}
+
+
+def benchmark_granule(tb_path, rr_path, predict, scaler, plot, output_dir):
+  ''' Run and time the pipeline stages on a granule. '''
+
+  results = {}
+
+  with h5py.File(tb_path, 'r') as hf:
+    n_pixels = hf['S1/Latitude'].size
+
+  data = measure('read', n_pixels, results)(read_datasets, tb_path, ['S1/Latitude', 'S1/Longitude', 'S1/Tc', 'S2/Tc'])
+  data = measure('mask', n_pixels, results)(mask_datasets, data)
+  TB = measure('concatenate', n_pixels, results)(np.concatenate, (data['S1/Tc'], data['S2/Tc']), axis=2)
+  measure('scale', n_pixels, results)(standardize, TB.reshape(-1, TB.shape[2]), scaler)
+  measure('predict', n_pixels, results)(predict_swath, predict, TB)
+
+  bbox_input = measure('read_bbox', n_pixels, results)(read_tb, tb_path, LAT_BOUNDS_IONIAN_SEA, LON_BOUNDS_IONIAN_SEA)
+  measure('read_rr', n_pixels, results)(read_datasets, rr_path, ['S1/Latitude', 'S1/Longitude', 'S1/surfacePrecipitation'])
+
+  if plot:
+    import matplotlib
+    matplotlib.use('Agg')
+    from plot_utils import plot_rr
+
+    lat, lon, TB_bbox = bbox_input
+    rr = predict_swath(predict, TB_bbox)
+
+    measure('plot_rr', n_pixels, results)(plot_rr,
+      RR = rr,
+      lat = lat,
+      lon = lon,
+      lat_bounds = LAT_BOUNDS_IONIAN_SEA,
+      lon_bounds = LON_BOUNDS_IONIAN_SEA,
+      colorAxisMin = 0,
+      colorAxisMax = 40,
+      show = False,
+      filepath = os.path.join(output_dir, 'plot_rr.png'))
+
+  return n_pixels, results
+
+
+def parse_args():
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Benchmark the prediction pipeline stages on synthetic GMI granules.')
+  parser.add_argument('--scans', type=int, nargs='+', default=[2963], help='scan counts of the synthetic granules')
+  parser.add_argument('--repeat', type=int, default=3, help='number of runs for each scan count')
+  parser.add_argument('--missing-fraction', type=float, default=0.01, help='fraction of missing values in the synthetic granules')
+  parser.add_argument('--missing-scan-fraction', type=float, default=0.0, help='fraction of scans without geolocation in the synthetic granules')
+  parser.add_argument('--model', default=None, help='path of a NumPy inference engine model (default: random weights)')
+  parser.add_argument('--plot', action='store_true', help='also benchmark the map rendering')
+  parser.add_argument('--output', default=None, help='path of the JSON report (default: standard output)')
+
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  tracemalloc.start()
+
+  report = {
+    'machine': {
+      'platform': platform.platform(),
+      'processor': platform.processor(),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'cpu_count': os.cpu_count()
+    },
+    'runs': []
+  }
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+
+    # the model and the scaling statistics
+    model_path = args.model
+    if model_path is None:
+      model_path = os.path.join(tmp_dir, 'model.npz')
+      make_random_model(model_path)
+
+    predict = NumpyMLP(model_path).predict
+    scaler = fit_scaler(np.random.default_rng(0).uniform(130, 300, size=(10000, 13)))
+
+    for n_scans in args.scans:
+
+      # the synthetic granules
+      tb_path = os.path.join(tmp_dir, f'1C-R.GPM.GMI.SYNTHETIC.{n_scans}.HDF5')
+      rr_path = os.path.join(tmp_dir, f'2A.GPM.GMI.SYNTHETIC.{n_scans}.HDF5')
+      make_granule_tb(tb_path, n_scans, args.missing_fraction, missing_scan_fraction=args.missing_scan_fraction)
+      make_granule_precipitation(rr_path, n_scans, args.missing_fraction, missing_scan_fraction=args.missing_scan_fraction)
+
+      for repeat in range(args.repeat):
+        n_pixels, stages = benchmark_granule(tb_path, rr_path, predict, scaler, args.plot, tmp_dir)
+        report['runs'].append({'n_scans': n_scans, 'n_pixels': n_pixels, 'repeat': repeat, 'stages': stages})
+
+  # the peak resident memory of the whole benchmark (in kilobytes on Linux)
+  report['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    print(json.dumps(report, indent=2))
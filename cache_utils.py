@@ -0,0 +1,175 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+'''
+A content-addressed on-disk cache of arrays, e.g. the preprocessed 13 channels TBs and the predicted rain rate swaths of granules.
+
+An entry is a set of named arrays stored in an .npz file named after the hash of everything it was computed from:
+the content of the input granule, the model weights and the preprocessing parameters. A granule that is modified,
+a retrained model or a change of the area of interest gives a different key, so an entry never has to be invalidated.
+
+The cache can be used concurrently by several processes:
+  - an entry is written into a temporary file which is atomically renamed into place, so a reader either finds the
+    whole entry or no entry
+  - reading an entry updates its modification time, so the entries are ordered by their last use
+  - the eviction of the least recently used entries when the cache is larger than its maximum size is serialized by
+    an exclusive lock file, and an entry evicted while it is being read is treated as a miss
+
+Hashing a large granule takes time, so the content digest of a file is itself cached by file path, size and
+modification time.
+'''
+
+# the version of the cached entries, bump it when the cached computations change
+CACHE_VERSION = 2
+
+# the maximum size of the cache in bytes
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+# the number of bytes hashed at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path):
+  ''' The SHA-256 digest of the content of a file. '''
+
+  sha256 = hashlib.sha256()
+  with open(file_path, 'rb') as f:
+    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+      sha256.update(chunk)
+
+  return sha256.hexdigest()
+
+
+class ArrayCache:
+  ''' A size-bounded LRU cache of named arrays on disk, safe to share between processes. '''
+
+  def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES):
+
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+
+    os.makedirs(os.path.join(cache_dir, 'entries'), exist_ok=True)
+    os.makedirs(os.path.join(cache_dir, 'digests'), exist_ok=True)
+
+  def digest(self, file_path):
+    ''' The content digest of a file, only hashed again when the file size or modification time changes. '''
+
+    stat = os.stat(file_path)
+    identity = f'{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    digest_path = os.path.join(self.cache_dir, 'digests', hashlib.sha1(identity.encode()).hexdigest())
+
+    try:
+      with open(digest_path) as f:
+        return f.read()
+    except FileNotFoundError:
+      pass
+
+    digest = file_digest(file_path)
+    self._write_atomic(digest_path, lambda f: f.write(digest.encode()))
+
+    return digest
+
+  def key(self, kind, files=(), params=None):
+    ''' The key of an entry of the given kind computed from the content of the files and the parameters. '''
+
+    description = {
+      'version': CACHE_VERSION,
+      'kind': kind,
+      'files': [self.digest(file_path) for file_path in files],
+      'params': params or {}
+    }
+
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+  def _path(self, key):
+    ''' The path of the file of an entry. '''
+
+    return os.path.join(self.cache_dir, 'entries', key[:2], f'{key}.npz')
+
+  def _write_atomic(self, path, write):
+    ''' Write a file through a temporary file in the same directory that is renamed into place. '''
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        write(f)
+      os.replace(tmp_path, path)
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+
+  def get(self, key):
+    ''' The arrays of an entry, or None if the entry is not in the cache. '''
+
+    path = self._path(key)
+
+    try:
+      with np.load(path) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+      # mark the entry as recently used
+      os.utime(path)
+    except (FileNotFoundError, ValueError, OSError):
+      return None
+
+    return arrays
+
+  def put(self, key, arrays):
+    ''' Store the arrays of an entry and evict the least recently used entries if the cache is too large. '''
+
+    self._write_atomic(self._path(key), lambda f: np.savez(f, **arrays))
+    self.evict()
+
+  def entries(self):
+    ''' List the (last use time, size, path) of the entries. '''
+
+    entries = []
+
+    for directory, _, filenames in os.walk(os.path.join(self.cache_dir, 'entries')):
+      for filename in filenames:
+        if not filename.endswith('.npz'):
+          continue
+
+        path = os.path.join(directory, filename)
+        try:
+          stat = os.stat(path)
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    return entries
+
+  def evict(self):
+    ''' Delete the least recently used entries until the cache fits in its maximum size. '''
+
+    with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+
+      entries = sorted(self.entries())
+      total = sum(size for _, size, _ in entries)
+
+      for _, size, path in entries:
+        if total <= self.max_bytes:
+          break
+
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          pass
+        total -= size
+
+  def cached(self, key, compute):
+    ''' The arrays of an entry, computed by the compute function and stored if the entry is not in the cache. '''
+
+    arrays = self.get(key)
+
+    if arrays is None:
+      arrays = compute()
+      self.put(key, arrays)
+
+    return arrays
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+from constants import *
+
+'''
+A single command line interface to the steps of the pipeline (see pipeline.py).
+
+Each subcommand only imports the modules it needs, when it runs: e.g. predict without a figure doesn't import
+TensorFlow, matplotlib or Basemap, so short headless jobs start quickly.
+
+The area of interest is the Ionian Sea by default, or another named area with --aoi, or any bounding box with
+--lat-bounds and --lon-bounds (--aoi full reads the whole granule).
+
+Example:
+  python cli.py download
+  python cli.py map-tb --output figures/fig3_aoi_sea_gmi_v.png figures/fig4_aoi_sea_gmi_h.png
+  python cli.py map-rr data/2A.GPM.GMI.GPROF2021v1.20200916-S130832-E144106.037225.V07A.HDF5 --show
+  python cli.py train --epochs 400 --no-show
+  python cli.py predict data/1C-R.GPM.GMI.XCAL2016-C.20200916-S130832-E144106.037225.V07A.HDF5 --output predictions/MLP-RR.037225.HDF5
+'''
+
+# the named areas of interest
+AOIS = {
+  'ionian-sea': (LAT_BOUNDS_IONIAN_SEA, LON_BOUNDS_IONIAN_SEA),
+  'ida-landfall': (LAT_BOUNDS_IDA_LANDFALL, LON_BOUNDS_IDA_LANDFALL),
+  'full': (None, None)
+}
+
+
+def area_of_interest(args):
+  ''' The latitude and longitude bounds of the area of interest of the command line arguments. '''
+
+  lat_bounds, lon_bounds = AOIS[args.aoi]
+
+  return args.lat_bounds or lat_bounds, args.lon_bounds or lon_bounds
+
+
+def map_bounds(lat_bounds, lon_bounds):
+  ''' Check that a map has a bounding box. '''
+
+  if lat_bounds is None or lon_bounds is None:
+    sys.exit('a map needs a bounding box, give a named --aoi or --lat-bounds and --lon-bounds')
+
+  return lat_bounds, lon_bounds
+
+
+def download(args):
+  ''' Download the data products. '''
+
+  from pipeline import download_products
+
+  failed = download_products(args.data_dir)
+
+  if failed:
+    sys.exit(f'{len(failed)} downloads failed, run the command again to resume them')
+
+
+def map_tb(args):
+  ''' Map the TBs of a 1C GMI granule. '''
+
+  from pipeline import map_tb
+
+  lat_bounds, lon_bounds = map_bounds(*area_of_interest(args))
+
+  try:
+    map_tb(args.granule, lat_bounds, lon_bounds, filepaths=args.output, colorAxisMin=args.vmin, colorAxisMax=args.vmax)
+  except ValueError as e:
+    sys.exit(str(e))
+
+
+def map_rr(args):
+  ''' Map the surface precipitation of a 2A GPROF granule. '''
+
+  from pipeline import map_rr
+
+  lat_bounds, lon_bounds = map_bounds(*area_of_interest(args))
+
+  try:
+    map_rr(args.granule, lat_bounds, lon_bounds,
+      show = args.show or not args.output,
+      filepath = args.output,
+      colorAxisMin = args.vmin,
+      colorAxisMax = args.vmax)
+  except ValueError as e:
+    sys.exit(str(e))
+
+
+def train(args):
+  ''' Train the model. '''
+
+  import warnings
+  warnings.filterwarnings("ignore")
+
+  from pipeline import train_model
+
+  # the hyperparameters that are not given keep the defaults of pipeline.py
+  hyperparameters = {name: getattr(args, name) for name in ['learning_rate', 'epochs', 'patience', 'batch_size'] if getattr(args, name) is not None}
+
+  train_model(args.data, args.models_dir,
+    **hyperparameters,
+    export_fused = not args.no_fused,
+    export_numpy = not args.no_numpy,
+    show = not args.no_show,
+    filepath = args.learning_curves)
+
+
+def predict(args):
+  ''' Predict the surface precipitation of a 1C GMI granule, and write it into a file and/or map it. '''
+
+  import numpy as np
+  from pipeline import predict_precipitation, map_prediction
+
+  lat_bounds, lon_bounds = area_of_interest(args)
+
+  prediction = predict_precipitation(args.granule, lat_bounds, lon_bounds,
+    models_dir = args.models_dir,
+    precision = args.precision,
+    cache_dir = None if args.no_cache else args.cache_dir)
+
+  if prediction is None:
+    sys.exit(f'{args.granule} does not cross the area of interest')
+
+  n_predicted = np.count_nonzero(~np.isnan(prediction['rr']))
+  print(f"{n_predicted} of {prediction['rr'].size} pixels predicted, mean rain rate {np.nanmean(prediction['rr']) if n_predicted else 0:.3f} mm/h")
+
+  # the prediction file has the layout of the 2A GPROF product so it can be mapped with map-rr
+  if args.output:
+    from output_utils import write_prediction
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+      os.makedirs(output_dir)
+    write_prediction(args.output, prediction, {'source_granule': os.path.basename(args.granule), 'precision': args.precision})
+
+  # the figure is only drawn if asked for, so that headless jobs don't import matplotlib and Basemap
+  if args.show or args.figure:
+    lat_bounds, lon_bounds = map_bounds(lat_bounds, lon_bounds)
+    map_prediction(prediction, lat_bounds, lon_bounds, show=args.show, filepath=args.figure)
+
+
+def add_aoi_arguments(parser):
+  ''' Add the area of interest arguments to a subcommand. '''
+
+  parser.add_argument('--aoi', default='ionian-sea', choices=list(AOIS), help='named area of interest')
+  parser.add_argument('--lat-bounds', type=float, nargs=2, default=None, help='latitude bounds of the area of interest (overrides --aoi)')
+  parser.add_argument('--lon-bounds', type=float, nargs=2, default=None, help='longitude bounds of the area of interest (overrides --aoi)')
+
+
+def parse_args(argv=None):
+  ''' Parse the command line arguments. '''
+
+  parser = argparse.ArgumentParser(description='Surface precipitation estimation from GMI TBs with an MLP.')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  subparser = subparsers.add_parser('download', help='download the data products')
+  subparser.add_argument('--data-dir', default=DATA_DIR, help='directory the data products are downloaded into')
+  subparser.set_defaults(run=download)
+
+  subparser = subparsers.add_parser('map-tb', help='map the TBs of a 1C GMI granule')
+  subparser.add_argument('granule', nargs='?', default=f'{DATA_DIR}/{DATA_FILENAME_TB}', help='1C GMI granule')
+  add_aoi_arguments(subparser)
+  subparser.add_argument('--output', nargs=2, default=None, metavar=('V_FILE', 'H_FILE'), help='render the vertical and horizontal polarization maps into these image files instead of showing them')
+  subparser.add_argument('--vmin', type=float, default=130, help='minimum of the color axis')
+  subparser.add_argument('--vmax', type=float, default=300, help='maximum of the color axis')
+  subparser.set_defaults(run=map_tb)
+
+  subparser = subparsers.add_parser('map-rr', help='map the surface precipitation of a 2A GPROF granule')
+  subparser.add_argument('granule', nargs='?', default=f'{DATA_DIR}/{DATA_FILENAME_PRECIPITATION}', help='2A GPROF granule')
+  add_aoi_arguments(subparser)
+  subparser.add_argument('--output', default=None, help='write the map into this image file instead of showing it')
+  subparser.add_argument('--show', action='store_true', help='also show the map when it is written into a file')
+  subparser.add_argument('--vmin', type=float, default=0, help='minimum of the color axis')
+  subparser.add_argument('--vmax', type=float, default=40, help='maximum of the color axis')
+  subparser.set_defaults(run=map_rr)
+
+  subparser = subparsers.add_parser('train', help='train the model')
+  subparser.add_argument('data', nargs='?', default=f'{DATA_DIR}/{DATA_FILENAME_GMI_DPR_RR}', help='NetCDF training dataset')
+  subparser.add_argument('--models-dir', default=MODELS_DIR, help='directory the model is saved into')
+  subparser.add_argument('--learning-rate', type=float, default=None, help='learning rate (default: LEARNING_RATE of pipeline.py)')
+  subparser.add_argument('--epochs', type=int, default=None, help='maximum number of epochs (default: EPOCHS of pipeline.py)')
+  subparser.add_argument('--patience', type=int, default=None, help='number of epochs without improvement of the validation loss after which the training stops (default: PATIENCE of pipeline.py)')
+  subparser.add_argument('--batch-size', type=int, default=None, help='number of training examples per iteration (default: BATCH_SIZE of pipeline.py)')
+  subparser.add_argument('--no-fused', action='store_true', help=f'do not export the model with the scaling folded in ({FUSED_MODEL_FILENAME})')
+  subparser.add_argument('--no-numpy', action='store_true', help=f'do not export the model for the NumPy inference engine ({NUMPY_MODEL_FILENAME})')
+  subparser.add_argument('--learning-curves', default=None, help='write the learning curves into this image file')
+  subparser.add_argument('--no-show', action='store_true', help='do not show the learning curves')
+  subparser.set_defaults(run=train)
+
+  subparser = subparsers.add_parser('predict', help='predict the surface precipitation of a 1C GMI granule')
+  subparser.add_argument('granule', nargs='?', default=f'{DATA_DIR}/{DATA_FILENAME_TB}', help='1C GMI granule')
+  add_aoi_arguments(subparser)
+  subparser.add_argument('--models-dir', default=MODELS_DIR, help='directory of the trained model')
+  subparser.add_argument('--precision', default='float32', choices=['float64', 'float32', 'float16', 'int8'], help='precision of the NumPy inference engine, float16 and int8 simulate the accuracy of reduced precision and are slower than float32')
+  subparser.add_argument('--cache-dir', default=CACHE_DIR, help='directory of the cache of the TBs and predictions')
+  subparser.add_argument('--no-cache', action='store_true', help='do not cache the TBs and predictions')
+  subparser.add_argument('--output', default=None, help='write the prediction into this HDF5 file with the S1 layout of the 2A GPROF product')
+  subparser.add_argument('--figure', default=None, help='map the prediction into this image file')
+  subparser.add_argument('--show', action='store_true', help='show the map of the prediction')
+  subparser.set_defaults(run=predict)
+
+  return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  args.run(args)
@@ -16,6 +16,12 @@ DATA_FILENAME_PRECIPITATION = '2A.GPM.GMI.GPROF2021v1.20200916-S130832-E144106.0
 # this training dataset is built from 10 orbits of March 2014 (i.e. not when the Medicane Ianos occured)
 DATA_FILENAME_GMI_DPR_RR = 'dataset2_GMI_DPR_RR.nc'
 
+# the memory-mapped feature store converted from the training data
+FEATURE_STORE_DIRNAME = 'dataset2_GMI_DPR_RR.store'
+
+# training data built by 07_build_training_dataset.py from local GMI and 2B-CMB orbits
+DATA_FILENAME_GMI_CMB_RR = 'dataset_GMI_CMB_RR.nc'
+
 # urls of the data
 DATA_URLS = [
   f'https://get.ecmwf.int/repository/mooc-machine-learning-weather-climate/tier_3/observations/{DATA_FILENAME_TB}',
@@ -26,12 +32,49 @@ DATA_URLS = [
 # the data directory path relative to the project home folder
 DATA_DIR = "data"
 
+# the directory where the batch predictions are written
+PREDICTIONS_DIR = "predictions"
+
+# the directory of the cache of preprocessed TBs and predictions
+CACHE_DIR = "cache"
+
+# the directory of the XYZ tile pyramids
+TILES_DIR = "tiles"
+
+# filename pattern of the 1C GMI TB granules
+GMI_TB_FILE_PATTERN = '1C-R.GPM.GMI.*.HDF5'
+
 # the models directory
 MODELS_DIR = "models"
 
 # the model filename
 MODEL_FILENAME = 'mlp_model.h5'
 
+# the filename of the hyperparameter sweep results table
+SWEEP_RESULTS_FILENAME = 'sweep_results.db'
+
+# the filename of the best model checkpointed during training
+CHECKPOINT_FILENAME = 'mlp_model_checkpoint.h5'
+
+# the filename of the feature scaling statistics fitted on the training dataset and saved with the model
+SCALER_FILENAME = 'mlp_scaler.npz'
+
+# the directory of the versioned models written by the incremental training (in the models directory)
+MODEL_VERSIONS_DIRNAME = 'versions'
+
+# the filename of the description of a versioned model
+MODEL_INFO_FILENAME = 'model_info.json'
+
+# the filename of the model with the feature scaling folded into its first layer
+FUSED_MODEL_FILENAME = 'mlp_model_fused.h5'
+
+# the filename of the model weights exported for the NumPy inference engine (the feature scaling is folded in)
+NUMPY_MODEL_FILENAME = 'mlp_model.npz'
+
+# the filename of the int8 post-training quantized model and of its accuracy report
+INT8_MODEL_FILENAME = 'mlp_model_int8.npz'
+QUANTIZATION_REPORT_FILENAME = 'quantization_report.json'
+
 # lat and lon bounding box bounds for the Ionian Sea
 # this area is of interest because it captures the Medicane Ianos (a rare Mediterranean hurricane)
 LAT_BOUNDS_IONIAN_SEA = [34, 40]
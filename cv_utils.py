@@ -0,0 +1,209 @@
+import multiprocessing
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from feature_store import split_destination
+
+'''
+Cross-validation of the MLP.
+
+The pixels of the feature store are assigned to k folds and a model is trained for each fold on the pixels of the
+other folds, then evaluated on the pixels of the fold. The early stopping of the training of a fold monitors the
+next fold (fold + 1 modulo k), which is held out of its training pixels, so that the test fold is never seen before
+it is evaluated and the skill estimate is not biased by the choice of the epoch. The folds are built in one of three ways:
+  kfold   the pixels are shuffled and dealt into k folds of equal size
+  block   the pixels are cut into k contiguous blocks in the order of the NetCDF dataset, in which the pixels of an
+          orbit are next to each other, so that neighbouring and strongly correlated pixels are not split between
+          the training and the test pixels
+  orbit   the orbits are dealt into k folds of about the same number of pixels (needs the 'orbit' variable of the
+          datasets built by 07_build_training_dataset.py)
+
+Random folds give an optimistic estimate of the skill of the model because neighbouring pixels of the same scene end
+up on both sides of the split, the blocked folds estimate the skill on unseen scenes.
+
+The folds are trained concurrently in worker processes, each limited to a number of threads so that the folds share
+the CPU cores rather than compete for all of them. The workers memory-map the same feature store.
+'''
+
+# the number of epochs without improvement of the validation loss after which the training of a fold stops
+PATIENCE = 50
+
+# the fold building methods
+FOLD_METHODS = ['kfold', 'block', 'orbit']
+
+
+def kfold_assignment(n, k, seed=None):
+  ''' Assign n pixels to k folds of equal size at random. '''
+
+  folds = np.arange(n) % k
+  np.random.default_rng(seed).shuffle(folds)
+
+  return folds.astype(np.int8)
+
+
+def block_assignment(n, k):
+  ''' Assign n pixels to k contiguous blocks. '''
+
+  return (np.arange(n) * k // n).astype(np.int8)
+
+
+def orbit_assignment(orbits, k):
+  ''' Assign the pixels to k folds by orbit, the orbits with the most pixels are dealt first into the smallest fold. '''
+
+  unique_orbits, inverse, counts = np.unique(orbits, return_inverse=True, return_counts=True)
+
+  if len(unique_orbits) < k:
+    raise ValueError(f'cannot build {k} orbit folds from {len(unique_orbits)} orbits')
+
+  orbit_folds = np.empty(len(unique_orbits), dtype=np.int8)
+  fold_sizes = np.zeros(k, dtype=np.int64)
+
+  for orbit in np.argsort(-counts, kind='stable'):
+    fold = np.argmin(fold_sizes)
+    orbit_folds[orbit] = fold
+    fold_sizes[fold] += counts[orbit]
+
+  return orbit_folds[inverse]
+
+
+def assign_folds(store, k, method='kfold', seed=None):
+  ''' Assign each pixel of the feature store to a fold.
+
+  Returns an array of the fold of each pixel, in the order of the store.
+  '''
+
+  n = len(store.rr)
+
+  if method == 'kfold':
+    return kfold_assignment(n, k, seed)
+
+  if method == 'block':
+    # the blocks are cut in the order of the NetCDF dataset then put in the order of the store
+    folds = np.empty(n, dtype=np.int8)
+    folds[split_destination(np.arange(n), store.n_train)] = block_assignment(n, k)
+    return folds
+
+  if method == 'orbit':
+    if store.orbit is None:
+      raise ValueError('the dataset has no orbit variable, build it with 07_build_training_dataset.py or use the block folds')
+    return orbit_assignment(np.asarray(store.orbit), k)
+
+  raise ValueError(f'unknown fold method {method}')
+
+
+def init_worker(threads):
+  ''' Limit the number of threads of a fold worker process. '''
+
+  from train_utils import limit_threads
+  limit_threads(threads)
+
+
+def run_fold(fold, folds, store_dir, config):
+  ''' Train a model on the pixels of the other folds and evaluate it on the pixels of the fold, in a worker process.
+
+  The training is early stopped on the next fold, held out of the training pixels, and the fold is only used for the evaluation.
+  Returns the result of the fold, a failure is recorded in the result rather than raised.
+  '''
+
+  from feature_store import FeatureStore
+  from model_utils import fit_scaler, standardize
+  from train_utils import make_dataset, build_model
+  from tensorflow.keras.callbacks import EarlyStopping
+
+  result = {'fold': fold, 'status': 'ok', 'n_train': None, 'n_validation': None, 'n_test': None, 'mse': None, 'mae': None, 'epochs': None, 'error': None}
+  start = time.perf_counter()
+
+  try:
+    store = FeatureStore(store_dir)
+
+    test = folds == fold
+    validation = folds == (fold + 1) % (int(folds.max()) + 1)
+    train = ~test & ~validation
+
+    X_train, y_train = store.tb[train], store.rr[train]
+    X_validation, y_validation = store.tb[validation], store.rr[validation]
+    X_test, y_test = store.tb[test], store.rr[test]
+    result['n_train'], result['n_validation'], result['n_test'] = len(X_train), len(X_validation), len(X_test)
+
+    # the scaling is fitted on the training pixels of the fold only
+    scaler = fit_scaler(X_train)
+    X_train = standardize(X_train, scaler)
+    X_validation = standardize(X_validation, scaler)
+    X_test = standardize(X_test, scaler)
+
+    model = build_model(X_train.shape[1],
+      layers = config['layers'],
+      activation = config['activation'],
+      learning_rate = config['learning_rate'],
+      optimizer = config['optimizer'])
+
+    history = model.fit(
+      make_dataset(X_train, y_train, config['batch_size'], shuffle=True),
+      epochs = config['epochs'],
+      validation_data = make_dataset(X_validation, y_validation, config['batch_size']),
+      callbacks = [EarlyStopping(monitor='val_loss', patience=PATIENCE, restore_best_weights=True)],
+      verbose = 0)
+
+    result['mse'], result['mae'] = model.evaluate(make_dataset(X_test, y_test, config['batch_size']), verbose=0)
+    result['epochs'] = len(history.history['loss'])
+
+  except Exception as e:
+    result['status'] = 'failed'
+    result['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+  result['seconds'] = time.perf_counter() - start
+
+  return result
+
+
+def summarize(results, seconds):
+  ''' Aggregate the results of the folds into the mean and standard deviation of their metrics. '''
+
+  ok = [result for result in results if result['status'] == 'ok']
+
+  summary = {
+    'n_folds': len(results),
+    'n_failed': len(results) - len(ok),
+    'wall_seconds': seconds,
+    'fold_seconds': sum(result['seconds'] for result in results)
+  }
+
+  for metric in ['mse', 'mae', 'epochs', 'seconds']:
+    values = np.array([result[metric] for result in ok], dtype=np.float64)
+    summary[f'mean_{metric}'] = float(values.mean()) if len(values) else None
+    summary[f'std_{metric}'] = float(values.std(ddof=1)) if len(values) > 1 else None
+
+  return summary
+
+
+def cross_validate(store_dir, folds, config, workers, threads_per_fold):
+  ''' Train and evaluate the folds concurrently.
+
+  Returns the results of the folds sorted by fold and their summary.
+  '''
+
+  n_folds = int(folds.max()) + 1
+
+  # each fold needs a test fold, a validation fold and at least one training fold
+  if n_folds < 3:
+    raise ValueError(f'cross-validation needs at least 3 folds, got {n_folds}')
+
+  # spawn the workers so that each of them imports TensorFlow after its threads are limited
+  context = multiprocessing.get_context('spawn')
+
+  results = []
+  start = time.perf_counter()
+
+  with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(threads_per_fold,)) as executor:
+    futures = [executor.submit(run_fold, fold, folds, store_dir, config) for fold in range(n_folds)]
+
+    for future in as_completed(futures):
+      result = future.result()
+      results.append(result)
+      print(f"fold {result['fold']} {result['status']}: mse={result['mse']} mae={result['mae']} ({result['seconds']:.1f}s)")
+
+  results.sort(key=lambda result: result['fold'])
+
+  return results, summarize(results, time.perf_counter() - start)
@@ -0,0 +1,178 @@
+import os
+import re
+import glob
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from gmi_utils import read_granule, read_tb
+
+'''
+Build the training dataset from GMI and radar rain rate orbits.
+
+The training dataset (DATA_FILENAME_GMI_DPR_RR) pairs the 13 GMI TB channels with the surface rain rate of the
+GMI/DPR combined product (2B-CMB): each GMI pixel is matched with its nearest radar pixel and only the pixels over
+ocean where rain was observed (rain rate > 0 mm/h) are kept.
+
+The 1C GMI and 2B-CMB granules of the same orbit are paired by their orbit number and matched in parallel worker
+processes. The matched pixels of each orbit are appended to a chunked NetCDF file as soon as the orbit is done, so
+that only a few orbits are ever held in memory. The file has the same 'tb' (pixel, channel) and 'rr' (pixel)
+variables as the original training dataset, plus the 'orbit' of each pixel.
+'''
+
+# the swath and variables of the radar rain rate product (2B-CMB V07)
+RADAR_SWATH = 'KuGMI'
+RADAR_RR_VARIABLE = f'{RADAR_SWATH}/nearSurfPrecipTotRate'
+RADAR_SURFACE_TYPE_VARIABLE = f'{RADAR_SWATH}/Input/surfaceType'
+
+# the surface types of the radar product are ocean from 0 to 99 (land from 100 to 199, coast from 200 to 299, ...)
+OCEAN_SURFACE_TYPE_MAX = 99
+
+# filename patterns of the 1C GMI and radar granules
+GMI_FILE_PATTERN = '1C-R.GPM.GMI.*.HDF5'
+RADAR_FILE_PATTERN = '2B.GPM.DPRGMI.CORRA*.HDF5'
+
+# GMI pixels further than this distance from any radar pixel are not matched
+MATCH_MAX_DISTANCE_KM = 5.0
+
+# the number of pixels per chunk of the NetCDF variables
+CHUNK_PIXELS = 65536
+
+
+def orbit_number(file_path):
+  ''' Parse the orbit number of a GPM granule filename, e.g. 037225 in 1C-R.GPM.GMI.XCAL2016-C.20200916-S130832-E144106.037225.V07A.HDF5 '''
+
+  match = re.search(r'\.(\d{6})\.V', os.path.basename(file_path))
+  return int(match.group(1)) if match else None
+
+
+def pair_granules(gmi_dir, other_dir, gmi_pattern=GMI_FILE_PATTERN, other_pattern=RADAR_FILE_PATTERN):
+  ''' Pair the 1C GMI granules with the granules of another product of the same orbits, the radar granules by default.
+
+  Returns a list of (orbit, GMI file path, other file path) tuples sorted by orbit.
+  '''
+
+  gmi_files = {orbit_number(path): path for path in glob.glob(os.path.join(gmi_dir, gmi_pattern))}
+  other_files = {orbit_number(path): path for path in glob.glob(os.path.join(other_dir, other_pattern))}
+
+  return [(orbit, gmi_files[orbit], other_files[orbit]) for orbit in sorted(gmi_files.keys() & other_files.keys()) if orbit is not None]
+
+
+def match_orbit(orbit, gmi_path, radar_path, max_distance_km=MATCH_MAX_DISTANCE_KM):
+  ''' Match the GMI pixels of an orbit with their nearest radar pixel.
+
+  Only the GMI pixels with valid TBs in all 13 channels, matched with a radar pixel over ocean with a rain rate > 0 are kept.
+  Returns the (pixels, 13) TBs, the (pixels,) rain rates and the orbit number.
+  '''
+
+  from regrid_utils import SwathRegridder
+
+  lat, lon, TB = read_tb(gmi_path)
+
+  radar = read_granule(radar_path,
+    variables = [f'{RADAR_SWATH}/Latitude', f'{RADAR_SWATH}/Longitude', RADAR_RR_VARIABLE, RADAR_SURFACE_TYPE_VARIABLE],
+    swath = RADAR_SWATH)
+
+  # the nearest radar pixel of each GMI pixel with a valid position, the radar pixels without a valid position
+  # (the NaN of the missing -9999.9 scans) are left out of the index by the regridder
+  lat, lon = lat.reshape(-1), lon.reshape(-1)
+  located = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+
+  regridder = SwathRegridder(radar[f'{RADAR_SWATH}/Latitude'], radar[f'{RADAR_SWATH}/Longitude'])
+  distance, idx = regridder.neighbours(lat[located], lon[located], 1, max_distance_km)
+  idx = idx[:, 0]
+
+  TB = TB.reshape(-1, TB.shape[2])[located]
+  rr = radar[RADAR_RR_VARIABLE].reshape(-1)
+  surface_type = radar[RADAR_SURFACE_TYPE_VARIABLE].reshape(-1)
+
+  # keep the matched pixels over ocean with rain and valid TBs
+  keep = np.flatnonzero(idx >= 0)
+  keep = keep[np.all(TB[keep] > 0, axis=1)]
+  keep = keep[surface_type[idx[keep]] <= OCEAN_SURFACE_TYPE_MAX]
+  keep = keep[rr[idx[keep]] > 0]
+
+  return TB[keep], rr[idx[keep]], orbit
+
+
+class NetCDFAppender:
+  ''' Append matched pixels to a chunked and compressed NetCDF training dataset. '''
+
+  def __init__(self, filepath, n_channels=13):
+
+    import netCDF4
+
+    self.ds = netCDF4.Dataset(filepath, 'w')
+    self.ds.createDimension('pixel', None)
+    self.ds.createDimension('channel', n_channels)
+
+    self.tb = self.ds.createVariable('tb', 'f4', ('pixel', 'channel'), zlib=True, chunksizes=(CHUNK_PIXELS, n_channels))
+    self.rr = self.ds.createVariable('rr', 'f4', ('pixel',), zlib=True, chunksizes=(CHUNK_PIXELS,))
+    self.orbit = self.ds.createVariable('orbit', 'i4', ('pixel',), zlib=True, chunksizes=(CHUNK_PIXELS,))
+
+    self.tb.units = 'K'
+    self.rr.units = 'mm/h'
+
+  def append(self, tb, rr, orbit):
+    ''' Append the matched pixels of an orbit. '''
+
+    start = len(self.ds.dimensions['pixel'])
+    stop = start + len(rr)
+
+    self.tb[start:stop] = tb
+    self.rr[start:stop] = rr
+    self.orbit[start:stop] = np.full(len(rr), orbit, dtype=np.int32)
+
+  def close(self):
+    self.ds.close()
+
+
+def build_dataset(pairs, filepath, workers=None, max_distance_km=MATCH_MAX_DISTANCE_KM):
+  ''' Match the paired orbits in parallel and append them to the NetCDF training dataset as they complete.
+
+  At most twice as many orbits as workers are in flight at a time so that memory use doesn't grow with the number of orbits.
+  Returns the number of pixels of the dataset and the list of (orbit, error) failures.
+  '''
+
+  workers = workers or os.cpu_count()
+
+  appender = NetCDFAppender(filepath)
+  n_pixels = 0
+  failed = []
+
+  pending = {}
+  pairs = iter(pairs)
+
+  # the dataset is closed even if the matching is interrupted, so that the orbits already appended are kept
+  try:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      while True:
+
+        # keep the workers busy with a bounded number of orbits in flight
+        for orbit, gmi_path, radar_path in pairs:
+          pending[executor.submit(match_orbit, orbit, gmi_path, radar_path, max_distance_km)] = orbit
+          if len(pending) >= 2 * workers:
+            break
+
+        if not pending:
+          break
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+        for future in done:
+          orbit = pending.pop(future)
+
+          try:
+            tb, rr, orbit = future.result()
+          except Exception as e:
+            print(f'failed to match orbit {orbit}: {e}')
+            failed.append((orbit, str(e)))
+            continue
+
+          appender.append(tb, rr, orbit)
+          n_pixels += len(rr)
+          print(f'orbit {orbit}: {len(rr)} pixels')
+
+  finally:
+    appender.close()
+
+  return n_pixels, failed
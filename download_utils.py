@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from profile_utils import profile_stage, profile_count
+
+'''
+Download the data products concurrently and resumably.
+
+Each file is downloaded into a .part file which is renamed to its final name only once the transfer is complete,
+so an interrupted transfer never leaves a truncated file under the final name. An interrupted transfer is resumed
+from the end of its .part file with an HTTP Range request. The size and SHA-256 checksum of each completed file are
+recorded in a manifest in the download directory and a file is only considered already downloaded if it matches
+its manifest entry.
+
+The checksum is computed from the downloaded bytes, so it detects a later corruption of the local file but is not an
+integrity check against the source. A transfer is checked against the Content-Length of the response instead, and
+the responses without a Content-Length are rejected since a truncated transfer couldn't be detected.
+'''
+
+# the number of files downloaded at the same time
+DOWNLOAD_WORKERS = 4
+
+# the number of bytes read from the response at a time
+CHUNK_SIZE = 1024 * 1024
+
+# the timeout of the HTTP requests in seconds
+TIMEOUT = 60
+
+# the filename of the manifest in the download directory
+MANIFEST_FILENAME = 'manifest.json'
+
+# suffix of the files that are being downloaded
+PARTIAL_SUFFIX = '.part'
+
+
+def sha256sum(file_path):
+  ''' Compute the SHA-256 checksum of a file. '''
+
+  sha256 = hashlib.sha256()
+
+  with open(file_path, 'rb') as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+      sha256.update(chunk)
+
+  return sha256.hexdigest()
+
+
+def load_manifest(download_dir):
+  ''' Load the manifest of the completed downloads, keyed by filename. '''
+
+  manifest_path = os.path.join(download_dir, MANIFEST_FILENAME)
+
+  if not os.path.exists(manifest_path):
+    return {}
+
+  with open(manifest_path) as f:
+    return json.load(f)
+
+
+def save_manifest(download_dir, manifest):
+  ''' Atomically save the manifest of the completed downloads. '''
+
+  manifest_path = os.path.join(download_dir, MANIFEST_FILENAME)
+
+  with open(manifest_path + PARTIAL_SUFFIX, 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+
+  os.replace(manifest_path + PARTIAL_SUFFIX, manifest_path)
+
+
+def is_downloaded(file_path, entry):
+  ''' Check that a file exists and matches the size and checksum of its manifest entry. '''
+
+  if entry is None or not os.path.exists(file_path):
+    return False
+
+  if os.path.getsize(file_path) != entry['size']:
+    return False
+
+  return sha256sum(file_path) == entry['sha256']
+
+
+def download_file(url, file_path):
+  ''' Download a file, resuming from its .part file if a previous transfer was interrupted.
+
+  Returns the manifest entry of the downloaded file.
+  '''
+
+  partial_path = file_path + PARTIAL_SUFFIX
+  offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+
+  # request the remainder of the file
+  request = urllib.request.Request(url)
+  if offset > 0:
+    request.add_header('Range', f'bytes={offset}-')
+
+  try:
+    response = urllib.request.urlopen(request, timeout=TIMEOUT)
+
+  except urllib.error.HTTPError as e:
+    # the requested range starts at the end of the file: the .part file is already complete
+    if e.code == 416 and e.headers.get('Content-Range') == f'bytes */{offset}':
+      response = None
+
+    # the .part file can't be resumed: start over
+    elif e.code == 416:
+      os.remove(partial_path)
+      return download_file(url, file_path)
+
+    else:
+      raise
+
+  if response is not None:
+    with response:
+
+      # without the length of the response a transfer cut short would be taken for a complete file
+      content_length = response.headers.get('Content-Length')
+      if content_length is None:
+        raise IOError(f'no Content-Length in the response for {url}, the transfer could not be checked')
+
+      # the server ignored the range request and is sending the whole file
+      if response.status != 206:
+        offset = 0
+
+      with profile_stage('download'), open(partial_path, 'ab' if offset > 0 else 'wb') as f:
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+          f.write(chunk)
+          profile_count('bytes_downloaded', len(chunk))
+
+      # check that the transfer was not cut short
+      if os.path.getsize(partial_path) != offset + int(content_length):
+        raise IOError(f'incomplete download of {url}')
+
+  with profile_stage('checksum'):
+    entry = {
+      'url': url,
+      'size': os.path.getsize(partial_path),
+      'sha256': sha256sum(partial_path)
+    }
+
+  # the file only gets its final name once it is complete
+  os.replace(partial_path, file_path)
+
+  return entry
+
+
+def download_data(urls, download_dir, workers=DOWNLOAD_WORKERS):
+  ''' Download the data that hasn't already been downloaded, with up to the given number of concurrent transfers.
+
+  Returns the list of urls that failed to download.
+  '''
+
+  manifest = load_manifest(download_dir)
+  manifest_lock = threading.Lock()
+
+  def download(url):
+    data_filename = os.path.basename(url)
+    download_file_path = os.path.join(download_dir, data_filename)
+
+    entry = manifest.get(data_filename)
+
+    if is_downloaded(download_file_path, entry):
+      print(f'already downloaded: {data_filename}')
+      return
+
+    if os.path.exists(download_file_path):
+      if entry is None:
+        # a file that is not in the manifest may have been truncated: resume it rather than trusting it
+        os.replace(download_file_path, download_file_path + PARTIAL_SUFFIX)
+      else:
+        # the file doesn't match its manifest entry: download it again
+        os.remove(download_file_path)
+
+    print(f'downloading {data_filename}')
+    entry = download_file(url, download_file_path)
+
+    # record the completed download
+    with manifest_lock:
+      manifest[data_filename] = entry
+      save_manifest(download_dir, manifest)
+
+    print(f'downloaded: {data_filename}')
+
+  failed = []
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = {executor.submit(download, url): url for url in urls}
+
+    for future, url in futures.items():
+      try:
+        future.result()
+      except Exception as e:
+        print(f'failed to download {os.path.basename(url)}: {e}')
+        failed.append(url)
+
+  return failed
@@ -0,0 +1,246 @@
+import os
+import numpy as np
+
+from constants import *
+from numpy_mlp import NumpyMLP, PRECISIONS, DEFAULT_MAX_BATCH_SIZE
+from predict_utils import iter_batches, load_tb, tb_params
+from profile_utils import profile_stage, profile_count
+
+'''
+Ensemble inference of several variants of the MLP trained in 03_train_sea_ann.py, e.g. retrained with other seeds,
+splits or hyperparameters, or the model versions of 10_incremental_train.py.
+
+The members are the .npz exports of the NumPy inference engine (numpy_mlp.export_npz). They are all evaluated in
+one pass over the same batches of preprocessed TBs instead of running the whole pipeline once per member:
+  - the members with the same architecture (layer sizes and activations) are stacked into one group
+  - the first layers of the group take the same raw TBs, so their kernels are concatenated into a single
+    (13, members * units) kernel and computed with a single matrix multiplication
+  - the next layers are computed for all the members at once with a batched matrix multiplication of the
+    (members, batch, units) outputs by the (members, units, units) stacked kernels
+
+For each pixel the ensemble gives the mean of the member predictions (the rain rate), their standard deviation
+(the spread of the ensemble, an estimate of the uncertainty of the rain rate) and their quantiles.
+'''
+
+# the quantiles of the member predictions given for each pixel
+ENSEMBLE_QUANTILES = (0.05, 0.5, 0.95)
+
+
+def member_path(path):
+  ''' The .npz file of an ensemble member given as an exported .npz file or as a model directory. '''
+
+  if os.path.isdir(path):
+    path = os.path.join(path, NUMPY_MODEL_FILENAME)
+
+  if not os.path.exists(path):
+    raise FileNotFoundError(f'{path} not found, export the model for the NumPy inference engine with numpy_mlp.export_npz')
+
+  return path
+
+
+def quantile_name(q):
+  ''' The name of the output layer of a quantile, e.g. rr_q05 for the 5% quantile. '''
+
+  return f'rr_q{round(q * 100):02d}'
+
+
+def check_quantiles(quantiles):
+  ''' Check that the quantiles are within [0, 1] and that their output layers have distinct names, e.g. not both 0.05 and 0.051. '''
+
+  names = {}
+  for q in quantiles:
+    if not 0 <= q <= 1:
+      raise ValueError(f'the quantile {q} is not within [0, 1]')
+
+    name = quantile_name(q)
+    if name in names:
+      raise ValueError(f'the quantiles {names[name]} and {q} have the same output layer {name}, the quantiles are rounded to the percent')
+    names[name] = q
+
+
+class EnsembleMLP:
+  ''' Forward pass of several Dense MLPs exported with export_npz, stacked by architecture.
+
+  The forward pass is computed in float32 by default, or in any of the PRECISIONS of the NumPy inference engine.
+  '''
+
+  def __init__(self, filepaths, max_batch_size=DEFAULT_MAX_BATCH_SIZE, precision='float32'):
+
+    if precision not in PRECISIONS:
+      raise ValueError(f'unsupported precision {precision}')
+
+    self.precision = precision
+    self.dtype = PRECISIONS[precision]
+    self.filepaths = [member_path(filepath) for filepath in filepaths]
+
+    members = [NumpyMLP(filepath, 1, precision) for filepath in self.filepaths]
+
+    if len({member.n_features for member in members}) > 1:
+      raise ValueError('the ensemble members do not take the same number of features')
+
+    self.n_members = len(members)
+    self.n_features = members[0].n_features
+
+    # group the members by architecture, remembering the position of each member in the ensemble
+    architectures = {}
+    for index, member in enumerate(members):
+      architecture = (tuple(member.activations), tuple(kernel.shape for kernel in member.kernels))
+      architectures.setdefault(architecture, []).append(index)
+
+    self.groups = []
+    for (activations, _), indices in architectures.items():
+      group = [members[index] for index in indices]
+
+      # the first layers side by side, the next layers stacked
+      first_kernel = np.ascontiguousarray(np.concatenate([member.kernels[0] for member in group], axis=1))
+      first_bias = np.concatenate([member.biases[0] for member in group])
+      kernels = [np.stack([member.kernels[i] for member in group]) for i in range(1, len(activations))]
+      biases = [np.stack([member.biases[i] for member in group])[:, np.newaxis, :] for i in range(1, len(activations))]
+
+      self.groups.append({
+        'indices': indices,
+        'activations': list(activations),
+        'kernels': [first_kernel] + kernels,
+        'biases': [first_bias] + biases
+      })
+
+    self._allocate(max_batch_size)
+
+  def _allocate(self, max_batch_size):
+    ''' Preallocate the output buffer of each layer of each group and the member predictions. '''
+
+    self.max_batch_size = max_batch_size
+
+    for group in self.groups:
+      n_group = len(group['indices'])
+      first_kernel, kernels = group['kernels'][0], group['kernels'][1:]
+
+      group['buffers'] = [np.empty((max_batch_size, first_kernel.shape[1]), dtype=self.dtype)]
+      group['buffers'] += [np.empty((n_group, max_batch_size, kernel.shape[2]), dtype=self.dtype) for kernel in kernels]
+
+    self.members = np.empty((max_batch_size, self.n_members), dtype=np.float32)
+
+  def predict_members(self, X):
+    ''' Predict one value per row of the (batch, features) input array with each member.
+
+    Returns a (batch, members) array in the order of the members, overwritten by the next call.
+    '''
+
+    n = X.shape[0]
+    if n > self.max_batch_size:
+      self._allocate(n)
+
+    X = np.asarray(X, dtype=self.dtype)
+
+    for group in self.groups:
+      n_group = len(group['indices'])
+
+      for i, (kernel, bias, activation, buffer) in enumerate(zip(group['kernels'], group['biases'], group['activations'], group['buffers'])):
+
+        if i == 0:
+          # the first layers of all the members in one matrix multiplication
+          out = np.matmul(X, kernel, out=buffer[:n])
+          out += bias
+        else:
+          if i == 1:
+            # the (members, batch, units) view of the first layer outputs, each member slice is a strided matrix
+            out = out.reshape(n, n_group, -1).transpose(1, 0, 2)
+          out = np.matmul(out, kernel, out=buffer[:, :n])
+          out += bias
+
+        if activation == 'sigmoid':
+          # exp overflows to inf for large negative inputs, which correctly gives a sigmoid of 0
+          np.negative(out, out=out)
+          with np.errstate(over='ignore'):
+            np.exp(out, out=out)
+          out += 1
+          np.reciprocal(out, out=out)
+        elif activation == 'relu':
+          np.maximum(out, 0, out=out)
+        elif activation == 'tanh':
+          np.tanh(out, out=out)
+
+      # the first output unit of each member, (batch, members) for a single layer model or (members, batch) otherwise
+      if len(group['kernels']) == 1:
+        self.members[:n, group['indices']] = out[:, ::out.shape[1] // n_group]
+      else:
+        self.members[:n, group['indices']] = out[:, :, 0].T
+
+    return self.members[:n]
+
+  def predict(self, X):
+    ''' Predict the ensemble mean of each row of the (batch, features) input array. '''
+
+    return self.predict_members(X).mean(axis=1)
+
+
+def ensemble_statistics(members, quantiles=ENSEMBLE_QUANTILES):
+  ''' The mean, standard deviation and quantiles of the (batch, members) member predictions, as a dictionary of output layers. '''
+
+  statistics = {
+    'rr': members.mean(axis=1),
+    'rr_std': members.std(axis=1)
+  }
+
+  if quantiles:
+    for q, values in zip(quantiles, np.quantile(members, quantiles, axis=1)):
+      statistics[quantile_name(q)] = values
+
+  return statistics
+
+
+def predict_ensemble_swath(ensemble, TB, quantiles=ENSEMBLE_QUANTILES):
+  ''' Predict the ensemble statistics of every valid pixel of a (scans, pixels, channels) TB swath.
+
+  Returns a dictionary of (scans, pixels) float32 arrays: the ensemble mean 'rr', standard deviation 'rr_std' and
+  the quantiles (see quantile_name), in which the pixels with missing TB values are NaN.
+  '''
+
+  check_quantiles(quantiles)
+
+  n_pixels = TB.shape[0] * TB.shape[1]
+  layers = {}
+  n_predicted = 0
+
+  with profile_stage('predict', n_pixels):
+    for idx, X in iter_batches(TB):
+      for name, values in ensemble_statistics(ensemble.predict_members(X), quantiles).items():
+        if name not in layers:
+          layers[name] = np.full(n_pixels, np.nan, dtype=np.float32)
+        layers[name][idx] = values
+      n_predicted += len(idx)
+
+  profile_count('pixels_predicted', n_predicted)
+  profile_count('pixels_masked', n_pixels - n_predicted)
+
+  # a swath without any valid pixel
+  if not layers:
+    layers = {name: np.full(n_pixels, np.nan, dtype=np.float32) for name in ['rr', 'rr_std'] + [quantile_name(q) for q in quantiles]}
+
+  return {name: values.reshape(TB.shape[0], TB.shape[1]) for name, values in layers.items()}
+
+
+def predict_ensemble_granule(file_path, ensemble, lat_bounds=None, lon_bounds=None, cache=None, quantiles=ENSEMBLE_QUANTILES):
+  ''' Predict the ensemble statistics of a 1C GMI granule within the area of interest.
+
+  The TBs are read and preprocessed once for all the members. If a cache is given the TBs and the ensemble
+  statistics are cached like the predictions of predict_utils.predict_granule.
+  Returns a dictionary with the S1 'lat' and 'lon' and the statistics swaths, or None if the granule does not cross the area of interest.
+  '''
+
+  def compute():
+    tb_input = load_tb(file_path, lat_bounds, lon_bounds, cache)
+    if tb_input is None:
+      return {}
+
+    lat, lon, TB = tb_input
+
+    return dict(lat=lat, lon=lon, **predict_ensemble_swath(ensemble, TB, quantiles))
+
+  if cache is None:
+    prediction = compute()
+  else:
+    params = dict(tb_params(lat_bounds, lon_bounds), precision=ensemble.precision, quantiles=list(quantiles))
+    prediction = cache.cached(cache.key('rr_ensemble', [file_path] + ensemble.filepaths, params), compute)
+
+  return prediction or None
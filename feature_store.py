@@ -0,0 +1,165 @@
+import json
+import os
+import numpy as np
+
+from model_utils import fit_scaler, update_scaler
+
+'''
+A memory-mapped float32 feature store of the training dataset.
+
+The NetCDF training dataset is converted once into a directory of contiguous float32 .npy arrays:
+  tb.npy      the (pixels, channels) TBs
+  rr.npy      the (pixels,) surface rain rates
+  orbit.npy   the (pixels,) orbit numbers, if the dataset has them
+  split.npy   the index of each stored pixel in the NetCDF dataset
+  meta.json   the number of pixels, the size of the training split and the per-channel statistics of the training split
+
+The pixels are stored in the order of the split made by split_dataset: the training pixels first, then the test
+pixels. The arrays are memory-mapped when the store is opened, so the training and test datasets are zero-copy
+slices of the store and only the pages that are read are loaded into memory. The conversion reads the NetCDF
+dataset in chunks of pixels so the dataset never has to fit in memory.
+'''
+
+# the version of the store format, bump it when the stored files change
+STORE_VERSION = 1
+
+# the number of pixels read from the NetCDF dataset at a time
+CHUNK_PIXELS = 1000000
+
+
+def split_destination(idx, n_train):
+  ''' Position in the store of the NetCDF pixels of the given indices, as split by split_dataset.
+
+  split_dataset puts the pixels at odd positions in the training dataset and the pixels at even positions in the test dataset.
+  '''
+
+  return np.where(idx % 2 == 1, idx // 2, n_train + idx // 2)
+
+
+def source_signature(nc_path):
+  ''' The size and modification time of the NetCDF dataset, to detect that the store is out of date. '''
+
+  stat = os.stat(nc_path)
+  return {'path': os.path.abspath(nc_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def build_feature_store(nc_path, store_dir, chunk_pixels=CHUNK_PIXELS):
+  ''' Convert the NetCDF training dataset into a feature store. '''
+
+  import xarray as xr
+
+  os.makedirs(store_dir, exist_ok=True)
+
+  with xr.open_dataset(nc_path) as ds:
+    pixel_dim = ds['rr'].dims[0]
+    tb = ds['tb'].transpose(pixel_dim, ...)
+    rr = ds['rr']
+    orbit = ds['orbit'] if 'orbit' in ds else None
+
+    n = rr.shape[0]
+    n_channels = tb.shape[1]
+    n_train = n // 2
+
+    # the memory-mapped arrays of the store
+    tb_store = np.lib.format.open_memmap(os.path.join(store_dir, 'tb.npy'), mode='w+', dtype=np.float32, shape=(n, n_channels))
+    rr_store = np.lib.format.open_memmap(os.path.join(store_dir, 'rr.npy'), mode='w+', dtype=np.float32, shape=(n,))
+    split_store = np.lib.format.open_memmap(os.path.join(store_dir, 'split.npy'), mode='w+', dtype=np.int64, shape=(n,))
+    if orbit is not None:
+      orbit_store = np.lib.format.open_memmap(os.path.join(store_dir, 'orbit.npy'), mode='w+', dtype=np.int32, shape=(n,))
+
+    # copy the dataset chunk by chunk into its place in the split
+    for start in range(0, n, chunk_pixels):
+      stop = min(start + chunk_pixels, n)
+      idx = np.arange(start, stop)
+      destination = split_destination(idx, n_train)
+
+      tb_store[destination] = tb[start:stop].values
+      rr_store[destination] = rr[start:stop].values.reshape(-1)
+      split_store[destination] = idx
+      if orbit is not None:
+        orbit_store[destination] = orbit[start:stop].values
+
+    for array in [tb_store, rr_store, split_store] + ([orbit_store] if orbit is not None else []):
+      array.flush()
+
+  # the per-channel statistics of the training split, accumulated chunk by chunk
+  scaler = None
+  for start in range(0, n_train, chunk_pixels):
+    chunk = tb_store[start:min(start + chunk_pixels, n_train)]
+    scaler = fit_scaler(chunk) if scaler is None else update_scaler(scaler, chunk)
+
+  meta = {
+    'version': STORE_VERSION,
+    'source': source_signature(nc_path),
+    'n_pixels': int(n),
+    'n_train': int(n_train),
+    'n_channels': int(n_channels),
+    'scaler': {
+      'mean': scaler['mean'].tolist(),
+      'scale': scaler['scale'].tolist(),
+      'var': scaler['var'].tolist(),
+      'n_samples_seen': int(scaler['n_samples_seen'])
+    }
+  }
+
+  with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+    json.dump(meta, f, indent=2)
+
+
+def is_up_to_date(nc_path, store_dir):
+  ''' Check that the feature store exists and was built from the current NetCDF dataset. '''
+
+  meta_path = os.path.join(store_dir, 'meta.json')
+  if not os.path.exists(meta_path):
+    return False
+
+  with open(meta_path) as f:
+    meta = json.load(f)
+
+  return meta['version'] == STORE_VERSION and meta['source'] == source_signature(nc_path)
+
+
+class FeatureStore:
+  ''' Read-only memory-mapped access to a feature store. '''
+
+  def __init__(self, store_dir):
+
+    with open(os.path.join(store_dir, 'meta.json')) as f:
+      self.meta = json.load(f)
+
+    self.n_train = self.meta['n_train']
+
+    self.tb = np.load(os.path.join(store_dir, 'tb.npy'), mmap_mode='r')
+    self.rr = np.load(os.path.join(store_dir, 'rr.npy'), mmap_mode='r')
+    self.split = np.load(os.path.join(store_dir, 'split.npy'), mmap_mode='r')
+
+    orbit_path = os.path.join(store_dir, 'orbit.npy')
+    self.orbit = np.load(orbit_path, mmap_mode='r') if os.path.exists(orbit_path) else None
+
+    # the statistics of the training split, in the format of the saved scaler statistics
+    scaler = self.meta['scaler']
+    self.scaler = {
+      'mean': np.array(scaler['mean']),
+      'scale': np.array(scaler['scale']),
+      'var': np.array(scaler['var']),
+      'n_samples_seen': scaler['n_samples_seen']
+    }
+
+  def train(self):
+    ''' The TBs and rain rates of the training split (views of the store). '''
+
+    return self.tb[:self.n_train], self.rr[:self.n_train]
+
+  def test(self):
+    ''' The TBs and rain rates of the test split (views of the store). '''
+
+    return self.tb[self.n_train:], self.rr[self.n_train:]
+
+
+def open_feature_store(nc_path, store_dir):
+  ''' Open the feature store of the NetCDF training dataset, building it first if it doesn't exist or is out of date. '''
+
+  if not is_up_to_date(nc_path, store_dir):
+    build_feature_store(nc_path, store_dir)
+
+  return FeatureStore(store_dir)
@@ -0,0 +1,150 @@
+import h5py
+import numpy as np
+
+from profile_utils import profiler, profile_stage, profile_count
+
+'''
+Read GPM GMI (1C) and GPROF (2A) granules restricted to an area of interest.
+
+A granule covers a full orbit (2963 scans of 221 pixels) but an area of interest such as the Ionian Sea
+is only crossed by a few hundred of those scans. Rather than loading every variable in full, the geolocation
+arrays are scanned block by block to find the range of scan rows that intersect the lat/lon bounding box,
+only that hyperslab is read for every requested variable, and the -9999.9 missing values are masked as the
+data is read.
+'''
+
+# special value for missing data as defined by the File Specification for GPM Products
+MISSING_VALUE = -9999.9
+
+# number of scans read at a time when searching the geolocation arrays for the area of interest
+SCAN_BLOCK_SIZE = 256
+
+
+def find_scan_range(hf, lat_bounds, lon_bounds, swath='S1', block_size=SCAN_BLOCK_SIZE):
+  ''' Find the range of scan rows with at least one pixel inside the lat/lon bounding box.
+
+  Returns a (start, stop) tuple that can be used as a slice on the scan axis, or None if the swath does not cross the box.
+  '''
+
+  lat_dset = hf[f'{swath}/Latitude']
+  lon_dset = hf[f'{swath}/Longitude']
+  n_scans = lat_dset.shape[0]
+
+  start = None
+  stop = None
+
+  # read the geolocation in blocks of scans so that the full orbit is never held in memory
+  for block_start in range(0, n_scans, block_size):
+    block_stop = min(block_start + block_size, n_scans)
+    lat = lat_dset[block_start:block_stop]
+    lon = lon_dset[block_start:block_stop]
+
+    # missing geolocation values fall outside of any valid bounds so they never match
+    inside = (lat >= lat_bounds[0]) & (lat <= lat_bounds[1]) & (lon >= lon_bounds[0]) & (lon <= lon_bounds[1])
+    rows = np.flatnonzero(inside.any(axis=1))
+
+    if rows.size > 0:
+      if start is None:
+        start = block_start + rows[0]
+      stop = block_start + rows[-1] + 1
+
+  if start is None:
+    return None
+
+  return int(start), int(stop)
+
+
+def mask_missing(data, variable):
+  ''' NaN the missing values of the given variable in place.
+
+  Latitude and longitude can legitimately be negative so only the -9999.9 special value is masked.
+  For physical quantities (TB, rain rates) any negative value is masked.
+  '''
+
+  if variable.endswith('Latitude') or variable.endswith('Longitude'):
+    data[data <= MISSING_VALUE + 0.5] = np.nan
+  else:
+    data[data < 0] = np.nan
+
+  return data
+
+
+def read_granule(file_path, variables, lat_bounds=None, lon_bounds=None, swath='S1'):
+  ''' Read the given variables of a granule, only keeping the scans that cross the area of interest.
+
+  The variables are given as paths within the HDF5 file (e.g. 'S1/Tc').
+  The scan range is determined from the geolocation of the given swath; all GMI swaths share the same scans.
+  If no bounds are given then the full granule is read.
+
+  Returns a dictionary of float32 arrays keyed by variable path with missing values set to NaN.
+  The dictionary is empty if the granule does not cross the area of interest.
+  '''
+
+  data = {}
+
+  with h5py.File(file_path, 'r') as hf:
+
+    # find the scans to read
+    if lat_bounds is not None and lon_bounds is not None:
+      scan_range = find_scan_range(hf, lat_bounds, lon_bounds, swath=swath)
+      if scan_range is None:
+        return data
+    else:
+      scan_range = (0, hf[f'{swath}/Latitude'].shape[0])
+
+    scans = slice(*scan_range)
+
+    n_pixels = (scan_range[1] - scan_range[0]) * hf[f'{swath}/Latitude'].shape[1]
+    profile_count('pixels_read', n_pixels)
+
+    # hyperslab read of the scan range for each variable
+    for variable in variables:
+      with profile_stage('read', n_pixels):
+        values = hf[variable][scans].astype(np.float32, copy=False)
+
+      with profile_stage('mask', n_pixels):
+        data[variable] = mask_missing(values, variable)
+
+      if profiler.enabled:
+        profile_count('values_masked', np.count_nonzero(np.isnan(data[variable])))
+
+  return data
+
+
+def read_tb(file_path, lat_bounds=None, lon_bounds=None, collocate=True):
+  ''' Read the 13 channels TB model input of a 1C GMI granule within the area of interest.
+
+  The 9 channels of swath S1 and the 4 channels of swath S2 are merged into a single (scans, pixels, 13) array on the S1 pixels.
+  The S1 and S2 swaths have their own geolocation so each S1 pixel is collocated with its nearest S2 pixel,
+  the S2 channels are NaN where there is no S2 pixel close enough. If collocate is False then the pixels are paired by array position.
+  Only the scans crossing the area of interest are collocated, without bounds the first read of a full orbit spends about a second collocating.
+  Returns the S1 latitude, longitude and the merged TB arrays, or None if the granule does not cross the area of interest.
+  '''
+
+  variables = ['S1/Latitude', 'S1/Longitude', 'S1/Tc', 'S2/Tc']
+  if collocate:
+    variables += ['S2/Latitude', 'S2/Longitude']
+
+  data = read_granule(file_path,
+    variables = variables,
+    lat_bounds = lat_bounds,
+    lon_bounds = lon_bounds)
+
+  if not data:
+    return None
+
+  TB_S2 = data['S2/Tc']
+
+  # map the S2 TBs onto the S1 pixels
+  if collocate:
+    from regrid_utils import collocate as collocate_swaths, collocate_values
+
+    with profile_stage('collocate', data['S1/Latitude'].size):
+      idx = collocate_swaths(data['S1/Latitude'], data['S1/Longitude'], data['S2/Latitude'], data['S2/Longitude'])
+      TB_S2 = collocate_values(TB_S2, idx)
+
+  # merge the two TB data sources into a single data object
+  with profile_stage('concatenate', data['S1/Latitude'].size):
+    TB = np.concatenate((data['S1/Tc'], TB_S2), axis=2)
+
+  return data['S1/Latitude'], data['S1/Longitude'], TB
@@ -0,0 +1,148 @@
+import numpy as np
+
+from profile_utils import profile_stage
+
+'''
+Persist the feature scaling fitted at training time alongside the model.
+
+The TB features are standardized with a StandardScaler fitted on the training dataset. The same mean and
+scale must be applied to the inputs at prediction time, so they are saved next to the model as a versioned
+preprocessing artifact rather than being recomputed on each granule.
+
+Because standardization is an affine transform, it can also be folded into the weights and bias of the first
+Dense layer: for x' = (x - mean) / scale, W.x' + b = (W / scale).x + (b - W.(mean / scale)).
+The fused model takes the raw TB as input and needs no separate normalization pass.
+'''
+
+# the version of the scaler artifact format, bump it when the saved fields change
+SCALER_VERSION = 1
+
+
+def save_scaler(scaler, filepath):
+  ''' Save the scaler statistics (mean, scale, var and n_samples_seen) fitted on the training dataset. '''
+
+  np.savez(filepath,
+    version = SCALER_VERSION,
+    mean = scaler['mean'],
+    scale = scaler['scale'],
+    var = scaler['var'],
+    n_samples_seen = scaler['n_samples_seen'])
+
+
+def load_scaler(filepath):
+  ''' Load the scaler statistics saved with save_scaler as a dictionary of arrays. '''
+
+  with np.load(filepath) as npz:
+    version = int(npz['version'])
+    if version != SCALER_VERSION:
+      raise ValueError(f'unsupported scaler version {version} in {filepath}, expected version {SCALER_VERSION}')
+
+    return {
+      'mean': npz['mean'],
+      'scale': npz['scale'],
+      'var': npz['var'],
+      'n_samples_seen': int(npz['n_samples_seen'])
+    }
+
+
+def fit_scaler(X):
+  ''' Compute the scaler statistics of the features, as a StandardScaler fitted on them would. '''
+
+  var = np.var(X, axis=0, dtype=np.float64)
+
+  # as in StandardScaler, features with no variance are left unscaled
+  scale = np.sqrt(var)
+  scale[scale == 0] = 1
+
+  return {
+    'mean': np.mean(X, axis=0, dtype=np.float64),
+    'scale': scale,
+    'var': var,
+    'n_samples_seen': len(X)
+  }
+
+
+def update_scaler(scaler, X):
+  ''' Update the scaler statistics with new features, as if they had been fitted on all the features at once.
+
+  The means and variances are merged with the parallel algorithm of Chan et al.
+  '''
+
+  new = fit_scaler(X)
+
+  n_a = scaler['n_samples_seen']
+  n_b = new['n_samples_seen']
+  n = n_a + n_b
+
+  delta = new['mean'] - scaler['mean']
+  mean = scaler['mean'] + delta * n_b / n
+  var = (scaler['var'] * n_a + new['var'] * n_b + delta ** 2 * n_a * n_b / n) / n
+
+  scale = np.sqrt(var)
+  scale[scale == 0] = 1
+
+  return {
+    'mean': mean,
+    'scale': scale,
+    'var': var,
+    'n_samples_seen': n
+  }
+
+
+def standardize(X, scaler):
+  ''' Standardize the features with the saved scaler statistics. '''
+
+  with profile_stage('scale', len(X)):
+    return ((X - scaler['mean']) / scaler['scale']).astype(np.float32)
+
+
+def fold_scaler(kernel, bias, scaler):
+  ''' Fold the feature scaling into the (features, units) kernel and the bias of a Dense layer. '''
+
+  mean = np.asarray(scaler['mean'], dtype=np.float64)
+  scale = np.asarray(scaler['scale'], dtype=np.float64)
+
+  fused_kernel = kernel / scale[:, np.newaxis]
+  fused_bias = bias - (mean / scale) @ kernel
+
+  return fused_kernel.astype(kernel.dtype), fused_bias.astype(bias.dtype)
+
+
+def rescale_kernel(kernel, bias, old_scaler, new_scaler):
+  ''' Adapt the (features, units) kernel and the bias of a Dense layer trained on inputs standardized with the old
+  scaler statistics so that it gives the same outputs on inputs standardized with the new scaler statistics. '''
+
+  old_mean = np.asarray(old_scaler['mean'], dtype=np.float64)
+  old_scale = np.asarray(old_scaler['scale'], dtype=np.float64)
+  new_mean = np.asarray(new_scaler['mean'], dtype=np.float64)
+  new_scale = np.asarray(new_scaler['scale'], dtype=np.float64)
+
+  # (x - old_mean) / old_scale = (new_scale * (x - new_mean) / new_scale + new_mean - old_mean) / old_scale
+  rescaled_kernel = kernel * (new_scale / old_scale)[:, np.newaxis]
+  rescaled_bias = bias + ((new_mean - old_mean) / old_scale) @ kernel
+
+  return rescaled_kernel.astype(kernel.dtype), rescaled_bias.astype(bias.dtype)
+
+
+def rescale_model(model, old_scaler, new_scaler):
+  ''' Adapt the first (Dense) layer of the model in place to inputs standardized with the new scaler statistics. '''
+
+  first_layer = model.layers[0]
+  kernel, bias = first_layer.get_weights()
+  first_layer.set_weights(list(rescale_kernel(kernel, bias, old_scaler, new_scaler)))
+
+
+def fuse_scaler(model, scaler):
+  ''' Return a copy of the model with the feature scaling folded into the weights and bias of its first layer. '''
+
+  import tensorflow as tf
+
+  fused_model = tf.keras.models.clone_model(model)
+  fused_model.set_weights(model.get_weights())
+
+  # the first layer is a Dense layer
+  first_layer = fused_model.layers[0]
+  kernel, bias = first_layer.get_weights()
+  first_layer.set_weights(list(fold_scaler(kernel, bias, scaler)))
+
+  return fused_model
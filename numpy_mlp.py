@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from constants import *
+
+'''
+A TensorFlow-free inference engine for the MLP trained in 03_train_sea_ann.py.
+
+The model is a small stack of Dense layers (13 -> 20 -> 10 -> 1 with sigmoid hidden layers and a linear output)
+so its forward pass is a handful of matrix multiplications. The Dense weights are exported once from the
+Keras model into a compact .npz file, with the training feature scaling folded into the first layer, and the
+forward pass is then computed with NumPy in float32 using preallocated buffers.
+
+Predicting this way only requires NumPy: it avoids the startup time and memory footprint of importing
+TensorFlow in every prediction process.
+
+Run this module to export an already trained model:
+  python numpy_mlp.py
+'''
+
+# the activation functions supported by the engine
+ACTIVATIONS = ['linear', 'sigmoid', 'relu', 'tanh']
+
+# the number of rows the buffers are preallocated for, they grow if a larger batch is given
+DEFAULT_MAX_BATCH_SIZE = 8192
+
+# the floating point precisions the forward pass can be computed in
+# NumPy has no float16 matrix multiplication kernel, float16 only simulates the accuracy of half precision and is much slower
+PRECISIONS = {'float64': np.float64, 'float32': np.float32, 'float16': np.float16}
+
+
+def export_npz(model, filepath, scaler=None):
+  ''' Export the weights and activations of the Dense layers of a Keras model into a .npz file.
+
+  If the scaler statistics are given then the feature scaling is folded into the first layer so that the exported model takes raw TBs.
+  '''
+
+  from model_utils import fold_scaler
+
+  arrays = {}
+  activations = []
+
+  for i, layer in enumerate(model.layers):
+    kernel, bias = layer.get_weights()
+    activation = layer.get_config()['activation']
+
+    if activation not in ACTIVATIONS:
+      raise ValueError(f'unsupported activation {activation} in layer {layer.name}')
+
+    # fold the scaling into the first layer
+    if i == 0 and scaler is not None:
+      kernel, bias = fold_scaler(kernel, bias, scaler)
+
+    arrays[f'kernel_{i}'] = kernel.astype(np.float32)
+    arrays[f'bias_{i}'] = bias.astype(np.float32)
+    activations.append(activation)
+
+  np.savez(filepath, activations=np.array(activations), **arrays)
+
+
+def verify_export(model, mlp, X, scaler=None, atol=1e-4):
+  ''' Check that the NumPy engine predictions match the Keras model predictions within the given tolerance.
+
+  The X inputs are raw TBs, they are standardized for the Keras model if the scaler statistics are given.
+  Returns the maximum absolute difference between the two predictions.
+  '''
+
+  from model_utils import standardize
+
+  X_model = standardize(X, scaler) if scaler is not None else X
+
+  expected = np.reshape(model.predict_on_batch(X_model), -1)
+  predicted = mlp.predict(X)
+
+  max_diff = float(np.max(np.abs(expected - predicted)))
+  if max_diff > atol:
+    raise ValueError(f'the NumPy engine predictions differ from the Keras model predictions by up to {max_diff} (tolerance is {atol})')
+
+  return max_diff
+
+
+class NumpyMLP:
+  ''' Forward pass of a Dense MLP exported with export_npz.
+
+  The forward pass is computed in float32 by default, or in any of the PRECISIONS.
+  '''
+
+  def __init__(self, filepath, max_batch_size=DEFAULT_MAX_BATCH_SIZE, precision='float32'):
+
+    if precision not in PRECISIONS:
+      raise ValueError(f'unsupported precision {precision}')
+
+    self.precision = precision
+    self.dtype = PRECISIONS[precision]
+
+    with np.load(filepath) as npz:
+      self.activations = [str(activation) for activation in npz['activations']]
+      self.kernels = [np.ascontiguousarray(npz[f'kernel_{i}'], dtype=self.dtype) for i in range(len(self.activations))]
+      self.biases = [np.ascontiguousarray(npz[f'bias_{i}'], dtype=self.dtype) for i in range(len(self.activations))]
+
+    self.n_features = self.kernels[0].shape[0]
+    self._allocate(max_batch_size)
+
+  def _allocate(self, max_batch_size):
+    ''' Preallocate the output buffer of each layer. '''
+
+    self.max_batch_size = max_batch_size
+    self.buffers = [np.empty((max_batch_size, kernel.shape[1]), dtype=self.dtype) for kernel in self.kernels]
+
+  def predict(self, X):
+    ''' Predict one value per row of the (batch, features) input array. '''
+
+    n = X.shape[0]
+    if n > self.max_batch_size:
+      self._allocate(n)
+
+    out = np.asarray(X, dtype=self.dtype)
+
+    for kernel, bias, activation, buffer in zip(self.kernels, self.biases, self.activations, self.buffers):
+
+      # the layer output is computed in place in its preallocated buffer
+      out = np.matmul(out, kernel, out=buffer[:n])
+      out += bias
+
+      if activation == 'sigmoid':
+        # exp overflows to inf for large negative inputs, which correctly gives a sigmoid of 0
+        np.negative(out, out=out)
+        with np.errstate(over='ignore'):
+          np.exp(out, out=out)
+        out += 1
+        np.reciprocal(out, out=out)
+      elif activation == 'relu':
+        np.maximum(out, 0, out=out)
+      elif activation == 'tanh':
+        np.tanh(out, out=out)
+
+    # copy the output so that it is not overwritten by the next call
+    return out[:, 0].copy()
+
+
+if __name__ == '__main__':
+  import tensorflow as tf
+  from model_utils import load_scaler
+
+  # export the trained model with the training feature scaling folded into its first layer
+  model = tf.keras.models.load_model(f'{MODELS_DIR}/{MODEL_FILENAME}')
+  scaler = load_scaler(f'{MODELS_DIR}/{SCALER_FILENAME}')
+  export_npz(model, f'{MODELS_DIR}/{NUMPY_MODEL_FILENAME}', scaler)
+
+  # check the exported model against the Keras model on random TBs in the valid range
+  X = np.random.default_rng(0).uniform(100, 300, size=(10000, model.input_shape[1])).astype(np.float32)
+  max_diff = verify_export(model, NumpyMLP(f'{MODELS_DIR}/{NUMPY_MODEL_FILENAME}'), X, scaler)
+  print(f'exported {NUMPY_MODEL_FILENAME} (max difference with the Keras model: {max_diff})')
@@ -0,0 +1,181 @@
+import os
+import time
+import zlib
+import h5py
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from gmi_utils import read_granule, MISSING_VALUE
+from profile_utils import profile_stage
+
+'''
+Write the predicted surface precipitation into HDF5 files with the layout of the 2A GPROF product.
+
+The predictions of a granule are written into the S1 group as the 2A.GPM.GMI.GPROF2021v1 granules that
+02_map_products_precipitation.py reads: S1/Latitude, S1/Longitude and S1/surfacePrecipitation, (scans, pixels)
+float32 datasets in which the missing values are -9999.9, declared by their _FillValue and missing_value attributes
+so that netCDF4 and xarray mask them too. The granules can be read and mapped with read_granule and
+plot_rr like the GPROF granules. The other layers of the ensemble predictions (see ensemble_utils) are written next
+to surfacePrecipitation, e.g. rr_std as S1/surfacePrecipitationStd and rr_q95 as S1/surfacePrecipitationQ95.
+
+The datasets are chunked by blocks of whole scans, so that reading the scans that cross an area of interest (as
+read_granule does) only decompresses the chunks of those scans. The chunks are compressed with the HDF5 shuffle and
+deflate (gzip) filters, so any HDF5 or NetCDF reader can decompress them, but the compression is done in a pool of
+threads (zlib releases the GIL) and the compressed chunks are written directly into the file with
+write_direct_chunk, rather than by the single threaded filter pipeline of the HDF5 library.
+
+The rain rates can optionally be rounded to a number of decimals (as the least_significant_digit option of netCDF4)
+so that the trailing bits of the float32 values are zero and compress much better.
+'''
+
+# the number of scans of a chunk, a chunk of 128 scans of 221 float32 pixels is 110 KB
+SCAN_CHUNK = 128
+
+# the deflate compression level
+COMPRESSION_LEVEL = 4
+
+# the number of threads compressing the chunks
+COMPRESSION_THREADS = min(4, os.cpu_count())
+
+# the filename prefix of the prediction files
+PREDICTION_FILE_PREFIX = 'MLP-RR.'
+
+# the datasets of the S1 group of the layers of a prediction
+LAYER_DATASETS = {
+  'lat': 'Latitude',
+  'lon': 'Longitude',
+  'rr': 'surfacePrecipitation',
+  'rr_std': 'surfacePrecipitationStd'
+}
+
+
+def layer_dataset(layer):
+  ''' The path in the file of the dataset of a layer of a prediction, e.g. S1/surfacePrecipitationQ95 for rr_q95. '''
+
+  if layer in LAYER_DATASETS:
+    return f'S1/{LAYER_DATASETS[layer]}'
+
+  if layer.startswith('rr_'):
+    return f"S1/surfacePrecipitation{layer[3:].capitalize()}"
+
+  raise ValueError(f'unknown prediction layer {layer}')
+
+
+def prediction_filename(granule_path):
+  ''' The filename of the prediction file of a 1C GMI granule. '''
+
+  return PREDICTION_FILE_PREFIX + os.path.basename(granule_path)
+
+
+def round_bits(values, least_significant_digit):
+  ''' Round the values to a power of two step finer than the given number of decimals, so that the trailing bits of the mantissas are zero. '''
+
+  bits = int(np.ceil(np.log2(10.0 ** least_significant_digit)))
+  scale = np.float32(2.0 ** bits)
+
+  return np.round(values * scale) / scale
+
+
+def shuffle_bytes(chunk):
+  ''' Reorder the bytes of a chunk as the HDF5 shuffle filter does: the first byte of every value, then the second byte, ... '''
+
+  return chunk.view(np.uint8).reshape(-1, chunk.dtype.itemsize).T.tobytes()
+
+
+def compress_chunk(chunk, level=COMPRESSION_LEVEL):
+  ''' Shuffle and deflate a chunk as the HDF5 shuffle and deflate filters do. '''
+
+  return zlib.compress(shuffle_bytes(np.ascontiguousarray(chunk)), level)
+
+
+def write_dataset(group, name, values, scan_chunk, level, executor):
+  ''' Write a (scans, pixels) float32 dataset chunked by whole scans, its chunks compressed in the threads of the executor. '''
+
+  n_scans, n_pixels = values.shape
+  chunk_scans = max(1, min(scan_chunk, n_scans))
+
+  dataset = group.create_dataset(name, shape=values.shape, dtype=np.float32, chunks=(chunk_scans, n_pixels),
+    compression='gzip', compression_opts=level, shuffle=True, fillvalue=np.float32(MISSING_VALUE))
+
+  dataset.attrs['CodeMissingValue'] = str(MISSING_VALUE)
+  # the CF attributes of the missing value, so that netCDF4 and xarray mask it when they read the file
+  dataset.attrs['_FillValue'] = np.float32(MISSING_VALUE)
+  dataset.attrs['missing_value'] = np.float32(MISSING_VALUE)
+  dataset.attrs['DimensionNames'] = 'nscan,npixel'
+
+  def chunks():
+    for start in range(0, n_scans, chunk_scans):
+      chunk = values[start:start + chunk_scans]
+
+      # the chunks are always whole, the last one is padded with missing values
+      if len(chunk) < chunk_scans:
+        chunk = np.concatenate([chunk, np.full((chunk_scans - len(chunk), n_pixels), MISSING_VALUE, dtype=np.float32)])
+
+      yield chunk
+
+  # the chunks are compressed concurrently and written in order
+  for i, compressed in enumerate(executor.map(lambda chunk: compress_chunk(chunk, level), chunks())):
+    dataset.id.write_direct_chunk((i * chunk_scans, 0), compressed)
+
+  return dataset
+
+
+def write_prediction(file_path, prediction, attributes=None, scan_chunk=SCAN_CHUNK, level=COMPRESSION_LEVEL,
+  threads=COMPRESSION_THREADS, least_significant_digit=None):
+  ''' Write the layers of a prediction ('lat', 'lon', 'rr' and the ensemble layers) into an HDF5 file with the 2A GPROF layout.
+
+  The attributes (e.g. the source granule and the model) are written as attributes of the file. The file is written
+  into a temporary file renamed into place so that a prediction file is never seen half written.
+  '''
+
+  tmp_path = file_path + '.tmp'
+
+  with profile_stage('save', np.size(prediction['rr'])):
+    with h5py.File(tmp_path, 'w') as hf, ThreadPoolExecutor(max_workers=threads) as executor:
+      hf.attrs['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+      for name, value in (attributes or {}).items():
+        hf.attrs[name] = value
+
+      group = hf.create_group('S1')
+
+      for layer, values in prediction.items():
+        values = np.array(values, dtype=np.float32)
+
+        if layer not in ('lat', 'lon'):
+          # negative values are missing values in the GPROF layout, the linear output of the model can predict small
+          # negative rain rates which are written as no rain rather than as missing
+          values[values < 0] = 0
+          if least_significant_digit is not None:
+            values = round_bits(values, least_significant_digit)
+
+        values[np.isnan(values)] = MISSING_VALUE
+
+        dataset = write_dataset(group, layer_dataset(layer).split('/')[1], values, scan_chunk, level, executor)
+        dataset.attrs['units'] = 'degrees' if layer in ('lat', 'lon') else 'mm/hr'
+
+    os.replace(tmp_path, file_path)
+
+  return file_path
+
+
+def read_prediction(file_path, lat_bounds=None, lon_bounds=None):
+  ''' Read the layers of a prediction file written by write_prediction, only keeping the scans that cross the area of interest.
+
+  Returns a dictionary of (scans, pixels) float32 arrays keyed by layer ('lat', 'lon', 'rr', ...) with missing values
+  set to NaN, empty if the prediction does not cross the area of interest.
+  '''
+
+  with h5py.File(file_path, 'r') as hf:
+    datasets = {name: f'S1/{name}' for name in hf['S1']}
+
+  layers = {}
+  for name, path in datasets.items():
+    layer = next((layer for layer, dataset in LAYER_DATASETS.items() if dataset == name), None)
+    if layer is None and name.startswith('surfacePrecipitation'):
+      layer = 'rr_' + name[len('surfacePrecipitation'):].lower()
+    if layer is not None:
+      layers[path] = layer
+
+  data = read_granule(file_path, list(layers), lat_bounds, lon_bounds)
+
+  return {layers[path]: values for path, values in data.items()}
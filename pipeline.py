@@ -0,0 +1,355 @@
+import os
+import numpy as np
+
+from constants import *
+from profile_utils import profile_stage
+
+'''
+The steps of the pipeline as importable functions: download the data products, map the TBs and the surface
+precipitation of a granule, train the model and predict the surface precipitation of a granule.
+
+They are run by the numbered scripts 00 to 04 and by the subcommands of cli.py, and can be reused from other code.
+
+The heavy modules are only imported on the code path that needs them: matplotlib and Basemap when a figure is
+drawn, xarray when the training dataset is read, and TensorFlow when a model is trained or when a model that was not
+exported for the NumPy inference engine is loaded. Predicting the surface precipitation of a granule without
+plotting it only imports NumPy, h5py and SciPy (the KD-tree collocating the S1 and S2 swaths, see regrid_utils).
+'''
+
+# the model hyperparameters
+
+# the learning rate is the step size at each iteration while moving toward a minimum of a loss function
+LEARNING_RATE = 0.001
+
+# an epoch in machine learning means one complete pass of the training dataset through the algorithm
+# this is the maximum number of epochs, the training stops early once the validation loss stops improving
+EPOCHS = 1600
+
+# the number of epochs without improvement of the validation loss after which the training stops
+# the weights of the epoch with the best validation loss are restored
+PATIENCE = 50
+
+# the batch size is the number of training examples utilized in one iteration
+# a large batch size should make the training faster but may lead to memory saturation
+BATCH_SIZE = 8000
+
+
+def download_products(data_dir=DATA_DIR, urls=DATA_URLS):
+  ''' Download the data products that haven't already been downloaded.
+
+  The downloads run concurrently, interrupted downloads are resumed and completed downloads are checked against the manifest.
+  Returns the urls of the failed downloads.
+  '''
+
+  from download_utils import download_data
+
+  # Create the data directory if it doesn't exist
+  if not os.path.exists(data_dir):
+    os.makedirs(data_dir)
+
+  return download_data(urls, data_dir)
+
+
+def read_tb_channels(file_path, lat_bounds=None, lon_bounds=None):
+  ''' Read the TBs of the vertically and horizontally polarized GMI channels of a 1C granule.
+
+  Returns the S1 latitude and longitude and the lists of (title, TB) channels of each polarization.
+  A ValueError is raised if the granule does not cross the area of interest.
+  '''
+
+  from gmi_utils import read_granule
+
+  # properties of the six GMI frequencies are determined by whether the TB measurement is warmer or colder than the background
+  # see: D'Adderio et al. 10.1016/j.atmosres.2022.106174
+  # https://www.sciencedirect.com/science/article/pii/S0169809522001600
+
+  # only read the scans that cross the area of interest, the missing values are NaNed as they are read
+  data = read_granule(file_path,
+    variables = ['S1/Latitude', 'S1/Longitude', 'S1/Tc', 'S2/Tc'],
+    lat_bounds = lat_bounds,
+    lon_bounds = lon_bounds)
+
+  if not data:
+    raise ValueError(f'{file_path} does not cross the area of interest')
+
+  # fetch TB data from Swath S1
+  lat_S1 = data['S1/Latitude']
+  lon_S1 = data['S1/Longitude']
+
+  # fetch the GPM Common Calibrated Brightness Temperature for channels 1 through 9
+  TB = data['S1/Tc']
+
+  # Central frequency: 10.65 GHz, IFOV size: 19x32 km
+  # TB warmer than background: emission from large raindrops (lower rain layers)
+  TB_10v = TB[:,:,0] # Vertical polarization
+  TB_10h = TB[:,:,1] # Horizontal polarization
+
+  # Central frequency: 18.7 GHz, IFOV size: 11x18 km
+  # TB warmer than background: emission from large raindrops (rain)
+  TB_19v = TB[:,:,2] # Vertical polarization
+  TB_19h = TB[:,:,3] # Horizontal polarization
+
+  # Central frequency: 23.8 GHz, IFOV size: 9.2x15 km
+  # TB warmer than background:
+  #   - emission from large raindrops (rain)
+  #   - emission from water vapour
+  TB_23v = TB[:,:,4] # Vertical polarization
+
+  # Central frequency: 36.5 GHz, IFOV size: 8.6x14 km
+  # TB warmer than background: emission from raindrops (rain)
+  # TB colder than background: scattering by large and dense ice (e.g. hail – deep convection)
+  TB_37v = TB[:,:,5] # Vertical polarization
+  TB_37h = TB[:,:,6] # Horizontal polarization
+
+  # Central frequency: 89.0 GHz, IFOV size: 4.4x7.2 km
+  # TB warmer than background: emission from water vapour and cloud liquid water
+  # TB colder than background: scattering by precipitating heavily rimed ice (e.g., graupel – convection/deep convection)
+  TB_89v = TB[:,:,7] # Vertical polarization
+  TB_89h = TB[:,:,8] # Horizontal polarization
+
+  # fetch the GPM Common Calibrated Brightness Temperature for channels 10 and 11 from Swath S2
+  TB = data['S2/Tc']
+
+  # Central frequency: 166.5 GHz, IFOV size: 4.4x7.2 km
+  # TB warmer than background: emission from water vapour and cloud liquid water
+  # TB colder than background: scattering by less dense ice (snowflakes and aggregates – stratiform/convective precip)
+  TB_166v = TB[:,:,0] # Vertical polarization
+  TB_166h = TB[:,:,1] # Horizontal polarization
+
+  # collect the the vertically polarized TB data into a list
+  # each list item is data for a channel
+  TBs_V = [
+    ('TB 10.65 GHz (V)', TB_10v),
+    ('TB 18.7 GHz (V)', TB_19v),
+    ('TB 23.8 GHz (V)', TB_23v),
+    ('TB 36.5 GHz (V)', TB_37v),
+    ('TB 89.0 GHz (V)', TB_89v),
+    ('TB 166.5 GHz (V)', TB_166v)]
+
+  # collect the the horizontally polarized TB data into a list
+  # each list item is data for a channel
+  TBs_H = [
+    ('TB 10.65 GHz (H)', TB_10h),
+    ('TB 18.7 GHz (H)', TB_19h),
+    None, # todo: look into why there is no horizontally polarized TB data in this channel
+    ('TB 36.5 GHz (H)', TB_37h),
+    ('TB 89.0 GHz (H)', TB_89h),
+    ('TB 166.5 GHz (H)', TB_166h)]
+
+  return lat_S1, lon_S1, TBs_V, TBs_H
+
+
+def map_tb(file_path, lat_bounds, lon_bounds, filepaths=None, colorAxisMin=130, colorAxisMax=300):
+  ''' Map the vertically and horizontally polarized TBs of a 1C granule.
+
+  The figures are shown, or rendered into the (vertical, horizontal) image files of filepaths in parallel worker processes.
+  '''
+
+  from plot_utils import plot_tb_all, render_parallel
+
+  lat, lon, TBs_V, TBs_H = read_tb_channels(file_path, lat_bounds, lon_bounds)
+
+  # the map projection and coast lines are cached and only the data within the area of interest is drawn
+  plot_tb_all_kwargs = {
+    'lat': lat,
+    'lon': lon,
+    'lat_bounds': lat_bounds,
+    'lon_bounds': lon_bounds,
+    'colorAxisMin': colorAxisMin,
+    'colorAxisMax': colorAxisMax
+  }
+
+  if filepaths:
+    render_parallel([
+      (plot_tb_all, dict(plot_tb_all_kwargs, TBs = TBs_V, filepath = filepaths[0])),
+      (plot_tb_all, dict(plot_tb_all_kwargs, TBs = TBs_H, filepath = filepaths[1]))
+    ])
+
+  else:
+    plot_tb_all(TBs_V, **plot_tb_all_kwargs)
+    plot_tb_all(TBs_H, **plot_tb_all_kwargs)
+
+
+def map_rr(file_path, lat_bounds, lon_bounds, show=True, filepath=None, colorAxisMin=0, colorAxisMax=40):
+  ''' Map the surface precipitation of a 2A GPROF granule.
+
+  A ValueError is raised if the granule does not cross the area of interest.
+  '''
+
+  from gmi_utils import read_granule
+  from plot_utils import plot_rr
+
+  # only read the scans that cross the area of interest, the -9999.9 missing values are NaNed as they are read
+  data = read_granule(file_path,
+    variables = ['S1/Latitude', 'S1/Longitude', 'S1/surfacePrecipitation'],
+    lat_bounds = lat_bounds,
+    lon_bounds = lon_bounds)
+
+  if not data:
+    raise ValueError(f'{file_path} does not cross the area of interest')
+
+  # plot the surface precipitation, use the "rr" variable to denote "rainfall rate"
+  plot_rr(
+    RR = data['S1/surfacePrecipitation'],
+    lat = data['S1/Latitude'],
+    lon = data['S1/Longitude'],
+    lat_bounds = lat_bounds,
+    lon_bounds = lon_bounds,
+    colorAxisMin = colorAxisMin,
+    colorAxisMax = colorAxisMax,
+    title = "Estimated Rainfall Rate",
+    show = show,
+    filepath = filepath)
+
+
+def train_model(data_filepath=f'{DATA_DIR}/{DATA_FILENAME_GMI_DPR_RR}', models_dir=MODELS_DIR, learning_rate=LEARNING_RATE,
+  epochs=EPOCHS, patience=PATIENCE, batch_size=BATCH_SIZE, export_fused=True, export_numpy=True, show=True, filepath=None):
+  ''' Train the MLP on the training dataset and save it with its scaler statistics into the models directory.
+
+  The model is also exported with the feature scaling folded into its first layer (export_fused) and for the NumPy
+  inference engine (export_numpy), the exports of a previous model that are not replaced are removed. The learning curves are shown and/or written into the image file of filepath.
+  Returns the trained model and its training history.
+  '''
+
+  from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
+  from feature_store import open_feature_store
+  from model_utils import save_scaler, fuse_scaler, standardize
+  from numpy_mlp import NumpyMLP, export_npz, verify_export
+  from train_utils import make_dataset, build_model
+
+  # Create the models directory if it doesn't exist
+  if not os.path.exists(models_dir):
+    os.makedirs(models_dir)
+
+  # the dataset is converted once into a memory-mapped float32 feature store (rebuilt only when the nc file changes)
+  # the training data (the TBs) and the target labels (the surface rain rate) are split as by split_dataset
+  with profile_stage('read'):
+    store = open_feature_store(data_filepath, os.path.splitext(data_filepath)[0] + '.store')
+
+  # that amount of data that we're dealing with
+  print('The shape of the TB features data is', store.tb.shape)
+  print('The shape of the surface rain rate label data is', store.rr.shape)
+
+  # the training and test datasets are zero-copy views of the store
+  X_train, y_train = store.train()
+  X_test, y_test = store.test()
+
+  # scaling: standardize features by removing the mean and scaling to unit variance
+  # mean and variance were calculated on the training dataset when the store was built
+  scaler = store.scaler
+
+  # mean and variance are applied to the training dataset and to the test dataset
+  X_train_scaled = standardize(X_train, scaler)
+  X_test_scaled = standardize(X_test, scaler)
+
+  # the mean and variance are saved with the model so that the same scaling is applied to the inputs at prediction time
+  save_scaler(scaler, f'{models_dir}/{SCALER_FILENAME}')
+
+  # print the result of splitting the dataset
+  print('The shape of the training dataset is', X_train.shape)
+  print('The shape of the test dataset is', X_test.shape)
+
+  # set the input shape
+  input_shape = X_train.shape[1]
+  print(f'Feature shape, i.e. number of TB channels: {input_shape}')
+
+  # a feed forward neural network with 2 sigmoid hidden layers of 20 and 10 perceptrons and a linear output,
+  # trained with Adam to minimize the mean squared error (MSE), the mean absolute error (MAE) is also reported
+  model = build_model(input_shape, learning_rate=learning_rate)
+  model.summary()
+
+  # stop the training once the validation loss stops improving and restore the best weights
+  # the best model is also checkpointed so that it is not lost if the training is interrupted
+  callbacks = [
+    EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True),
+    ModelCheckpoint(f'{models_dir}/{CHECKPOINT_FILENAME}', monitor='val_loss', save_best_only=True)
+  ]
+
+  # the training dataset, the batch size and the number of epochs to be used re defined
+  # validation is also carried out
+  # monitoring loss and metrics on the test dataset
+  # at the end of each epoch
+  # for trainig with GPU (Faster) wrap the training in: with tf.device("/device:GPU:0"):
+  with profile_stage('train', len(X_train_scaled)):
+    history = model.fit(
+      make_dataset(X_train_scaled, y_train, batch_size, shuffle=True),
+      epochs = epochs,
+      validation_data = make_dataset(X_test_scaled, y_test, batch_size),
+      callbacks = callbacks)
+
+  # the model is saved at the end of the training phase in an HFD5 output file
+  with profile_stage('save'):
+    model.save(f'{models_dir}/{MODEL_FILENAME}')
+
+  # fold the feature scaling into the first layer so that no normalization pass is needed at prediction time
+  if export_fused:
+    with profile_stage('save'):
+      fused_model = fuse_scaler(model, scaler)
+      fused_model.save(f'{models_dir}/{FUSED_MODEL_FILENAME}')
+
+  # otherwise the fused previous model is removed, load_predictor would prefer it to the new model and scaler
+  elif os.path.exists(f'{models_dir}/{FUSED_MODEL_FILENAME}'):
+    os.remove(f'{models_dir}/{FUSED_MODEL_FILENAME}')
+
+  # export the weights for the NumPy inference engine and check that its predictions match the model's on the test dataset
+  if export_numpy:
+    with profile_stage('save'):
+      export_npz(model, f'{models_dir}/{NUMPY_MODEL_FILENAME}', scaler)
+    verify_export(model, NumpyMLP(f'{models_dir}/{NUMPY_MODEL_FILENAME}'), X_test, scaler)
+
+  # otherwise the export of the previous model is removed, load_predictor would prefer it to the new model
+  elif os.path.exists(f'{models_dir}/{NUMPY_MODEL_FILENAME}'):
+    os.remove(f'{models_dir}/{NUMPY_MODEL_FILENAME}')
+
+  # plot the training's learning curve
+  if show or filepath:
+    from plot_utils import plot_learning_curves
+    plot_learning_curves(history, show=show, filepath=filepath)
+
+  return model, history
+
+
+def predict_precipitation(file_path, lat_bounds=None, lon_bounds=None, models_dir=MODELS_DIR, precision='float32', cache_dir=CACHE_DIR, verbose=False):
+  ''' Predict the surface precipitation of a 1C GMI granule within the area of interest with the trained model.
+
+  The swath is streamed through the model in batches and the missing pixels are left as NaN in the predicted swath.
+  If a cache directory is given the predictions are cached, predicting the same granule again with the same model
+  skips the reading and the inference.
+  Returns a dictionary with the S1 'lat' and 'lon' and the predicted 'rr' swaths, or None if the granule does not cross the area of interest.
+  '''
+
+  from predict_utils import load_predictor, predict_granule, predictor_files
+
+  # the inputs are standardized with the mean and variance calculated on the training dataset
+  predict = load_predictor(models_dir, verbose=verbose, precision=precision)
+
+  cache = None
+  if cache_dir:
+    from cache_utils import ArrayCache
+    cache = ArrayCache(cache_dir)
+
+  # only the scans that cross the area of interest are read
+  return predict_granule(file_path, predict,
+    lat_bounds = lat_bounds,
+    lon_bounds = lon_bounds,
+    cache = cache,
+    model_files = predictor_files(models_dir, precision),
+    precision = precision)
+
+
+def map_prediction(prediction, lat_bounds, lon_bounds, show=True, filepath=None, colorAxisMin=0, colorAxisMax=40):
+  ''' Map the surface precipitation predicted by predict_precipitation. '''
+
+  from plot_utils import plot_rr
+
+  plot_rr(
+    RR = prediction['rr'],
+    lat = prediction['lat'],
+    lon = prediction['lon'],
+    lat_bounds = lat_bounds,
+    lon_bounds = lon_bounds,
+    colorAxisMin = colorAxisMin,
+    colorAxisMax = colorAxisMax,
+    title = "Estimated Surface Precipitation",
+    show = show,
+    filepath = filepath)
@@ -1,33 +1,96 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import warnings
 
+from profile_utils import profile_stage
+
 # resolution: use 'h' for high or 'f' for full (much slower render time)
 BASEMAP_RESOLUTION = 'l'
 
-def plot_tb(TB, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax):
-  ''' Use Basemap to visualize brightness temperature (TB) products on a map.'''
+# fast rendering: reuse the map projection and coastlines of a bounding box and only draw the data within the bounding box
+FAST_RENDERING = True
+
+
+@lru_cache(maxsize=16)
+def get_basemap(lat_bounds, lon_bounds, resolution=BASEMAP_RESOLUTION):
+  ''' Build the map of a bounding box, cached so that its projection and coastline geometry are only computed once.
 
-  # the basemap bounding
- 
-  m = Basemap(projection = 'merc',
-    resolution = BASEMAP_RESOLUTION,
+  The bounds must be given as tuples so that they can be used as cache keys.
+  '''
+
+  from mpl_toolkits.basemap import Basemap
+
+  return Basemap(projection = 'merc',
+    resolution = resolution,
     lat_ts = 20,
     llcrnrlat = lat_bounds[0],
     urcrnrlat = lat_bounds[1],
     llcrnrlon = lon_bounds[0],
     urcrnrlon = lon_bounds[1])
 
+
+def crop_to_bounds(data, lat, lon, lat_bounds, lon_bounds):
+  ''' Crop a swath to the scans and pixels that cross the bounding box, keeping one pixel of margin on each side. '''
+
+  inside = (lat >= lat_bounds[0]) & (lat <= lat_bounds[1]) & (lon >= lon_bounds[0]) & (lon <= lon_bounds[1])
+
+  rows = np.flatnonzero(inside.any(axis=1))
+  cols = np.flatnonzero(inside.any(axis=0))
+
+  # nothing to draw
+  if rows.size == 0:
+    return data[:0, :0], lat[:0, :0], lon[:0, :0]
+
+  rows = slice(max(rows[0] - 1, 0), rows[-1] + 2)
+  cols = slice(max(cols[0] - 1, 0), cols[-1] + 2)
+
+  return data[rows, cols], lat[rows, cols], lon[rows, cols]
+
+
+def draw_swath(data, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, fast=FAST_RENDERING):
+  ''' Draw swath data on the map of the bounding box with the coast lines, parallels and meridians.
+
+  In fast mode the map is reused from the cache and the swath is cropped to the bounding box and projected once
+  before being drawn with pcolormesh. Otherwise a new map is built and the full swath is drawn with pcolor.
+  '''
+
+  from mpl_toolkits.basemap import Basemap
+
+  if fast:
+    m = get_basemap(tuple(lat_bounds), tuple(lon_bounds))
+    data, lat, lon = crop_to_bounds(data, lat, lon, lat_bounds, lon_bounds)
+
+  else:
+    # the basemap bounding
+    m = Basemap(projection = 'merc',
+      resolution = BASEMAP_RESOLUTION,
+      lat_ts = 20,
+      llcrnrlat = lat_bounds[0],
+      urcrnrlat = lat_bounds[1],
+      llcrnrlon = lon_bounds[0],
+      urcrnrlon = lon_bounds[1])
+
   # set min/max values of the colorbar
   with warnings.catch_warnings():
     warnings.simplefilter("ignore")
-    im1 = m.pcolor(lon[:], lat[:] ,TB[:],
-      shading = 'nearest',
-      cmap = 'turbo',
-      latlon = True,
-      vmin = colorAxisMin,
-      vmax = colorAxisMax)
+
+    # pcolormesh can't handle missing coordinates so fall back on pcolor if there are any
+    if fast and np.all(np.isfinite(lat)) and np.all(np.isfinite(lon)):
+      x, y = m(lon, lat)
+      m.pcolormesh(x, y, np.ma.masked_invalid(data),
+        shading = 'nearest',
+        cmap = 'turbo',
+        vmin = colorAxisMin,
+        vmax = colorAxisMax)
+
+    else:
+      m.pcolor(lon[:], lat[:], data[:],
+        shading = 'nearest',
+        cmap = 'turbo',
+        latlon = True,
+        vmin = colorAxisMin,
+        vmax = colorAxisMax)
 
   # draw the coast lines
   m.drawcoastlines()
@@ -40,14 +103,25 @@ def plot_tb(TB, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax):
   m.drawparallels(parallels, labels=[1,0,0,0], fontsize=15)
   m.drawmeridians(meridians, labels=[0,0,0,1], fontsize=15)
 
-  # add colorbar.
-  cbar = m.colorbar(location='right', pad="5%")
-  cbar.set_label('Kelvin (K)') # temperature in Kelvin
+  return m
 
 
-def plot_tb_all(TBs, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, show=True, filepath=None):
+def plot_tb(TB, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, fast=FAST_RENDERING):
+  ''' Use Basemap to visualize brightness temperature (TB) products on a map.'''
+
+  with profile_stage('plot', np.size(TB)):
+    m = draw_swath(TB, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, fast)
+
+    # add colorbar.
+    cbar = m.colorbar(location='right', pad="5%")
+    cbar.set_label('Kelvin (K)') # temperature in Kelvin
+
+
+def plot_tb_all(TBs, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, show=True, filepath=None, fast=FAST_RENDERING):
   ''' Loop through TB data for each channel and plot the data on a map.'''
 
+  import matplotlib.pyplot as plt
+
   # create a figure to draw the data into a map plot
   fig = plt.figure(figsize=(24, 10))
 
@@ -61,7 +135,7 @@ def plot_tb_all(TBs, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMa
     # check that TB data is given
     if TB:
       # draw the plot for the TB at the given channel
-      plot_tb(TB[1], lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax)
+      plot_tb(TB[1], lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, fast)
 
       # plot title
       plt.title(TB[0])
@@ -75,65 +149,41 @@ def plot_tb_all(TBs, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMa
 
   # write the plots into an image file
   if filepath:
-    plt.savefig(
-      f'{filepath}',
-      bbox_inches='tight',
-      dpi = 300)
+    with profile_stage('save'):
+      plt.savefig(
+        f'{filepath}',
+        bbox_inches='tight',
+        dpi = 300)
 
   # show the plots!
   if show: plt.show()
 
 
-def plot_rr(RR, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, title="Surface Precipitation", show=True, filepath=None):
+def plot_rr(RR, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, title="Surface Precipitation", show=True, filepath=None, fast=FAST_RENDERING):
   ''' Use Basemap to visualize rainfall rates (surface precipitation) products on a map.'''
 
+  import matplotlib.pyplot as plt
+
   fig = plt.figure()
   ax = fig.add_subplot(111)
 
-  # the basemap bounding
-  # resolution: use 'h' for high or 'f' for full (much slower render time)
-  m = Basemap(projection = 'merc',
-    resolution = BASEMAP_RESOLUTION,
-    lat_ts = 20,
-    llcrnrlat = lat_bounds[0],
-    urcrnrlat = lat_bounds[1],
-    llcrnrlon = lon_bounds[0],
-    urcrnrlon = lon_bounds[1])
+  with profile_stage('plot', np.size(RR)):
+    m = draw_swath(RR, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, fast)
 
-  # set min/max values of the colorbar
-  with warnings.catch_warnings():
-    warnings.simplefilter("ignore")
-    im1 = m.pcolor(lon[:], lat[:], RR[:],
-      shading = 'nearest',
-      cmap = 'turbo',
-      latlon = True,
-      vmin = colorAxisMin,
-      vmax = colorAxisMax)
-
-  # draw coast lines
-  m.drawcoastlines()
-
-  # set parallels and meridians
-  dparal = 2 #separation in deg between drawn parallels
-  parallels = np.arange(lat_bounds[0], lat_bounds[1], dparal)
-  dmerid = 2 #separation in deg between drawn meridians
-  meridians = np.arange(lon_bounds[0], lon_bounds[1], dmerid)
-  m.drawparallels(parallels, labels=[1,0,0,0], fontsize=15)
-  m.drawmeridians(meridians, labels=[0,0,0,1], fontsize=15)
-
-  # add colorbar.
-  cbar = m.colorbar(location='right', pad="5%")
-  cbar.set_label('Rainfall Rate [mm/h]')
+    # add colorbar.
+    cbar = m.colorbar(location='right', pad="5%")
+    cbar.set_label('Rainfall Rate [mm/h]')
 
   # add title
   plt.title(title, fontsize=12)
 
   # write the plots into an image file
   if filepath:
-    plt.savefig(
-      f'{filepath}',
-      bbox_inches='tight',
-      dpi = 300)
+    with profile_stage('save'):
+      plt.savefig(
+        f'{filepath}',
+        bbox_inches='tight',
+        dpi = 300)
 
   # show the plots!
   if show: plt.show()
@@ -142,6 +192,8 @@ def plot_rr(RR, lat, lon, lat_bounds, lon_bounds, colorAxisMin, colorAxisMax, ti
 def plot_learning_curves(history, show=True, filepath=None):
   ''' Plot the training's learning curve. '''
 
+  import matplotlib.pyplot as plt
+
   plt.title('Learning Curves')
   plt.xlabel('Epoch')
   plt.ylabel('MSE loss')
@@ -151,10 +203,37 @@ def plot_learning_curves(history, show=True, filepath=None):
 
   # write the plots into an image file
   if filepath:
-    plt.savefig(
-      f'{filepath}',
-      bbox_inches='tight',
-      dpi = 300)
+    with profile_stage('save'):
+      plt.savefig(
+        f'{filepath}',
+        bbox_inches='tight',
+        dpi = 300)
 
   # show the plots!
-  if show: plt.show()
\ No newline at end of file
+  if show: plt.show()
+
+
+def render_figure(plot_function, kwargs):
+  ''' Render a figure into its image file in a worker process. '''
+
+  import matplotlib.pyplot as plt
+
+  # no display in the worker processes
+  plt.switch_backend('Agg')
+
+  plot_function(**kwargs, show=False)
+  plt.close('all')
+
+  return kwargs['filepath']
+
+
+def render_parallel(jobs, max_workers=None):
+  ''' Render figures into image files in parallel worker processes.
+
+  Each job is a tuple of a plot function of this module (e.g. plot_tb_all or plot_rr) and of its keyword arguments, which must include the filepath.
+  Returns the filepaths of the rendered figures.
+  '''
+
+  with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    futures = [executor.submit(render_figure, plot_function, kwargs) for plot_function, kwargs in jobs]
+    return [future.result() for future in futures]
@@ -0,0 +1,229 @@
+import os
+import numpy as np
+
+from constants import *
+from gmi_utils import read_tb
+from profile_utils import profile_stage, profile_count
+
+'''
+Stream a swath of TB measurements through a model.
+
+The swath is walked through in blocks of scans, pixels with missing TB values are dropped before they reach
+the model, the remaining pixels are predicted in fixed-size batches and the predictions are scattered back
+into a NaN-filled output swath of the same shape as the input. The memory used by the model is bounded by the
+batch size and the compute is only spent on valid pixels, whatever the number of scans in the granule.
+
+The model is loaded once with load_predictor and can then be used to predict any number of granules.
+'''
+
+# number of scans read from the swath at a time
+SCAN_BLOCK_SIZE = 64
+
+# number of pixels given to the model at a time
+PREDICT_BATCH_SIZE = 8192
+
+
+def iter_scan_blocks(TB, block_size=SCAN_BLOCK_SIZE):
+  ''' Yield the index of the first scan and the TB data of each block of scans in the swath. '''
+
+  for start in range(0, TB.shape[0], block_size):
+    yield start, TB[start:start + block_size]
+
+
+def iter_valid_pixels(TB, block_size=SCAN_BLOCK_SIZE):
+  ''' Yield the flat swath indices and the TB vectors of the pixels that have a valid TB in every channel.
+
+  A TB is not valid if it is missing (NaN) or not positive.
+  '''
+
+  n_pixels = TB.shape[1]
+  n_channels = TB.shape[2]
+
+  for start, block in iter_scan_blocks(TB, block_size):
+    X = block.reshape(-1, n_channels)
+
+    # NaN comparisons are false so missing values are dropped along with the non positive ones
+    valid = np.flatnonzero(np.all(X > 0, axis=1))
+
+    if valid.size > 0:
+      yield start * n_pixels + valid, X[valid]
+
+
+def iter_batches(TB, batch_size=PREDICT_BATCH_SIZE, block_size=SCAN_BLOCK_SIZE):
+  ''' Regroup the valid pixels of the swath into batches of a fixed size (the last batch may be smaller).
+
+  The batch buffers are reused from one batch to the next so they must be consumed before the next batch is requested.
+  '''
+
+  n_channels = TB.shape[2]
+
+  X_batch = np.empty((batch_size, n_channels), dtype=np.float32)
+  idx_batch = np.empty(batch_size, dtype=np.int64)
+  n = 0
+
+  for idx, X in iter_valid_pixels(TB, block_size):
+    offset = 0
+
+    # fill the batch buffer and hand it over each time it is full
+    while offset < len(idx):
+      count = min(batch_size - n, len(idx) - offset)
+      X_batch[n:n + count] = X[offset:offset + count]
+      idx_batch[n:n + count] = idx[offset:offset + count]
+      n += count
+      offset += count
+
+      if n == batch_size:
+        yield idx_batch, X_batch
+        n = 0
+
+  # the remaining pixels
+  if n > 0:
+    yield idx_batch[:n], X_batch[:n]
+
+
+def predict_swath(predict, TB, batch_size=PREDICT_BATCH_SIZE, block_size=SCAN_BLOCK_SIZE):
+  ''' Predict the surface rain rate of every valid pixel of a (scans, pixels, channels) TB swath.
+
+  The predict argument is a function that takes a (batch, channels) array and returns one prediction per row.
+  Returns a (scans, pixels) float32 array in which the pixels with missing TB values are NaN.
+  '''
+
+  n_pixels = TB.shape[0] * TB.shape[1]
+  rr = np.full(n_pixels, np.nan, dtype=np.float32)
+  n_predicted = 0
+
+  with profile_stage('predict', n_pixels):
+    for idx, X in iter_batches(TB, batch_size, block_size):
+      rr[idx] = np.reshape(predict(X), -1)
+      n_predicted += len(idx)
+
+  profile_count('pixels_predicted', n_predicted)
+  profile_count('pixels_masked', n_pixels - n_predicted)
+
+  return rr.reshape(TB.shape[0], TB.shape[1])
+
+
+def predictor_files(models_dir=MODELS_DIR, precision='float32'):
+  ''' The files of the model that load_predictor loads, in the same order of preference. '''
+
+  numpy_model_path = f'{models_dir}/{NUMPY_MODEL_FILENAME}'
+  fused_model_path = f'{models_dir}/{FUSED_MODEL_FILENAME}'
+
+  if precision == 'int8':
+    return [f'{models_dir}/{INT8_MODEL_FILENAME}']
+  if os.path.exists(numpy_model_path):
+    return [numpy_model_path]
+  if os.path.exists(fused_model_path):
+    return [fused_model_path]
+
+  return [f'{models_dir}/{MODEL_FILENAME}', f'{models_dir}/{SCALER_FILENAME}']
+
+
+def load_predictor(models_dir=MODELS_DIR, verbose=False, precision='float32'):
+  ''' Load the trained model and return a function that predicts the surface rain rate of a (batch, 13) array of raw TBs.
+
+  The NumPy inference engine is used if the model was exported for it, so that TensorFlow is not imported.
+  Otherwise the Keras model is loaded, either with the feature scaling fused into its first layer or with the saved scaler statistics.
+  The NumPy inference engine can compute in 'float64', 'float32' or 'float16', or use the 'int8' quantized model
+  written by 08_quantization_report.py. The Keras model only computes in float32, the other precisions need the
+  NumPy export and a ValueError is raised without it.
+  '''
+
+  from model_utils import load_scaler, standardize
+  from quantize_utils import load_variant
+
+  # the scaling: the inputs are standardized with the mean and variance calculated on the training dataset
+  numpy_model_path = f'{models_dir}/{NUMPY_MODEL_FILENAME}'
+  fused_model_path = f'{models_dir}/{FUSED_MODEL_FILENAME}'
+
+  if precision == 'int8' or os.path.exists(numpy_model_path):
+    # the NumPy inference engine doesn't need TensorFlow and the standardization is folded into its first layer
+    model = load_variant(precision, numpy_model_path, f'{models_dir}/{INT8_MODEL_FILENAME}')
+    return model.predict
+
+  if precision != 'float32':
+    raise ValueError(f'{numpy_model_path} not found, predicting in {precision} needs the model exported for the NumPy inference engine')
+
+  import tensorflow as tf
+
+  if os.path.exists(fused_model_path):
+    # the standardization is folded into the first layer of the fused model so it takes the raw TBs
+    model = tf.keras.models.load_model(fused_model_path, compile=False)
+    predict = model.predict_on_batch
+
+  else:
+    # standardize each batch with the scaler statistics saved at training time
+    model = tf.keras.models.load_model(f'{models_dir}/{MODEL_FILENAME}')
+    scaler = load_scaler(f'{models_dir}/{SCALER_FILENAME}')
+    predict = lambda X: model.predict_on_batch(standardize(X, scaler))
+
+  # check its architecture
+  if verbose:
+    model.summary()
+
+  return predict
+
+
+def tb_params(lat_bounds=None, lon_bounds=None, collocate=True):
+  ''' The parameters of the TB model input read by read_tb, for the cache keys of the TBs and of the predictions. '''
+
+  params = {'lat_bounds': lat_bounds, 'lon_bounds': lon_bounds, 'collocate': collocate}
+
+  if collocate:
+    from regrid_utils import COLLOCATION_MAX_DISTANCE_KM
+    params['collocation_max_distance_km'] = COLLOCATION_MAX_DISTANCE_KM
+
+  return params
+
+
+def load_tb(file_path, lat_bounds=None, lon_bounds=None, cache=None, collocate=True):
+  ''' Read the 13 channels TB model input of a granule with read_tb, through the cache if one is given.
+
+  Returns the S1 latitude, longitude and the merged TB arrays, or None if the granule does not cross the area of interest.
+  '''
+
+  if cache is None:
+    return read_tb(file_path, lat_bounds, lon_bounds, collocate)
+
+  def compute():
+    tb_input = read_tb(file_path, lat_bounds, lon_bounds, collocate)
+    return {} if tb_input is None else dict(zip(['lat', 'lon', 'TB'], tb_input))
+
+  key = cache.key('tb', [file_path], tb_params(lat_bounds, lon_bounds, collocate))
+  arrays = cache.cached(key, compute)
+
+  if not arrays:
+    return None
+
+  return arrays['lat'], arrays['lon'], arrays['TB']
+
+
+def predict_granule(file_path, predict, lat_bounds=None, lon_bounds=None, cache=None, model_files=None, precision='float32'):
+  ''' Predict the surface rain rate of a 1C GMI granule within the area of interest.
+
+  If a cache is given the preprocessed TBs are cached, and so are the predictions if the model_files the predict
+  function was loaded from are given (see predictor_files), so that predicting the same granule again with the same
+  model skips the reading and the inference.
+  Returns a dictionary with the S1 'lat' and 'lon' and the predicted 'rr' swaths, or None if the granule does not cross the area of interest.
+  '''
+
+  def compute():
+    tb_input = load_tb(file_path, lat_bounds, lon_bounds, cache)
+    if tb_input is None:
+      return {}
+
+    lat, lon, TB = tb_input
+
+    return {
+      'lat': lat,
+      'lon': lon,
+      'rr': predict_swath(predict, TB)
+    }
+
+  if cache is None or model_files is None:
+    prediction = compute()
+  else:
+    key = cache.key('rr', [file_path] + list(model_files), dict(tb_params(lat_bounds, lon_bounds), precision=precision))
+    prediction = cache.cached(key, compute)
+
+  return prediction or None
@@ -0,0 +1,206 @@
+import atexit
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+'''
+Instrument the pipeline with named stage timers, peak memory tracking and counters.
+
+The pipeline functions wrap their stages (read, mask, scale, predict, plot, save, ...) in profile_stage and count
+the pixels they process with profile_count. Profiling is off by default and then costs nothing but a function call.
+It is turned on by setting the PROFILE_ENV environment variable to the path of the profile, or with the --profile
+option of the scripts that have command line arguments:
+  GMI_PROFILE=profile.json python 04_predict_precipitation.py
+  GMI_PROFILE=profile.csv python 02_map_products_precipitation.py
+
+The profile is written when the script exits, as JSON or as CSV depending on the extension of its path. For each
+stage it gives the number of calls, the total time, the pixels processed per second and the peak memory allocated
+by the stage (traced with tracemalloc, which slows down the allocations). Nested stages are timed both on their own
+and as part of their enclosing stage. The profile also records the counters, the wall time and the peak resident
+memory of the process.
+
+Worker processes profile their stages without writing a profile: they are collected with snapshot and merged into
+the profile of the main process with merge.
+'''
+
+# the environment variable with the path of the profile
+PROFILE_ENV = 'GMI_PROFILE'
+
+
+class Profiler:
+  ''' Accumulate the timings, peak memory and pixel counts of the stages and the counters of a run. '''
+
+  def __init__(self):
+
+    self.enabled = False
+    self.path = None
+    self.started = time.time()
+
+    self.stages = {}
+    self.counters = {}
+    self.lock = threading.Lock()
+
+    # the stack of the stages being run by each thread
+    self.local = threading.local()
+
+  def enable(self, path=None, trace_memory=True):
+    ''' Turn profiling on, the profile is written into the given path when the process exits. '''
+
+    self.enabled = True
+    self.path = path
+
+    if trace_memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+    if path:
+      atexit.register(self.write)
+
+  @contextmanager
+  def stage(self, name, pixels=None):
+    ''' Time a stage and track the peak memory it allocates. '''
+
+    stack = getattr(self.local, 'stack', None)
+    if stack is None:
+      stack = self.local.stack = []
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+      # fold the peak so far into the enclosing stages before the peak is reset for this stage
+      current, peak = tracemalloc.get_traced_memory()
+      for frame in stack:
+        frame['peak'] = max(frame['peak'], peak)
+      tracemalloc.reset_peak()
+
+    frame = {'memory': current if tracing else 0, 'peak': current if tracing else 0}
+    stack.append(frame)
+    start = time.perf_counter()
+
+    try:
+      yield
+
+    finally:
+      seconds = time.perf_counter() - start
+      stack.pop()
+
+      if tracing:
+        frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        for enclosing in stack:
+          enclosing['peak'] = max(enclosing['peak'], frame['peak'])
+
+      self.record(name, seconds, frame['peak'] - frame['memory'], pixels)
+
+  def record(self, name, seconds, peak_memory_bytes=0, pixels=None, calls=1):
+    ''' Add a measurement of a stage. '''
+
+    with self.lock:
+      stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_memory_bytes': 0, 'pixels': 0})
+      stage['calls'] += calls
+      stage['seconds'] += seconds
+      stage['peak_memory_bytes'] = max(stage['peak_memory_bytes'], peak_memory_bytes)
+      stage['pixels'] += pixels or 0
+
+  def count(self, name, value=1):
+    ''' Add to a counter. '''
+
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + int(value)
+
+  def snapshot(self):
+    ''' The stages and counters of the profile, e.g. to return them from a worker process. '''
+
+    with self.lock:
+      return {'stages': {name: dict(stage) for name, stage in self.stages.items()}, 'counters': dict(self.counters)}
+
+  def reset(self):
+    ''' Clear the stages and counters, e.g. between the tasks of a worker process. '''
+
+    with self.lock:
+      self.stages.clear()
+      self.counters.clear()
+
+  def merge(self, snapshot):
+    ''' Add the stages and counters of a snapshot taken in another process. '''
+
+    for name, stage in snapshot['stages'].items():
+      self.record(name, stage['seconds'], stage['peak_memory_bytes'], stage['pixels'], stage['calls'])
+    for name, value in snapshot['counters'].items():
+      self.count(name, value)
+
+  def report(self):
+    ''' The profile of the run. '''
+
+    snapshot = self.snapshot()
+
+    for stage in snapshot['stages'].values():
+      stage['pixels_per_second'] = stage['pixels'] / stage['seconds'] if stage['pixels'] and stage['seconds'] > 0 else None
+
+    return {
+      'script': os.path.basename(sys.argv[0]),
+      'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+      'wall_seconds': time.time() - self.started,
+      # in kilobytes on Linux
+      'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+      'stages': snapshot['stages'],
+      'counters': snapshot['counters']
+    }
+
+  def write(self, path=None):
+    ''' Write the profile as JSON, or as CSV if the path ends with .csv. '''
+
+    path = path or self.path
+    report = self.report()
+
+    if path.endswith('.csv'):
+      with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['kind', 'name', 'calls', 'seconds', 'pixels', 'pixels_per_second', 'peak_memory_bytes', 'value'])
+        for name, stage in report['stages'].items():
+          writer.writerow(['stage', name, stage['calls'], stage['seconds'], stage['pixels'], stage['pixels_per_second'], stage['peak_memory_bytes'], None])
+        for name, value in report['counters'].items():
+          writer.writerow(['counter', name, None, None, None, None, None, value])
+        writer.writerow(['run', 'wall_seconds', None, None, None, None, None, report['wall_seconds']])
+        writer.writerow(['run', 'max_rss_bytes', None, None, None, None, None, report['max_rss_bytes']])
+
+    else:
+      with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+# the profiler of the process
+profiler = Profiler()
+
+
+def profile_stage(name, pixels=None):
+  ''' Time a stage of the pipeline if profiling is on, e.g. with profile_stage('read', n_pixels): ... '''
+
+  if not profiler.enabled:
+    return nullcontext()
+
+  return profiler.stage(name, pixels)
+
+
+def profile_count(name, value=1):
+  ''' Add to a counter of the pipeline if profiling is on. '''
+
+  if profiler.enabled:
+    profiler.count(name, value)
+
+
+def enable_profiling(path=None):
+  ''' Turn profiling on and write the profile into the given path, or into the path of the PROFILE_ENV environment variable. '''
+
+  path = path or os.environ.get(PROFILE_ENV)
+  if path and not profiler.enabled:
+    # only the main process writes the profile
+    profiler.enable(path if multiprocessing.parent_process() is None else None)
+
+
+# profiling is turned on for any script run with the environment variable set
+enable_profiling()
@@ -0,0 +1,253 @@
+import os
+import time
+import numpy as np
+
+from cache_utils import file_digest
+from numpy_mlp import NumpyMLP, DEFAULT_MAX_BATCH_SIZE
+
+'''
+Reduced-precision and int8 post-training quantized inference of the MLP exported with numpy_mlp.export_npz.
+
+The float64, float32 and float16 variants compute the forward pass of the NumPy inference engine in that precision.
+
+The int8 variant is quantized after training and calibrated on a sample of the training TBs:
+  - the input of each layer is quantized per feature to 8-bit codes between its calibrated min and max
+    (x ~ min + step * q, q in 0..255), and the min and step are folded into the kernel and bias of the layer
+  - the folded kernel is quantized symmetrically per output unit to int8 (W ~ scale * Wq, Wq in -127..127)
+  - the layer output is the integer product of the codes and the int8 kernel, rescaled and shifted by the bias
+
+NumPy has no int8 matrix multiplication, so the integer product is computed by the float32 BLAS on the integer
+codes: the products and their sums are integers below 2**24 so they are exact, and the results are the same as
+with an int8 kernel accumulating in int32.
+
+The int8 model is stamped with the SHA-256 digest of the exported model it was quantized from, and it is only loaded
+next to that same exported model, so that a retrained model is never predicted with the int8 weights of the previous one.
+
+Each variant is compared with the full precision (float64) model on the held-out test split by evaluate_variants.
+
+The float16 and int8 variants simulate the accuracy of reduced-precision inference, they are neither faster nor
+smaller in memory than float32 with NumPy: NumPy has no float16 or int8 matrix multiplication kernels, so float16
+runs an unoptimized loop (more than 10x slower than float32) and int8 runs the float32 BLAS on the integer codes plus
+the quantization of every layer input (about half the throughput of float32), with the kernels held as float32.
+Only the stored int8 weights are smaller. float32 remains the fastest variant for production.
+'''
+
+# the number of training pixels used to calibrate the int8 quantization
+CALIBRATION_PIXELS = 100000
+
+# the number of levels of the 8-bit codes of the layer inputs and of the int8 kernels
+INPUT_LEVELS = 255
+KERNEL_LEVELS = 127
+
+# the number of pixels per batch when evaluating a variant
+EVALUATION_BATCH_SIZE = 8192
+
+
+def calibrate(mlp, X):
+  ''' Find the min and max of each feature of the input of each layer over the calibration inputs. '''
+
+  ranges = []
+
+  out = np.asarray(X, dtype=mlp.dtype)
+  for kernel, bias, activation in zip(mlp.kernels, mlp.biases, mlp.activations):
+    ranges.append((out.min(axis=0), out.max(axis=0)))
+
+    # the float forward pass of the layer, on a copy so that the calibration inputs are left untouched
+    out = out @ kernel + bias
+    if activation == 'sigmoid':
+      with np.errstate(over='ignore'):
+        out = 1 / (1 + np.exp(-out))
+    elif activation == 'relu':
+      out = np.maximum(out, 0)
+    elif activation == 'tanh':
+      out = np.tanh(out)
+
+  return ranges
+
+
+def quantize_mlp(mlp, X_calibration, filepath, source_path=None):
+  ''' Quantize an MLP to int8 with the input ranges calibrated on the given inputs and save it into a .npz file.
+
+  The digest of the source_path file the MLP was loaded from is saved with the int8 model (see load_variant).
+  '''
+
+  arrays = {}
+
+  if source_path is not None:
+    arrays['source_sha256'] = np.array(file_digest(source_path))
+
+  for i, (kernel, bias, (x_min, x_max)) in enumerate(zip(mlp.kernels, mlp.biases, calibrate(mlp, X_calibration))):
+    kernel = kernel.astype(np.float64)
+    bias = bias.astype(np.float64)
+
+    # the step of the 8-bit codes of each input feature, constant features get a step of 1 (their code is always 0)
+    step = (x_max - x_min) / INPUT_LEVELS
+    step[step == 0] = 1
+
+    # fold the codes offset and step into the layer: x @ W + b = q @ (step * W) + (x_min @ W + b)
+    folded_kernel = step[:, np.newaxis] * kernel
+    folded_bias = x_min @ kernel + bias
+
+    # symmetric int8 quantization of each output unit of the folded kernel
+    scale = np.abs(folded_kernel).max(axis=0) / KERNEL_LEVELS
+    scale[scale == 0] = 1
+
+    arrays[f'kernel_{i}'] = np.rint(folded_kernel / scale).astype(np.int8)
+    arrays[f'kernel_scale_{i}'] = scale.astype(np.float32)
+    arrays[f'bias_{i}'] = folded_bias.astype(np.float32)
+    arrays[f'input_min_{i}'] = x_min.astype(np.float32)
+    arrays[f'input_step_{i}'] = step.astype(np.float32)
+
+  np.savez(filepath, activations=np.array(mlp.activations), **arrays)
+
+
+class QuantizedMLP:
+  ''' Forward pass of an int8 MLP saved with quantize_mlp, with the same interface as NumpyMLP.
+
+  It gives the predictions of int8 inference but computes them with float32 kernels, slower than NumpyMLP in float32.
+  '''
+
+  precision = 'int8'
+
+  def __init__(self, filepath, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+
+    with np.load(filepath) as npz:
+      self.activations = [str(activation) for activation in npz['activations']]
+      n_layers = len(self.activations)
+
+      self.kernels = [npz[f'kernel_{i}'] for i in range(n_layers)]
+      self.kernel_scales = [npz[f'kernel_scale_{i}'] for i in range(n_layers)]
+      self.biases = [npz[f'bias_{i}'] for i in range(n_layers)]
+      self.input_mins = [npz[f'input_min_{i}'] for i in range(n_layers)]
+      self.input_steps = [npz[f'input_step_{i}'] for i in range(n_layers)]
+
+      # the digest of the exported model the int8 model was quantized from
+      self.source_digest = str(npz['source_sha256']) if 'source_sha256' in npz else None
+
+    # the int8 kernels as float32 integers for the BLAS, NumPy has no int8 matrix multiplication
+    self.blas_kernels = [kernel.astype(np.float32) for kernel in self.kernels]
+
+    self.n_features = self.kernels[0].shape[0]
+    self._allocate(max_batch_size)
+
+  def _allocate(self, max_batch_size):
+    ''' Preallocate the codes and the output buffer of each layer. '''
+
+    self.max_batch_size = max_batch_size
+    self.codes = [np.empty((max_batch_size, kernel.shape[0]), dtype=np.float32) for kernel in self.kernels]
+    self.buffers = [np.empty((max_batch_size, kernel.shape[1]), dtype=np.float32) for kernel in self.kernels]
+
+  def predict(self, X):
+    ''' Predict one value per row of the (batch, features) input array. '''
+
+    n = X.shape[0]
+    if n > self.max_batch_size:
+      self._allocate(n)
+
+    out = np.asarray(X, dtype=np.float32)
+
+    for i, activation in enumerate(self.activations):
+
+      # quantize the layer input to its 8-bit codes
+      codes = np.subtract(out, self.input_mins[i], out=self.codes[i][:n])
+      codes /= self.input_steps[i]
+      np.rint(codes, out=codes)
+      np.clip(codes, 0, INPUT_LEVELS, out=codes)
+
+      # the exact integer product of the codes and the int8 kernel, rescaled
+      out = np.matmul(codes, self.blas_kernels[i], out=self.buffers[i][:n])
+      out *= self.kernel_scales[i]
+      out += self.biases[i]
+
+      if activation == 'sigmoid':
+        np.negative(out, out=out)
+        with np.errstate(over='ignore'):
+          np.exp(out, out=out)
+        out += 1
+        np.reciprocal(out, out=out)
+      elif activation == 'relu':
+        np.maximum(out, 0, out=out)
+      elif activation == 'tanh':
+        np.tanh(out, out=out)
+
+    return out[:, 0].copy()
+
+
+def load_variant(precision, numpy_model_path, int8_model_path, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+  ''' Load the inference variant of the given precision: 'float64', 'float32', 'float16' or 'int8'.
+
+  The int8 model is only loaded if it was quantized from the current exported model, a ValueError is raised otherwise.
+  '''
+
+  if precision == 'int8':
+    mlp = QuantizedMLP(int8_model_path, max_batch_size)
+
+    if not os.path.exists(numpy_model_path) or mlp.source_digest != file_digest(numpy_model_path):
+      raise ValueError(f'{int8_model_path} was not quantized from {numpy_model_path}, quantize it again with 08_quantization_report.py')
+
+    return mlp
+
+  return NumpyMLP(numpy_model_path, max_batch_size, precision)
+
+
+def model_bytes(mlp):
+  ''' The size in bytes of the stored weights of a variant (the int8 kernels are held as float32 at runtime). '''
+
+  return sum(kernel.nbytes for kernel in mlp.kernels) + sum(bias.nbytes for bias in mlp.biases)
+
+
+def predict_batched(mlp, X, batch_size=EVALUATION_BATCH_SIZE):
+  ''' Predict the rows of X in batches and return the float64 predictions with the elapsed time in seconds. '''
+
+  predictions = np.empty(len(X), dtype=np.float64)
+
+  start = time.perf_counter()
+  for i in range(0, len(X), batch_size):
+    predictions[i:i + batch_size] = mlp.predict(X[i:i + batch_size])
+  seconds = time.perf_counter() - start
+
+  return predictions, seconds
+
+
+def error_metrics(predicted, expected):
+  ''' The mean absolute error, root mean square error and maximum absolute error of the predictions. '''
+
+  error = predicted - expected
+
+  return {
+    'mae': float(np.mean(np.abs(error))),
+    'rmse': float(np.sqrt(np.mean(error ** 2))),
+    'max_abs_error': float(np.max(np.abs(error)))
+  }
+
+
+def evaluate_variants(variants, X_test, y_test, reference='float64', batch_size=EVALUATION_BATCH_SIZE):
+  ''' Compare the predictions of the inference variants on the test split.
+
+  The variants are given as a dictionary of models by precision and must include the reference (full precision) model.
+  For each variant the report gives its errors against the observed rain rates ('truth') and against the reference
+  model predictions ('vs_reference'), its throughput in pixels per second, relative to the float32 variant if there
+  is one, and the size of its stored weights.
+  '''
+
+  X_test = np.ascontiguousarray(X_test, dtype=np.float32)
+  y_test = np.asarray(y_test, dtype=np.float64)
+
+  predictions = {}
+  report = {}
+
+  for precision, mlp in variants.items():
+    predictions[precision], seconds = predict_batched(mlp, X_test, batch_size)
+
+    report[precision] = {
+      'truth': error_metrics(predictions[precision], y_test),
+      'pixels_per_second': len(X_test) / seconds,
+      'model_bytes': model_bytes(mlp)
+    }
+
+  for precision in variants:
+    report[precision]['vs_reference'] = error_metrics(predictions[precision], predictions[reference])
+    if 'float32' in variants:
+      report[precision]['relative_throughput'] = report[precision]['pixels_per_second'] / report['float32']['pixels_per_second']
+
+  return report
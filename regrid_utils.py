@@ -0,0 +1,235 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from scipy.spatial import cKDTree
+
+'''
+Resample swath data onto a regular lat/lon grid.
+
+The GMI swaths are irregular: each pixel has its own latitude and longitude. To put swath data on a regular grid
+(e.g. over LAT_BOUNDS_IONIAN_SEA/LON_BOUNDS_IONIAN_SEA or a global grid), a KD-tree spatial index is built from the
+swath pixel positions expressed as 3-D unit vectors on the sphere, so that distances are valid everywhere including
+across the antimeridian and near the poles. The nearest swath pixels of all the grid cells are found in a single
+vectorized query and their indices and distances are cached per grid, so that resampling many variables or
+resampling the same grid again doesn't query the index again.
+
+Example:
+  regridder = SwathRegridder(lat_S1, lon_S1)
+  grid_lat, grid_lon = make_grid(LAT_BOUNDS_IONIAN_SEA, LON_BOUNDS_IONIAN_SEA, resolution=0.1)
+  gridded = regridder.resample({'rr': rr, 'tb': TB}, grid_lat, grid_lon, method='idw')
+
+The same index is used to collocate the S1 and S2 swaths of a GMI granule: each S1 pixel is paired with its nearest
+S2 pixel rather than with the S2 pixel at the same array position. The pairing only depends on the orbit geometry so
+it is cached and reused for all the channels, and for the granules sharing the same geometry. Its first computation
+costs about 0.3 ms per scan: a few ms to tens of ms for the scans crossing an area of interest (gmi_utils.read_tb
+only reads and collocates those), but about a second for a full 2963 scans orbit.
+'''
+
+# the mean radius of the Earth in km
+EARTH_RADIUS_KM = 6371.0
+
+# grid cells further than this distance from any swath pixel are left empty (NaN)
+MAX_DISTANCE_KM = 15.0
+
+# the number of neighbours used by the inverse distance weighting
+IDW_NEIGHBOURS = 4
+
+# the power of the inverse distance weighting
+IDW_POWER = 2
+
+# S1 pixels further than this distance from any S2 pixel are left without S2 values
+COLLOCATION_MAX_DISTANCE_KM = 10.0
+
+# the number of orbit geometries whose S1/S2 collocation is cached
+COLLOCATION_CACHE_SIZE = 8
+
+# the cached S1/S2 collocations, keyed by orbit geometry
+collocation_cache = OrderedDict()
+
+
+def to_unit_vectors(lat, lon):
+  ''' Convert latitudes and longitudes in degrees into an (n, 3) array of 3-D unit vectors. '''
+
+  lat = np.radians(np.asarray(lat, dtype=np.float64).reshape(-1))
+  lon = np.radians(np.asarray(lon, dtype=np.float64).reshape(-1))
+
+  cos_lat = np.cos(lat)
+
+  return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def km_to_chord(distance_km):
+  ''' Convert a great circle distance in km into the chord distance between the unit vectors. '''
+
+  return 2 * np.sin(np.asarray(distance_km) / (2 * EARTH_RADIUS_KM))
+
+
+def chord_to_km(chord):
+  ''' Convert the chord distance between unit vectors into a great circle distance in km. '''
+
+  return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def geometry_key(*arrays):
+  ''' Hash the coordinate arrays of a geometry so that it can be used as a cache key. '''
+
+  sha1 = hashlib.sha1()
+  for array in arrays:
+    sha1.update(str(np.shape(array)).encode())
+    sha1.update(np.ascontiguousarray(array).tobytes())
+
+  return sha1.hexdigest()
+
+
+def make_grid(lat_bounds, lon_bounds, resolution):
+  ''' Build the latitudes and longitudes of the cell centers of a regular grid with the given resolution in degrees.
+
+  Returns two (rows, columns) arrays, with the latitude increasing with the rows and the longitude with the columns.
+  '''
+
+  lats = np.arange(lat_bounds[0] + resolution / 2, lat_bounds[1], resolution)
+  lons = np.arange(lon_bounds[0] + resolution / 2, lon_bounds[1], resolution)
+
+  grid_lon, grid_lat = np.meshgrid(lons, lats)
+
+  return grid_lat, grid_lon
+
+
+class SwathRegridder:
+  ''' Resample the variables of a swath onto grids using a KD-tree index of the swath pixel positions. '''
+
+  def __init__(self, lat, lon):
+
+    self.shape = np.shape(lat)
+
+    # only index the pixels with a valid position
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    self.valid_index = np.flatnonzero(valid)
+    # the sliding midpoint tree is faster to build on the regularly spaced swath pixels
+    self.tree = cKDTree(to_unit_vectors(lat[valid], lon[valid]), balanced_tree=False, compact_nodes=False)
+
+    # the neighbours of the grids that were already queried
+    self.cache = {}
+
+  def neighbours(self, grid_lat, grid_lon, k=1, max_distance_km=MAX_DISTANCE_KM):
+    ''' Find the k nearest swath pixels of each grid cell within the maximum distance.
+
+    Returns the (cells, k) distances in km and the (cells, k) flat swath pixel indices, -1 where there is no pixel within the maximum distance.
+    The cells without a valid position (NaN latitude or longitude) have no neighbours.
+    '''
+
+    key = (geometry_key(grid_lat, grid_lon), k, max_distance_km)
+
+    if key not in self.cache:
+      grid_lat = np.asarray(grid_lat).reshape(-1)
+      grid_lon = np.asarray(grid_lon).reshape(-1)
+
+      distance = np.full((len(grid_lat), k), np.inf)
+      swath_idx = np.full((len(grid_lat), k), -1, dtype=np.int64)
+
+      # only query the cells with a valid position, the tree rejects NaN coordinates
+      valid = np.flatnonzero(np.isfinite(grid_lat) & np.isfinite(grid_lon))
+
+      if len(valid) and len(self.valid_index):
+        chord, idx = self.tree.query(to_unit_vectors(grid_lat[valid], grid_lon[valid]), k=k, distance_upper_bound=km_to_chord(max_distance_km), workers=-1)
+
+        chord = chord.reshape(-1, k)
+        idx = idx.reshape(-1, k)
+
+        # the tree returns an index one past the last pixel when there is no neighbour within the maximum distance
+        found = idx < len(self.valid_index)
+        distance[valid] = np.where(found, chord_to_km(np.where(found, chord, 0)), np.inf)
+        swath_idx[valid] = np.where(found, self.valid_index[np.where(found, idx, 0)], -1)
+
+      self.cache[key] = (distance, swath_idx)
+
+    return self.cache[key]
+
+  def resample(self, variables, grid_lat, grid_lon, method='nearest', max_distance_km=MAX_DISTANCE_KM, k=IDW_NEIGHBOURS, power=IDW_POWER):
+    ''' Resample swath variables onto the grid with nearest neighbour or inverse distance weighting ('idw') resampling.
+
+    The variables are given as a dictionary of (scans, pixels) or (scans, pixels, channels) swath arrays.
+    All the variables are stacked so that they are gathered from their neighbours in a single pass.
+    Missing (NaN) values are ignored by the inverse distance weighting.
+    Returns a dictionary of (rows, columns) or (rows, columns, channels) float32 grids in which the empty cells are NaN.
+    '''
+
+    n_pixels = self.shape[0] * self.shape[1]
+    names = list(variables)
+
+    # stack the variables into a single (pixels, channels) matrix
+    columns = [np.asarray(variables[name], dtype=np.float32).reshape(n_pixels, -1) for name in names]
+    n_columns = [column.shape[1] for column in columns]
+    values = np.concatenate(columns, axis=1)
+
+    if method == 'nearest':
+      distance, idx = self.neighbours(grid_lat, grid_lon, 1, max_distance_km)
+      idx = idx[:, 0]
+
+      resampled = np.full((len(idx), values.shape[1]), np.nan, dtype=np.float32)
+      found = idx >= 0
+      resampled[found] = values[idx[found]]
+
+    elif method == 'idw':
+      distance, idx = self.neighbours(grid_lat, grid_lon, k, max_distance_km)
+
+      # gather the values of the neighbours: (cells, k, channels)
+      neighbour_values = values[np.where(idx >= 0, idx, 0)]
+
+      # weight the neighbours by their inverse distance, the missing neighbours and values get no weight
+      weights = 1 / np.maximum(distance, 1e-6) ** power
+      weights = np.where(idx >= 0, weights, 0)[:, :, np.newaxis] * ~np.isnan(neighbour_values)
+
+      with np.errstate(invalid='ignore', divide='ignore'):
+        resampled = (np.nansum(weights * neighbour_values, axis=1) / weights.sum(axis=1)).astype(np.float32)
+
+    else:
+      raise ValueError(f'unknown resampling method {method}')
+
+    # unstack the variables and give them the shape of the grid
+    gridded = {}
+    offset = 0
+    for name, n in zip(names, n_columns):
+      grid = resampled[:, offset:offset + n].reshape(np.shape(grid_lat) + (n,))
+      gridded[name] = grid if np.ndim(variables[name]) == 3 else grid[..., 0]
+      offset += n
+
+    return gridded
+
+
+def collocate(lat_S1, lon_S1, lat_S2, lon_S2, max_distance_km=COLLOCATION_MAX_DISTANCE_KM):
+  ''' Find the nearest S2 pixel of each S1 pixel within the maximum distance.
+
+  Returns a (scans, pixels) array of flat S2 pixel indices, -1 where there is no S2 pixel within the maximum distance
+  or where the S1 pixel has no valid position. The S2 pixels without a valid position are never collocated. The result is cached per orbit geometry.
+
+  The KD-tree is built on all the given S2 pixels and queried with all the given S1 pixels, so the swaths should be
+  restricted to the scans of the area of interest first: an uncached full orbit takes about a second.
+  '''
+
+  key = (geometry_key(lat_S1, lon_S1, lat_S2, lon_S2), max_distance_km)
+
+  if key in collocation_cache:
+    collocation_cache.move_to_end(key)
+
+  else:
+    distance, idx = SwathRegridder(lat_S2, lon_S2).neighbours(lat_S1, lon_S1, 1, max_distance_km)
+    collocation_cache[key] = idx.reshape(np.shape(lat_S1))
+
+    # evict the least recently used geometry
+    if len(collocation_cache) > COLLOCATION_CACHE_SIZE:
+      collocation_cache.popitem(last=False)
+
+  return collocation_cache[key]
+
+
+def collocate_values(values, idx):
+  ''' Gather the (scans, pixels, channels) S2 values at the collocated S1 pixels, NaN where there is no collocated S2 pixel. '''
+
+  values = values.reshape(-1, values.shape[2])
+
+  collocated = np.full(idx.shape + (values.shape[1],), np.nan, dtype=values.dtype)
+  found = idx >= 0
+  collocated[found] = values[idx[found]]
+
+  return collocated
@@ -0,0 +1,394 @@
+import asyncio
+import json
+import os
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import *
+
+'''
+A long-lived local prediction service.
+
+The model is loaded once when the service starts and stays loaded, so a prediction request doesn't pay for the
+import of TensorFlow and the loading of the model. The service speaks a minimal HTTP/1.1 with JSON bodies over a
+local TCP port or a unix socket, and keeps the connections alive between requests:
+  GET  /health           the service status and the loaded model
+  GET  /stats            request, batch and latency counters
+  POST /predict          {"tb": [[13 TBs], ...]} -> {"rr": [...]}, null for the pixels with a missing TB
+  POST /predict_granule  {"path": ..., "lat_bounds": [..], "lon_bounds": [..], "output": optional HDF5 path}
+
+The TB vectors of concurrent requests are merged into micro-batches: the first waiting request opens a batch, which
+is predicted as soon as it is full or when the batch deadline has passed, so that many small swath pieces are
+predicted in a few large batches while no request waits for more than the deadline. The batches are predicted one
+at a time in a single model thread so that the event loop keeps accepting requests. Granules are read in a pool of
+threads and their pixels are predicted through the same micro-batches.
+'''
+
+# the host and port of the service
+HOST = '127.0.0.1'
+PORT = 8765
+
+# the maximum number of pixels of a micro-batch
+MAX_BATCH_PIXELS = 65536
+
+# the maximum time in seconds a request waits for its micro-batch to fill up
+BATCH_DEADLINE = 0.005
+
+# the number of threads reading granules
+GRANULE_WORKERS = 4
+
+# the number of most recent request latencies kept per route for the stats
+LATENCY_WINDOW = 10000
+
+# the maximum size of a request body in bytes
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# the reason phrases of the HTTP status codes used by the service
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+  ''' An error answered with an HTTP status code. '''
+
+  def __init__(self, status, message):
+    super().__init__(message)
+    self.status = status
+
+
+class MicroBatcher:
+  ''' Merge the TB vectors of concurrent requests into micro-batches predicted in a single model thread. '''
+
+  def __init__(self, predict, max_batch_pixels=MAX_BATCH_PIXELS, deadline=BATCH_DEADLINE):
+
+    self.predict = predict
+    self.max_batch_pixels = max_batch_pixels
+    self.deadline = deadline
+
+    self.queue = asyncio.Queue()
+    self.model_thread = ThreadPoolExecutor(max_workers=1)
+
+    self.stats = {'requests': 0, 'pixels': 0, 'batches': 0, 'batch_pixels_max': 0, 'predict_seconds': 0.0}
+
+  async def submit(self, X):
+    ''' Predict the rows of a (pixels, channels) array with the next micro-batch. '''
+
+    future = asyncio.get_running_loop().create_future()
+    await self.queue.put((np.asarray(X, dtype=np.float32), future))
+    return await future
+
+  async def next_batch(self):
+    ''' Wait for a first request and collect the requests that arrive until the batch is full or the deadline has passed. '''
+
+    loop = asyncio.get_running_loop()
+
+    batch = [await self.queue.get()]
+    n_pixels = len(batch[0][0])
+    deadline = loop.time() + self.deadline
+
+    while n_pixels < self.max_batch_pixels:
+      timeout = deadline - loop.time()
+      if timeout <= 0:
+        break
+
+      try:
+        item = await asyncio.wait_for(self.queue.get(), timeout)
+      except asyncio.TimeoutError:
+        break
+
+      batch.append(item)
+      n_pixels += len(item[0])
+
+    return batch, n_pixels
+
+  async def run(self):
+    ''' Predict the micro-batches forever. '''
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+      batch, n_pixels = await self.next_batch()
+
+      X = np.concatenate([X for X, future in batch]) if len(batch) > 1 else batch[0][0]
+
+      start = time.perf_counter()
+      try:
+        predictions = await loop.run_in_executor(self.model_thread, self.predict, X)
+      except Exception as e:
+        for X, future in batch:
+          if not future.done():
+            future.set_exception(e)
+        continue
+
+      self.stats['predict_seconds'] += time.perf_counter() - start
+      self.stats['requests'] += len(batch)
+      self.stats['pixels'] += n_pixels
+      self.stats['batches'] += 1
+      self.stats['batch_pixels_max'] = max(self.stats['batch_pixels_max'], n_pixels)
+
+      # hand its predictions back to each request
+      predictions = np.reshape(predictions, -1)
+      offset = 0
+      for X, future in batch:
+        if not future.done():
+          future.set_result(predictions[offset:offset + len(X)])
+        offset += len(X)
+
+
+def to_json_list(values):
+  ''' Convert an array into nested lists in which the NaN values are null. '''
+
+  values = np.asarray(values, dtype=np.float64)
+  return np.where(np.isnan(values), None, values).tolist()
+
+
+class PredictionService:
+  ''' Answer the HTTP requests of the prediction service. '''
+
+  def __init__(self, predict, model_info, max_batch_pixels=MAX_BATCH_PIXELS, deadline=BATCH_DEADLINE, granule_workers=GRANULE_WORKERS):
+
+    self.predict = predict
+    self.model_info = model_info
+    self.max_batch_pixels = max_batch_pixels
+    self.deadline = deadline
+    self.granule_threads = ThreadPoolExecutor(max_workers=granule_workers)
+
+    self.started = time.time()
+    self.latencies = {}
+    self.errors = 0
+
+  async def start(self):
+    ''' Start the micro-batching task, it must be called from the event loop. '''
+
+    self.loop = asyncio.get_running_loop()
+    self.batcher = MicroBatcher(self.predict, self.max_batch_pixels, self.deadline)
+    self.batcher_task = asyncio.create_task(self.batcher.run())
+
+  async def predict_tb(self, body):
+    ''' Predict the rain rate of TB vectors, the vectors with a missing or non positive TB are predicted as NaN. '''
+
+    try:
+      X = np.asarray(body['tb'], dtype=np.float32)
+    except (KeyError, TypeError, ValueError):
+      raise HTTPError(400, 'the body must have a "tb" list of TB vectors')
+
+    if X.ndim == 1:
+      X = X[np.newaxis, :]
+    if X.ndim != 2 or X.shape[1] != self.model_info['n_features']:
+      raise HTTPError(400, f"the TB vectors must have {self.model_info['n_features']} channels")
+
+    rr = np.full(len(X), np.nan, dtype=np.float32)
+
+    # NaN comparisons are false so missing values are dropped along with the non positive ones
+    valid = np.flatnonzero(np.all(X > 0, axis=1))
+    if valid.size > 0:
+      rr[valid] = await self.batcher.submit(X[valid])
+
+    return {'rr': to_json_list(rr)}
+
+  def predict_batch_threadsafe(self, X):
+    ''' Predict a batch with the micro-batches from a granule thread. '''
+
+    return asyncio.run_coroutine_threadsafe(self.batcher.submit(X), self.loop).result()
+
+  async def predict_granule(self, body):
+    ''' Predict the rain rate of a 1C GMI granule, optionally written into an HDF5 file (see output_utils) rather than returned. '''
+
+    from predict_utils import predict_granule
+    from output_utils import write_prediction
+
+    if 'path' not in body:
+      raise HTTPError(400, 'the body must have the "path" of a granule')
+
+    lat_bounds = body.get('lat_bounds')
+    lon_bounds = body.get('lon_bounds')
+
+    try:
+      prediction = await self.loop.run_in_executor(self.granule_threads,
+        predict_granule, body['path'], self.predict_batch_threadsafe, lat_bounds, lon_bounds)
+    except OSError as e:
+      raise HTTPError(400, f'cannot read the granule: {e}')
+
+    if prediction is None:
+      return {'path': body['path'], 'status': 'skipped'}
+
+    result = {
+      'path': body['path'],
+      'status': 'ok',
+      'n_pixels': int(prediction['rr'].size),
+      'n_predicted': int(np.count_nonzero(~np.isnan(prediction['rr'])))
+    }
+
+    if body.get('output'):
+      await self.loop.run_in_executor(self.granule_threads, write_prediction, body['output'], prediction, {'source_granule': os.path.basename(body['path'])})
+      result['output'] = body['output']
+    else:
+      result.update({name: to_json_list(values) for name, values in prediction.items()})
+
+    return result
+
+  def health(self):
+    ''' The status of the service and of the loaded model. '''
+
+    return {'status': 'ok', 'uptime_seconds': time.time() - self.started, 'model': self.model_info}
+
+  def stats(self):
+    ''' The counters of the micro-batches and the latencies of the requests by route. '''
+
+    stats = dict(self.batcher.stats)
+    stats['mean_batch_pixels'] = stats['pixels'] / stats['batches'] if stats['batches'] else 0
+    stats['queued'] = self.batcher.queue.qsize()
+    stats['errors'] = self.errors
+
+    stats['routes'] = {}
+    for route, latencies in self.latencies.items():
+      latencies = np.array(latencies)
+      stats['routes'][route] = {
+        'requests': len(latencies),
+        'mean_ms': float(latencies.mean() * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000)
+      }
+
+    return stats
+
+  async def route(self, method, path, body):
+    ''' Dispatch a request to its handler. '''
+
+    routes = {
+      ('GET', '/health'): lambda: self.health(),
+      ('GET', '/stats'): lambda: self.stats(),
+      ('POST', '/predict'): lambda: self.predict_tb(body),
+      ('POST', '/predict_granule'): lambda: self.predict_granule(body)
+    }
+
+    if (method, path) not in routes:
+      if path in {route_path for route_method, route_path in routes}:
+        raise HTTPError(405, f'{method} is not allowed on {path}')
+      raise HTTPError(404, f'unknown path {path}')
+
+    result = routes[(method, path)]()
+    if asyncio.iscoroutine(result):
+      result = await result
+
+    return result
+
+  async def handle_request(self, reader):
+    ''' Read an HTTP request and answer it.
+
+    Returns the status, the JSON response and whether to keep the connection alive, or None if the connection was closed.
+    '''
+
+    request_line = await reader.readline()
+    if not request_line:
+      return None
+
+    try:
+      method, path, version = request_line.decode('latin-1').split()
+    except ValueError:
+      return 400, {'error': 'malformed request line'}, False
+
+    headers = {}
+    while True:
+      line = await reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        break
+      name, _, value = line.decode('latin-1').partition(':')
+      headers[name.strip().lower()] = value.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+    # the body can't be delimited without a valid length, so the connection is closed
+    try:
+      length = int(headers.get('content-length', 0))
+    except ValueError:
+      return 400, {'error': f"invalid Content-Length {headers['content-length']!r}"}, False
+
+    if length < 0:
+      return 400, {'error': f'invalid Content-Length {length}'}, False
+
+    if length > MAX_BODY_BYTES:
+      return 413, {'error': f'the body is larger than {MAX_BODY_BYTES} bytes'}, False
+
+    path = path.split('?')[0]
+
+    start = time.perf_counter()
+    try:
+      body = json.loads(await reader.readexactly(length)) if length else {}
+      status, response = 200, await self.route(method, path, body)
+    except HTTPError as e:
+      status, response = e.status, {'error': str(e)}
+    except json.JSONDecodeError as e:
+      status, response = 400, {'error': f'the body is not valid JSON: {e}'}
+    except Exception as e:
+      status, response = 500, {'error': f'{type(e).__name__}: {e}'}
+
+    if status != 200:
+      self.errors += 1
+    if status != 404:
+      self.latencies.setdefault(path, deque(maxlen=LATENCY_WINDOW)).append(time.perf_counter() - start)
+
+    return status, response, keep_alive
+
+  async def handle_connection(self, reader, writer):
+    ''' Answer the requests of a connection until it is closed. '''
+
+    try:
+      while True:
+        answer = await self.handle_request(reader)
+        if answer is None:
+          break
+
+        status, response, keep_alive = answer
+        payload = json.dumps(response).encode()
+
+        writer.write(
+          f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+          f'Content-Type: application/json\r\n'
+          f'Content-Length: {len(payload)}\r\n'
+          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+        await writer.drain()
+
+        if not keep_alive:
+          break
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+
+    finally:
+      writer.close()
+
+
+def load_model_info(models_dir, precision):
+  ''' Load the predictor of the service and describe the loaded model. '''
+
+  from predict_utils import load_predictor
+
+  predict = load_predictor(models_dir, precision=precision)
+
+  # the number of input channels, from the model itself
+  n_features = getattr(getattr(predict, '__self__', None), 'n_features', 13)
+
+  return predict, {'models_dir': models_dir, 'precision': precision, 'n_features': n_features}
+
+
+async def serve(models_dir=MODELS_DIR, host=HOST, port=PORT, unix_socket=None, precision='float32',
+  max_batch_pixels=MAX_BATCH_PIXELS, deadline=BATCH_DEADLINE, granule_workers=GRANULE_WORKERS):
+  ''' Load the model and serve the predictions until the service is stopped. '''
+
+  predict, model_info = load_model_info(models_dir, precision)
+
+  service = PredictionService(predict, model_info, max_batch_pixels, deadline, granule_workers)
+  await service.start()
+
+  if unix_socket:
+    server = await asyncio.start_unix_server(service.handle_connection, path=unix_socket)
+  else:
+    server = await asyncio.start_server(service.handle_connection, host, port)
+
+  address = unix_socket or f'http://{host}:{port}'
+  print(f'serving {models_dir} ({precision}) on {address}')
+
+  async with server:
+    await server.serve_forever()
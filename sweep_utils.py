@@ -0,0 +1,172 @@
+import itertools
+import json
+import multiprocessing
+import random
+import sqlite3
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+'''
+Hyperparameter sweeps of the MLP.
+
+A search space maps each hyperparameter to the list of values to try:
+  layers         the widths of the hidden layers, e.g. (20, 10)
+  activation     the activation function of the hidden layers
+  learning_rate  the learning rate of the optimizer
+  batch_size     the number of training examples per iteration
+  optimizer      'adam', 'sgd' or 'rmsprop'
+  epochs         the maximum number of epochs (the training stops early once the validation loss stops improving)
+
+The trials are either every combination of the values (grid search) or random combinations (random search).
+They run concurrently in worker processes, each limited to a number of threads so that the trials share the
+CPU cores rather than compete for all of them, and each capped to a maximum time. The config, metrics
+and wall time of every trial are stored in a local SQLite results table.
+
+The trials are early stopped and ranked on a validation split held out of the training split (its last pixels in
+the order of the NetCDF dataset), the test split is left untouched so that it gives an unbiased estimate of the
+skill of the selected config. The metrics of a trial are the validation metrics of its best epoch, whose weights
+are restored at the end of the training.
+
+The maximum time of a trial is counted from its start, including the reading of the data and the building of the
+model, and checked after every training batch: a trial overruns it by at most a batch and a validation pass.
+'''
+
+# the number of epochs without improvement of the validation loss after which a trial stops
+PATIENCE = 50
+
+# the fraction of the training split held out to early stop and rank the trials
+VALIDATION_FRACTION = 0.2
+
+# the schema of the results table
+RESULTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS trials (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  sweep TEXT,
+  config TEXT,
+  status TEXT,
+  val_mse REAL,
+  val_mae REAL,
+  epochs INTEGER,
+  timed_out INTEGER,
+  seconds REAL,
+  error TEXT
+)'''
+
+
+def grid_search(space):
+  ''' List the configs of every combination of the values in the search space. '''
+
+  names = list(space)
+  return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+def random_search(space, n_trials, seed=None):
+  ''' Draw configs of random combinations of the values in the search space. '''
+
+  rng = random.Random(seed)
+  return [{name: rng.choice(values) for name, values in space.items()} for _ in range(n_trials)]
+
+
+def init_worker(threads):
+  ''' Limit the number of threads of a trial worker process. '''
+
+  from train_utils import limit_threads
+  limit_threads(threads)
+
+
+def run_trial(config, store_dir, max_seconds):
+  ''' Train and evaluate the model of a config in a worker process.
+
+  Returns the result of the trial, a failure is recorded in the result rather than raised.
+  '''
+
+  from model_utils import standardize
+  from feature_store import FeatureStore
+  from train_utils import make_dataset, build_model, time_limit
+  from tensorflow.keras.callbacks import EarlyStopping
+
+  result = {'config': config, 'status': 'ok', 'val_mse': None, 'val_mae': None, 'epochs': None, 'timed_out': False, 'error': None}
+  start = time.perf_counter()
+
+  try:
+    # the same split and scaling as in 03_train_sea_ann.py, the workers share the pages of the memory-mapped store
+    store = FeatureStore(store_dir)
+    X_train, y_train = store.train()
+
+    # the validation pixels are held out of the training split, the test split is not used
+    n_fit = int(len(X_train) * (1 - VALIDATION_FRACTION))
+    X_fit, y_fit = standardize(X_train[:n_fit], store.scaler), y_train[:n_fit]
+    X_validation, y_validation = standardize(X_train[n_fit:], store.scaler), y_train[n_fit:]
+
+    model = build_model(X_fit.shape[1],
+      layers = config['layers'],
+      activation = config['activation'],
+      learning_rate = config['learning_rate'],
+      optimizer = config['optimizer'])
+
+    # the time limit includes the setup of the trial
+    timer = time_limit(max_seconds, start)
+    early_stopping = EarlyStopping(monitor='val_loss', patience=PATIENCE, restore_best_weights=True)
+    history = model.fit(
+      make_dataset(X_fit, y_fit, config['batch_size'], shuffle=True),
+      epochs = config['epochs'],
+      validation_data = make_dataset(X_validation, y_validation, config['batch_size']),
+      callbacks = [early_stopping, timer],
+      verbose = 0)
+
+    # the validation metrics of the best epoch, whose weights are restored
+    best_epoch = int(np.argmin(history.history['val_loss']))
+    result['val_mse'] = history.history['val_loss'][best_epoch]
+    result['val_mae'] = history.history['val_mae'][best_epoch]
+    result['epochs'] = len(history.history['loss'])
+    result['timed_out'] = timer.timed_out
+
+  except Exception as e:
+    result['status'] = 'failed'
+    result['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+  result['seconds'] = time.perf_counter() - start
+
+  return result
+
+
+def save_result(db, sweep, result):
+  ''' Insert the result of a trial into the results table. '''
+
+  db.execute(
+    'INSERT INTO trials (sweep, config, status, val_mse, val_mae, epochs, timed_out, seconds, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    (sweep, json.dumps(result['config']), result['status'], result['val_mse'], result['val_mae'],
+      result['epochs'], int(result['timed_out']), result['seconds'], result['error']))
+  db.commit()
+
+
+def run_sweep(configs, store_dir, db_path, workers, threads_per_trial, max_seconds, sweep=None):
+  ''' Run the trials of the configs concurrently and store their results in the results table as they complete.
+
+  Returns the results of the trials.
+  '''
+
+  sweep = sweep or time.strftime('%Y%m%d-%H%M%S')
+
+  db = sqlite3.connect(db_path)
+  db.execute(RESULTS_TABLE)
+
+  # spawn the workers so that each of them imports TensorFlow after its threads are limited
+  context = multiprocessing.get_context('spawn')
+
+  results = []
+
+  with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(threads_per_trial,)) as executor:
+    futures = [executor.submit(run_trial, config, store_dir, max_seconds) for config in configs]
+
+    for future in as_completed(futures):
+      result = future.result()
+      save_result(db, sweep, result)
+      results.append(result)
+      print(f"{result['status']}: {result['config']} val_mse={result['val_mse']} ({result['seconds']:.1f}s)")
+
+  db.close()
+
+  return results
@@ -0,0 +1,109 @@
+import h5py
+import numpy as np
+
+'''
+Generate synthetic GMI granules with the group layout of the real products.
+
+The 1C-R GMI TB granules have the S1 (9 channels) and S2 (4 channels) swaths with their Latitude, Longitude and Tc
+datasets, and the 2A GPROF granules have the S1 swath with its Latitude, Longitude and surfacePrecipitation datasets.
+The swaths have 221 pixels per scan and a configurable number of scans (2963 in a real orbit). The ground track
+crosses the Ionian Sea area of interest so that bounding box reads can be exercised. A fraction of the values are
+set to the -9999.9 missing value, and optionally the geolocation of a fraction of the scans as in the real granules.
+The S2 swath is shifted along the track from the S1 swath, as the footprints of the high frequency channels are, so
+that the pixels of the two swaths at the same array position are not at the same place and have to be collocated.
+
+These granules only mimic the structure and value ranges of the real products, not their physics. They are meant to
+measure the performance of the pipeline without downloading the real files.
+'''
+
+# the number of pixels per scan of the GMI swaths
+N_PIXELS = 221
+
+# the number of scans of a full orbit
+N_SCANS = 2963
+
+# the number of TB channels of each swath
+N_CHANNELS = {'S1': 9, 'S2': 4}
+
+# the special value for missing data
+MISSING_VALUE = -9999.9
+
+# the shift along the track of the S2 swath from the S1 swath, in degrees (about 5.5 km)
+S2_SHIFT = 0.05
+
+
+def make_geolocation(n_scans, n_pixels=N_PIXELS, lat_center=37, lon_center=18, shift=0.0, missing_scan_fraction=0.0, seed=0):
+  ''' Build the latitude and longitude of a swath whose ground track passes over the given center.
+
+  The latitude of the ground track sweeps the -70 to 70 degrees range of the GPM orbit over the whole granule, the
+  swath can be shifted along the track by a number of degrees. A random fraction of the scans have the missing value
+  as latitude and longitude, the same scans for the same seed so that the swaths of a granule agree.
+  '''
+
+  # position of each scan along the track and of each pixel across the track, in degrees
+  along = np.linspace(-70, 70, n_scans)[:, np.newaxis] + shift
+  across = np.linspace(-4.5, 4.5, n_pixels)[np.newaxis, :]
+
+  lat = np.clip(along + 0.2 * across, -90, 90)
+  lon = lon_center + 0.3 * (along - lat_center) + across
+
+  lat, lon = lat.astype(np.float32), lon.astype(np.float32)
+
+  missing = np.random.default_rng(seed).random(n_scans) < missing_scan_fraction
+  lat[missing] = MISSING_VALUE
+  lon[missing] = MISSING_VALUE
+
+  return lat, lon
+
+
+def add_missing_values(data, rng, missing_fraction):
+  ''' Set a random fraction of the values to the missing value. '''
+
+  data[rng.random(data.shape) < missing_fraction] = MISSING_VALUE
+  return data
+
+
+def make_granule_tb(file_path, n_scans=N_SCANS, missing_fraction=0.01, seed=0, compression='gzip', missing_scan_fraction=0.0, s2_shift=S2_SHIFT):
+  ''' Write a synthetic 1C-R GMI TB granule, the S2 swath shifted along the track by s2_shift degrees. '''
+
+  rng = np.random.default_rng(seed)
+
+  with h5py.File(file_path, 'w') as hf:
+    for swath, n_channels in N_CHANNELS.items():
+      lat, lon = make_geolocation(n_scans, shift=s2_shift if swath == 'S2' else 0.0, missing_scan_fraction=missing_scan_fraction, seed=seed)
+      tc = rng.uniform(130, 300, size=(n_scans, N_PIXELS, n_channels)).astype(np.float32)
+
+      hf.create_dataset(f'{swath}/Latitude', data=lat, chunks=True, compression=compression)
+      hf.create_dataset(f'{swath}/Longitude', data=lon, chunks=True, compression=compression)
+      hf.create_dataset(f'{swath}/Tc', data=add_missing_values(tc, rng, missing_fraction), chunks=True, compression=compression)
+
+
+def make_granule_precipitation(file_path, n_scans=N_SCANS, missing_fraction=0.01, seed=0, compression='gzip', missing_scan_fraction=0.0):
+  ''' Write a synthetic 2A GPROF surface precipitation granule, on the S1 swath of the TB granule of the same seed. '''
+
+  rng = np.random.default_rng(seed)
+  lat, lon = make_geolocation(n_scans, missing_scan_fraction=missing_scan_fraction, seed=seed)
+
+  # mostly no rain with a long tail of heavy rain
+  rr = (rng.exponential(2, size=(n_scans, N_PIXELS)) * (rng.random((n_scans, N_PIXELS)) < 0.3)).astype(np.float32)
+
+  with h5py.File(file_path, 'w') as hf:
+    hf.create_dataset('S1/Latitude', data=lat, chunks=True, compression=compression)
+    hf.create_dataset('S1/Longitude', data=lon, chunks=True, compression=compression)
+    hf.create_dataset('S1/surfacePrecipitation', data=add_missing_values(rr, rng, missing_fraction), chunks=True, compression=compression)
+
+
+def make_random_model(file_path, layers=(13, 20, 10, 1), seed=0):
+  ''' Write a NumPy inference engine model of the given layer widths with random weights. '''
+
+  rng = np.random.default_rng(seed)
+
+  arrays = {}
+  activations = []
+
+  for i, (n_in, n_out) in enumerate(zip(layers[:-1], layers[1:])):
+    arrays[f'kernel_{i}'] = rng.normal(0, 0.005, size=(n_in, n_out)).astype(np.float32)
+    arrays[f'bias_{i}'] = np.zeros(n_out, dtype=np.float32)
+    activations.append('linear' if i == len(layers) - 2 else 'sigmoid')
+
+  np.savez(file_path, activations=np.array(activations), **arrays)
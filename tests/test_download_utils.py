@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download_utils import download_data, download_file, load_manifest, PARTIAL_SUFFIX
+
+'''
+Tests of the resumable downloads against a local HTTP server that supports Range requests.
+'''
+
+# the content of the file served by the test server
+CONTENT = bytes(range(256)) * 4096
+
+FILENAME = 'granule.HDF5'
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+  ''' Serve the files of the server with Range requests, optionally without Content-Length or cut short. '''
+
+  def do_GET(self):
+    server = self.server
+    server.requests.append({'path': self.path, 'range': self.headers.get('Range')})
+
+    content = server.files.get(self.path.lstrip('/'))
+    if content is None:
+      self.send_error(404)
+      return
+
+    start = 0
+    range_header = self.headers.get('Range')
+
+    if range_header and server.ranges:
+      start = int(range_header.split('=')[1].split('-')[0])
+
+      # the range starts at or after the end of the file
+      if start >= len(content):
+        self.send_response(416)
+        self.send_header('Content-Range', f'bytes */{len(content)}')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+
+      self.send_response(206)
+      self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+    else:
+      self.send_response(200)
+
+    body = content[start:]
+
+    if server.content_length:
+      self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+
+    # a transfer cut short sends half of the body and closes the connection
+    self.wfile.write(body[:len(body) // 2] if server.truncate else body)
+    self.close_connection = True
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture
+def server():
+  ''' A local HTTP server serving CONTENT as FILENAME, its behaviour is set by its ranges, content_length and truncate attributes. '''
+
+  httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+  httpd.files = {FILENAME: CONTENT}
+  httpd.requests = []
+  httpd.ranges = True
+  httpd.content_length = True
+  httpd.truncate = False
+  httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/{FILENAME}'
+
+  thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+  thread.start()
+
+  yield httpd
+
+  httpd.shutdown()
+  httpd.server_close()
+
+
+def read(file_path):
+  with open(file_path, 'rb') as f:
+    return f.read()
+
+
+def test_download(server, tmp_path):
+  file_path = tmp_path / FILENAME
+
+  entry = download_file(server.url, str(file_path))
+
+  assert read(file_path) == CONTENT
+  assert entry == {'url': server.url, 'size': len(CONTENT), 'sha256': hashlib.sha256(CONTENT).hexdigest()}
+  assert not os.path.exists(str(file_path) + PARTIAL_SUFFIX)
+
+
+def test_resume(server, tmp_path):
+  file_path = tmp_path / FILENAME
+  (tmp_path / (FILENAME + PARTIAL_SUFFIX)).write_bytes(CONTENT[:1000])
+
+  download_file(server.url, str(file_path))
+
+  assert read(file_path) == CONTENT
+  assert server.requests[-1]['range'] == 'bytes=1000-'
+
+
+def test_resume_ignored_range(server, tmp_path):
+  server.ranges = False
+  file_path = tmp_path / FILENAME
+  (tmp_path / (FILENAME + PARTIAL_SUFFIX)).write_bytes(CONTENT[:1000])
+
+  download_file(server.url, str(file_path))
+
+  assert read(file_path) == CONTENT
+
+
+def test_complete_partial_file(server, tmp_path):
+  # the .part file already holds the whole file: the server answers 416 with the size of the file
+  file_path = tmp_path / FILENAME
+  (tmp_path / (FILENAME + PARTIAL_SUFFIX)).write_bytes(CONTENT)
+
+  entry = download_file(server.url, str(file_path))
+
+  assert read(file_path) == CONTENT
+  assert entry['size'] == len(CONTENT)
+
+
+def test_invalid_partial_file(server, tmp_path):
+  # a .part file longer than the file can't be resumed and is downloaded again
+  file_path = tmp_path / FILENAME
+  (tmp_path / (FILENAME + PARTIAL_SUFFIX)).write_bytes(CONTENT + b'garbage')
+
+  download_file(server.url, str(file_path))
+
+  assert read(file_path) == CONTENT
+  assert server.requests[-1]['range'] is None
+
+
+def test_not_found(server, tmp_path):
+  url = server.url.replace(FILENAME, 'missing.HDF5')
+
+  assert download_data([url], str(tmp_path)) == [url]
+  assert not os.path.exists(tmp_path / 'missing.HDF5')
+  assert load_manifest(str(tmp_path)) == {}
+
+
+def test_no_content_length(server, tmp_path):
+  server.content_length = False
+
+  assert download_data([server.url], str(tmp_path)) == [server.url]
+  assert not os.path.exists(tmp_path / FILENAME)
+  assert load_manifest(str(tmp_path)) == {}
+
+
+def test_truncated_transfer(server, tmp_path):
+  server.truncate = True
+
+  assert download_data([server.url], str(tmp_path)) == [server.url]
+  assert not os.path.exists(tmp_path / FILENAME)
+
+  # the next run resumes the transfer from the end of the .part file
+  server.truncate = False
+  assert download_data([server.url], str(tmp_path)) == []
+  assert read(tmp_path / FILENAME) == CONTENT
+  assert server.requests[-1]['range'] is not None
+
+
+def test_manifest(server, tmp_path):
+  assert download_data([server.url], str(tmp_path)) == []
+  assert load_manifest(str(tmp_path))[FILENAME]['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+
+  # a file matching its manifest entry is not downloaded again
+  n_requests = len(server.requests)
+  assert download_data([server.url], str(tmp_path)) == []
+  assert len(server.requests) == n_requests
+
+  # a corrupted file is downloaded again
+  corrupted = bytearray(CONTENT)
+  corrupted[10] ^= 0xff
+  (tmp_path / FILENAME).write_bytes(bytes(corrupted))
+
+  assert download_data([server.url], str(tmp_path)) == []
+  assert len(server.requests) == n_requests + 1
+  assert read(tmp_path / FILENAME) == CONTENT
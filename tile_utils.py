@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from regrid_utils import SwathRegridder, geometry_key
+
+'''
+Render swath data into a web mercator XYZ tile pyramid on disk.
+
+The tiles are the 256x256 PNG images of the slippy map scheme used by web maps: tile x, y of zoom z is written into
+<tiles dir>/z/x/y.png and the pyramid can be browsed with any web map library (e.g. Leaflet or OpenLayers with a
+file:// or local http url). The swath values are colored with the same turbo colormap and color axis range as the
+static maps of plot_utils, and the tiles are transparent where there is no data.
+
+Each pixel of a tile takes the value of the nearest swath pixel within a maximum distance, found with the KD-tree
+index of regrid_utils. Several swaths (e.g. the granules of a storm) are composited into the same pyramid: the
+nearest pixel of any of the swaths is used.
+
+The tiles are rendered in parallel worker processes and the pyramid is updated incrementally: the digest of each
+tile combines the rendering parameters and the content digests of the swaths that have pixels in (or near) the tile,
+and is recorded in the tiles.json manifest of the pyramid. When a granule is added, only the tiles it touches get a
+new digest and are rendered again, the other tiles are left as they are. The manifest also records the size and
+modification time of each file with the digest of its swath and the tiles it touches, so the files that didn't change
+are not read again unless they share a tile with a changed file: a rerun without new granules reads no swath.
+'''
+
+# the size in pixels of a tile
+TILE_SIZE = 256
+
+# the zoom levels rendered by default
+MIN_ZOOM = 3
+MAX_ZOOM = 8
+
+# tile pixels further than this distance from any swath pixel are transparent
+TILE_MAX_DISTANCE_KM = 10.0
+
+# the colormap of the tiles, the same as the static maps
+COLORMAP = 'turbo'
+
+# the latitude limit of the web mercator projection
+MAX_LATITUDE = 85.0511287798
+
+# the circumference of the Earth at the equator in km
+EARTH_CIRCUMFERENCE_KM = 40075.016686
+
+# the version of the tile rendering, bump it when the rendering changes so that all the tiles are rendered again
+TILES_VERSION = 1
+
+# the manifest of the digests of the rendered tiles and of the files they were rendered from
+TILES_MANIFEST_FILENAME = 'tiles.json'
+
+
+def lonlat_to_pixel(lat, lon, zoom):
+  ''' Convert latitudes and longitudes into the global web mercator pixel coordinates of a zoom level. '''
+
+  size = TILE_SIZE * 2 ** zoom
+  lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+
+  X = (np.asarray(lon) + 180) / 360 * size
+  Y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * size
+
+  return X, Y
+
+
+def pixel_to_lonlat(X, Y, zoom):
+  ''' Convert global web mercator pixel coordinates of a zoom level into latitudes and longitudes. '''
+
+  size = TILE_SIZE * 2 ** zoom
+
+  lon = X / size * 360 - 180
+  lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * Y / size))))
+
+  return lat, lon
+
+
+def tile_grid(zoom, x, y):
+  ''' The latitudes and longitudes of the centers of the pixels of a tile, as (TILE_SIZE, TILE_SIZE) arrays. '''
+
+  offsets = np.arange(TILE_SIZE) + 0.5
+  X, Y = np.meshgrid(x * TILE_SIZE + offsets, y * TILE_SIZE + offsets)
+
+  return pixel_to_lonlat(X, Y, zoom)
+
+
+def km_per_pixel(lat, zoom):
+  ''' The size in km of a web mercator pixel of a zoom level at the given latitudes. '''
+
+  return EARTH_CIRCUMFERENCE_KM * np.cos(np.radians(lat)) / (TILE_SIZE * 2 ** zoom)
+
+
+def swath_tiles(lat, lon, zoom, max_distance_km=TILE_MAX_DISTANCE_KM):
+  ''' Find the tiles of a zoom level that each swath pixel can be drawn in, i.e. the tiles within the maximum distance of the pixel.
+
+  Returns the (x, y) tile of each (pixel, tile) pair and the flat index of the pixel.
+  '''
+
+  n_tiles = 2 ** zoom
+
+  X, Y = lonlat_to_pixel(lat, lon, zoom)
+  pad = max_distance_km / km_per_pixel(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE), zoom)
+
+  tx0 = np.floor((X - pad) / TILE_SIZE).astype(np.int64)
+  tx1 = np.floor((X + pad) / TILE_SIZE).astype(np.int64)
+  ty0 = np.clip(np.floor((Y - pad) / TILE_SIZE).astype(np.int64), 0, n_tiles - 1)
+  ty1 = np.clip(np.floor((Y + pad) / TILE_SIZE).astype(np.int64), 0, n_tiles - 1)
+
+  span = int(max((tx1 - tx0).max(initial=0), (ty1 - ty0).max(initial=0))) + 1
+
+  tiles_x, tiles_y, pixels = [], [], []
+  for dx in range(span):
+    for dy in range(span):
+      inside = np.flatnonzero((tx0 + dx <= tx1) & (ty0 + dy <= ty1))
+      # the tiles wrap around the antimeridian
+      tiles_x.append((tx0[inside] + dx) % n_tiles)
+      tiles_y.append(ty0[inside] + dy)
+      pixels.append(inside)
+
+  return np.concatenate(tiles_x), np.concatenate(tiles_y), np.concatenate(pixels)
+
+
+def plan_tiles(swaths, zooms, max_distance_km=TILE_MAX_DISTANCE_KM):
+  ''' Find the swath pixels of every tile of the pyramid.
+
+  The swaths are given as a list of dictionaries with their 'lat', 'lon' and 'values' arrays.
+  Returns a dictionary of the list of (swath index, flat pixel indices) of each (zoom, x, y) tile.
+  '''
+
+  plan = {}
+
+  for swath_index, swath in enumerate(swaths):
+    lat = np.asarray(swath['lat'], dtype=np.float64).reshape(-1)
+    lon = np.asarray(swath['lon'], dtype=np.float64).reshape(-1)
+    values = np.asarray(swath['values']).reshape(-1)
+
+    # only the pixels with a position and a value are drawn
+    valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon) & np.isfinite(values))
+
+    for zoom in zooms:
+      tiles_x, tiles_y, pixels = swath_tiles(lat[valid], lon[valid], zoom, max_distance_km)
+
+      # group the pixels by tile
+      keys = tiles_x * 2 ** zoom + tiles_y
+      order = np.argsort(keys, kind='stable')
+      keys, pixels = keys[order], valid[pixels[order]]
+      unique_keys, starts = np.unique(keys, return_index=True)
+
+      for key, group in zip(unique_keys, np.split(pixels, starts[1:])):
+        tile = (zoom, int(key // 2 ** zoom), int(key % 2 ** zoom))
+        plan.setdefault(tile, []).append((swath_index, group))
+
+  return plan
+
+
+def tile_path(tiles_dir, tile):
+  ''' The path of the PNG file of a (zoom, x, y) tile. '''
+
+  zoom, x, y = tile
+  return os.path.join(tiles_dir, str(zoom), str(x), f'{y}.png')
+
+
+def file_stamp(file_path, params):
+  ''' The stamp of a file from its size and modification time and the parameters its swath is read and planned with. '''
+
+  stat = os.stat(file_path)
+  description = json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'params': params}, sort_keys=True)
+  return hashlib.sha1(description.encode()).hexdigest()
+
+
+def tile_digest(swath_digests, params):
+  ''' The digest of a tile from the digests of its swaths and the rendering parameters. '''
+
+  description = json.dumps({'version': TILES_VERSION, 'params': params, 'swaths': sorted(swath_digests)}, sort_keys=True)
+  return hashlib.sha1(description.encode()).hexdigest()
+
+
+def render_tile(tile, lat, lon, values, path, vmin, vmax, colormap=COLORMAP, max_distance_km=TILE_MAX_DISTANCE_KM):
+  ''' Render the nearest swath pixel values of a tile into a PNG file, transparent where there is no swath pixel. '''
+
+  import matplotlib
+  from matplotlib import colors
+  from matplotlib import image
+
+  grid_lat, grid_lon = tile_grid(*tile)
+
+  distance, idx = SwathRegridder(lat, lon).neighbours(grid_lat, grid_lon, 1, max_distance_km)
+  idx = idx.reshape(grid_lat.shape)
+
+  raster = np.full(grid_lat.shape, np.nan, dtype=np.float32)
+  found = idx >= 0
+  raster[found] = values[idx[found]]
+
+  rgba = matplotlib.colormaps[colormap](colors.Normalize(vmin, vmax)(raster), bytes=True)
+  rgba[~np.isfinite(raster), 3] = 0
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+
+  # write the tile into a temporary file renamed into place so that a tile is never seen half written
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.png')
+  os.close(fd)
+  image.imsave(tmp_path, rgba, format='png')
+  os.replace(tmp_path, path)
+
+  return tile
+
+
+def load_manifest(tiles_dir):
+  ''' Load the digests of the rendered tiles and the records of the files they were rendered from.
+
+  Returns a dictionary with the digest of each tile under 'tiles', and the stamp, swath digest and tiles of each file under 'files'.
+  '''
+
+  manifest_path = os.path.join(tiles_dir, TILES_MANIFEST_FILENAME)
+  if not os.path.exists(manifest_path):
+    return {'tiles': {}, 'files': {}}
+
+  with open(manifest_path) as f:
+    manifest = json.load(f)
+
+  # the manifests of the previous version only have the digests of the tiles
+  if 'files' not in manifest:
+    return {'tiles': manifest, 'files': {}}
+
+  return manifest
+
+
+def save_manifest(tiles_dir, manifest):
+  ''' Save the manifest of the tiles atomically. '''
+
+  manifest_path = os.path.join(tiles_dir, TILES_MANIFEST_FILENAME)
+  tmp_path = manifest_path + '.tmp'
+
+  with open(tmp_path, 'w') as f:
+    json.dump(manifest, f)
+  os.replace(tmp_path, manifest_path)
+
+
+def build_pyramid(file_paths, read_swath, tiles_dir, vmin, vmax, zooms=range(MIN_ZOOM, MAX_ZOOM + 1), colormap=COLORMAP,
+  max_distance_km=TILE_MAX_DISTANCE_KM, workers=None, read_params=None):
+  ''' Render the tiles of the files whose digest changed since they were last rendered, in parallel worker processes.
+
+  The swath of a file is read with read_swath(file_path), which returns a dictionary with its 'lat', 'lon' and 'values'
+  arrays or None, and read_params describes what it reads (e.g. the channel). A file is only read when its size,
+  modification time or read parameters changed, or when it has pixels in a tile that has to be rendered again.
+  The tiles that no swath touches anymore are deleted.
+  Returns the number of rendered, unchanged and deleted tiles and the number of files read.
+  '''
+
+  os.makedirs(tiles_dir, exist_ok=True)
+
+  params = {'vmin': vmin, 'vmax': vmax, 'colormap': colormap, 'max_distance_km': max_distance_km}
+  stamp_params = {'read': read_params, 'zooms': list(zooms), 'max_distance_km': max_distance_km}
+
+  # the files are recorded by absolute path so that the records don't depend on the working directory
+  file_paths = [os.path.abspath(file_path) for file_path in file_paths]
+
+  manifest = load_manifest(tiles_dir)
+  records = {}
+  swaths = {}
+  tile_parts = {}
+
+  def load(file_path):
+    ''' Read the swath of a file and find its pixels in every tile. '''
+
+    swath = read_swath(file_path)
+    swaths[file_path] = swath
+    if swath is None:
+      return {'digest': None, 'tiles': []}
+
+    plan = plan_tiles([swath], zooms, max_distance_km)
+    for tile, parts in plan.items():
+      tile_parts.setdefault('/'.join(map(str, tile)), []).append((file_path, parts[0][1]))
+
+    return {'digest': geometry_key(swath['lat'], swath['lon'], swath['values']), 'tiles': ['/'.join(map(str, tile)) for tile in plan]}
+
+  # the records of the files that didn't change are reused without reading them
+  for file_path in file_paths:
+    stamp = file_stamp(file_path, stamp_params)
+    record = manifest['files'].get(file_path)
+
+    if record is None or record['stamp'] != stamp:
+      record = dict(load(file_path), stamp=stamp)
+
+    records[file_path] = record
+
+  # the files with pixels in each tile
+  tile_files = {}
+  for file_path, record in records.items():
+    for key in record['tiles']:
+      tile_files.setdefault(key, []).append(file_path)
+
+  digests = {key: tile_digest([records[file_path]['digest'] for file_path in files], params) for key, files in tile_files.items()}
+
+  render = [key for key in digests
+    if manifest['tiles'].get(key) != digests[key] or not os.path.exists(tile_path(tiles_dir, tuple(map(int, key.split('/')))))]
+
+  # read the unchanged files sharing a tile with a changed file
+  for file_path in sorted({file_path for key in render for file_path in tile_files[key]} - set(swaths)):
+    load(file_path)
+
+  order = {file_path: index for index, file_path in enumerate(file_paths)}
+
+  tasks = []
+  for key in render:
+    tile = tuple(map(int, key.split('/')))
+    # the swaths in the order of the files whatever order they were read in
+    parts = sorted(tile_parts[key], key=lambda part: order[part[0]])
+
+    # the swath pixels of the tile
+    lat = np.concatenate([np.asarray(swaths[file_path]['lat']).reshape(-1)[pixels] for file_path, pixels in parts])
+    lon = np.concatenate([np.asarray(swaths[file_path]['lon']).reshape(-1)[pixels] for file_path, pixels in parts])
+    values = np.concatenate([np.asarray(swaths[file_path]['values']).reshape(-1)[pixels] for file_path, pixels in parts])
+
+    tasks.append((tile, lat, lon, values, tile_path(tiles_dir, tile), vmin, vmax, colormap, max_distance_km))
+
+  # delete the tiles that no swath touches anymore
+  stale = [key for key in manifest['tiles'] if key not in digests]
+  for key in stale:
+    path = tile_path(tiles_dir, tuple(map(int, key.split('/'))))
+    if os.path.exists(path):
+      os.remove(path)
+
+  rendered = 0
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    for tile in executor.map(render_tile, *zip(*tasks), chunksize=16) if tasks else []:
+      manifest['tiles']['/'.join(map(str, tile))] = digests['/'.join(map(str, tile))]
+      rendered += 1
+
+  tiles = {key: manifest['tiles'][key] for key in digests if key in manifest['tiles']}
+  save_manifest(tiles_dir, {'tiles': tiles, 'files': records})
+
+  return {'rendered': rendered, 'unchanged': len(digests) - len(tasks), 'deleted': len(stale), 'read': len(swaths)}
@@ -0,0 +1,157 @@
+import numpy as np
+
+'''
+The training data input pipeline.
+
+The TB features and the rain rate labels are read from the NetCDF dataset straight into contiguous float32
+arrays, without going through pandas, and are fed to the model through a cached and prefetched tf.data dataset.
+'''
+
+
+def load_training_data(filepath):
+  ''' Read the TB features and the surface rain rate labels of the training dataset.
+
+  Returns a (pixels, channels) float32 array of TBs and a (pixels,) float32 array of rain rates.
+  '''
+
+  import xarray as xr
+
+  with xr.open_dataset(filepath) as ds:
+
+    # the pixels are along the dimension of the rain rate, the TB channels along the other dimension of the TBs
+    pixel_dim = ds['rr'].dims[0]
+    tb = ds['tb'].transpose(pixel_dim, ...)
+
+    X = np.ascontiguousarray(tb.values, dtype=np.float32)
+    y = np.ascontiguousarray(ds['rr'].values, dtype=np.float32).reshape(-1)
+
+  return X, y
+
+
+# splitting the dataset
+def split_dataset(dataset, label_dataset):
+  ''' this function splits the dataset between training and test datasets
+
+  'X' represents training data and 'y' represents the target label
+  opt for 50% split between training and test set because the the training set is quite small
+  '''
+
+  choice = np.mod(range(0, len(dataset)), 2) == 0 # this variable is true for even positions in the obseravtions sequence
+  X_train = dataset[choice == 0]
+  X_test = dataset[choice]
+  y_train = label_dataset[choice == 0]
+  y_test = label_dataset[choice]
+
+  # return the split dataset
+  return X_train, X_test, y_train, y_test
+
+
+def sample_rows(X, y, n, seed=None):
+  ''' Draw a random sample of n rows of the features and labels, in their original order. '''
+
+  if n >= len(X):
+    return np.asarray(X), np.asarray(y)
+
+  idx = np.sort(np.random.default_rng(seed).choice(len(X), size=n, replace=False))
+
+  return X[idx], y[idx]
+
+
+def next_version_dir(versions_dir):
+  ''' The directory of the next model version: v001, v002, ... '''
+
+  import os
+  import re
+
+  versions = [0]
+  if os.path.isdir(versions_dir):
+    for name in os.listdir(versions_dir):
+      match = re.fullmatch(r'v(\d+)', name)
+      if match:
+        versions.append(int(match.group(1)))
+
+  return os.path.join(versions_dir, f'v{max(versions) + 1:03d}')
+
+
+def make_dataset(X, y, batch_size, shuffle=False):
+  ''' Build a tf.data dataset of (features, label) batches.
+
+  The dataset is cached in memory after its first pass and the next batches are prefetched while the model trains on the current one.
+  The training dataset is reshuffled at each epoch, as model.fit does with NumPy arrays.
+  '''
+
+  import tensorflow as tf
+
+  dataset = tf.data.Dataset.from_tensor_slices((X, y)).cache()
+
+  if shuffle:
+    dataset = dataset.shuffle(len(X), reshuffle_each_iteration=True)
+
+  return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def build_model(input_shape, layers=(20, 10), activation='sigmoid', learning_rate=0.001, optimizer='adam'):
+  ''' Build and compile a feed forward MLP with the given hidden layer widths, activation function and optimizer.
+
+  The defaults are the architecture trained in 03_train_sea_ann.py: two sigmoid hidden layers of 20 and 10 perceptrons and a linear output.
+  '''
+
+  from tensorflow.keras.models import Sequential
+  from tensorflow.keras.layers import Dense
+  from tensorflow.keras import optimizers
+
+  model = Sequential()
+  model.add(Dense(layers[0], input_dim=input_shape, kernel_initializer='normal', activation=activation))
+  for units in layers[1:]:
+    model.add(Dense(units, kernel_initializer='normal', activation=activation))
+  model.add(Dense(1, kernel_initializer='normal', activation='linear')) # output
+
+  optimizers_by_name = {
+    'adam': optimizers.Adam,
+    'sgd': optimizers.SGD,
+    'rmsprop': optimizers.RMSprop
+  }
+
+  model.compile(optimizer=optimizers_by_name[optimizer](learning_rate=learning_rate), loss='mean_squared_error', metrics=['mae'])
+
+  return model
+
+
+def time_limit(max_seconds, start=None):
+  ''' Return a Keras callback that stops the training once the given number of seconds have passed.
+
+  The time is counted from the given time.perf_counter() start, e.g. the start of a trial, or from the start of the training.
+  '''
+
+  import time
+  import tensorflow as tf
+
+  class TimeLimit(tf.keras.callbacks.Callback):
+
+    def on_train_begin(self, logs=None):
+      self.start = time.perf_counter() if start is None else start
+      self.timed_out = False
+
+    def on_train_batch_end(self, batch, logs=None):
+      if time.perf_counter() - self.start > max_seconds:
+        self.timed_out = True
+        self.model.stop_training = True
+
+  return TimeLimit()
+
+
+def limit_threads(threads):
+  ''' Limit the number of threads used by TensorFlow and the numerical libraries of the current process.
+
+  Must be called before TensorFlow is imported by the process.
+  '''
+
+  import os
+
+  for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS']:
+    os.environ[variable] = str(threads)
+  os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+  import tensorflow as tf
+  tf.config.threading.set_intra_op_parallelism_threads(threads)
+  tf.config.threading.set_inter_op_parallelism_threads(1)
@@ -0,0 +1,342 @@
+import os
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from constants import *
+
+'''
+Verify the skill of the model against the GPROF surface precipitation over many granules.
+
+The 1C GMI and 2A GPROF granules of the same orbits are paired by their orbit number (see dataset_utils.pair_granules). The model predicts the rain
+rate of the S1 pixels of the 1C granule (or its prediction file written by output_utils is read), and the
+prediction is compared pixel by pixel with the surfacePrecipitation of the 2A granule, which is on the same S1 grid.
+A prediction file can only hold the scans crossing an area of interest, its scans are then located in the 2A granule
+by their geolocation. Only the pixels where both rain rates are valid are verified.
+
+The skill scores are accumulated in a SkillAccumulator for each region (a bounding box, or the full granules):
+  - the bias, MAE, RMSE and correlation of the predicted rain rates, from running means and co-moments merged with
+    the parallel algorithm of Chan et al. as the scaler statistics are (see model_utils.update_scaler)
+  - the contingency table of rain / no rain at each rain rate threshold, from which the probability of detection
+    (POD), false alarm ratio (FAR) and critical success index (CSI) are computed
+
+The accumulators only hold a few numbers per region and threshold, and the accumulators of the granules are merged
+as the granules complete, so the memory used doesn't grow with the number of verified orbits. The granules are
+verified in parallel worker processes and each granule is read once for all the regions.
+'''
+
+# the rain rate thresholds in mm/h of the contingency tables
+RAIN_THRESHOLDS = (0.1, 1.0, 5.0, 10.0)
+
+# the regions verified by default, the full granules and the areas of interest
+REGIONS = {
+  'global': (None, None),
+  'ionian-sea': (LAT_BOUNDS_IONIAN_SEA, LON_BOUNDS_IONIAN_SEA),
+  'ida-landfall': (LAT_BOUNDS_IDA_LANDFALL, LON_BOUNDS_IDA_LANDFALL)
+}
+
+# filename pattern of the 2A GPROF granules
+GPROF_FILE_PATTERN = '2A.GPM.GMI.GPROF*.HDF5'
+
+# the largest difference in degrees between the geolocations of the same S1 pixel in the 1C and 2A granules
+GEOLOCATION_TOLERANCE = 0.01
+
+
+class SkillAccumulator:
+  ''' Running skill scores of predicted against reference rain rates that can be merged with other accumulators. '''
+
+  def __init__(self, thresholds=RAIN_THRESHOLDS):
+
+    self.thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    # the number of pixels, the means and the sums of squared deviations of the predictions and of the references,
+    # their co-moment and the sum of the absolute errors
+    self.n = 0
+    self.mean_predicted = 0.0
+    self.mean_reference = 0.0
+    self.m2_predicted = 0.0
+    self.m2_reference = 0.0
+    self.comoment = 0.0
+    self.sum_abs_error = 0.0
+
+    # the contingency table of each threshold
+    self.hits = np.zeros(len(self.thresholds), dtype=np.int64)
+    self.misses = np.zeros(len(self.thresholds), dtype=np.int64)
+    self.false_alarms = np.zeros(len(self.thresholds), dtype=np.int64)
+    self.correct_negatives = np.zeros(len(self.thresholds), dtype=np.int64)
+
+  def update(self, predicted, reference):
+    ''' Add pixels to the accumulator, the pixels where either rain rate is NaN are ignored. '''
+
+    predicted = np.asarray(predicted, dtype=np.float64).reshape(-1)
+    reference = np.asarray(reference, dtype=np.float64).reshape(-1)
+
+    valid = np.isfinite(predicted) & np.isfinite(reference)
+    predicted, reference = predicted[valid], reference[valid]
+
+    if len(predicted) == 0:
+      return self
+
+    batch = SkillAccumulator(self.thresholds)
+    batch.n = len(predicted)
+    batch.mean_predicted = predicted.mean()
+    batch.mean_reference = reference.mean()
+
+    deviation_predicted = predicted - batch.mean_predicted
+    deviation_reference = reference - batch.mean_reference
+    batch.m2_predicted = np.dot(deviation_predicted, deviation_predicted)
+    batch.m2_reference = np.dot(deviation_reference, deviation_reference)
+    batch.comoment = np.dot(deviation_predicted, deviation_reference)
+    batch.sum_abs_error = np.abs(predicted - reference).sum()
+
+    for i, threshold in enumerate(self.thresholds):
+      rain_predicted = predicted >= threshold
+      rain_reference = reference >= threshold
+
+      batch.hits[i] = np.count_nonzero(rain_predicted & rain_reference)
+      batch.misses[i] = np.count_nonzero(~rain_predicted & rain_reference)
+      batch.false_alarms[i] = np.count_nonzero(rain_predicted & ~rain_reference)
+      batch.correct_negatives[i] = batch.n - batch.hits[i] - batch.misses[i] - batch.false_alarms[i]
+
+    return self.merge(batch)
+
+  def merge(self, other):
+    ''' Merge another accumulator into this one, as if its pixels had been added to this one. '''
+
+    if not np.array_equal(self.thresholds, other.thresholds):
+      raise ValueError('cannot merge accumulators of different thresholds')
+
+    if other.n == 0:
+      return self
+
+    n_a, n_b = self.n, other.n
+    n = n_a + n_b
+
+    delta_predicted = other.mean_predicted - self.mean_predicted
+    delta_reference = other.mean_reference - self.mean_reference
+
+    self.mean_predicted += delta_predicted * n_b / n
+    self.mean_reference += delta_reference * n_b / n
+    self.m2_predicted += other.m2_predicted + delta_predicted ** 2 * n_a * n_b / n
+    self.m2_reference += other.m2_reference + delta_reference ** 2 * n_a * n_b / n
+    self.comoment += other.comoment + delta_predicted * delta_reference * n_a * n_b / n
+    self.sum_abs_error += other.sum_abs_error
+    self.n = n
+
+    self.hits += other.hits
+    self.misses += other.misses
+    self.false_alarms += other.false_alarms
+    self.correct_negatives += other.correct_negatives
+
+    return self
+
+  def metrics(self):
+    ''' The skill scores of the accumulated pixels. '''
+
+    if self.n == 0:
+      return {'n': 0}
+
+    bias = self.mean_predicted - self.mean_reference
+
+    # the mean squared error from the variances, the covariance and the bias
+    mse = (self.m2_predicted + self.m2_reference - 2 * self.comoment) / self.n + bias ** 2
+    denominator = np.sqrt(self.m2_predicted * self.m2_reference)
+
+    def ratio(numerator, denominator):
+      return float(numerator / denominator) if denominator > 0 else None
+
+    metrics = {
+      'n': int(self.n),
+      'mean_predicted': float(self.mean_predicted),
+      'mean_reference': float(self.mean_reference),
+      'bias': float(bias),
+      'relative_bias': ratio(bias, self.mean_reference),
+      'mae': float(self.sum_abs_error / self.n),
+      'rmse': float(np.sqrt(max(mse, 0))),
+      'correlation': ratio(self.comoment, denominator),
+      'thresholds': {}
+    }
+
+    for i, threshold in enumerate(self.thresholds):
+      hits, misses, false_alarms = self.hits[i], self.misses[i], self.false_alarms[i]
+
+      metrics['thresholds'][f'{threshold:g}'] = {
+        'hits': int(hits),
+        'misses': int(misses),
+        'false_alarms': int(false_alarms),
+        'correct_negatives': int(self.correct_negatives[i]),
+        'pod': ratio(hits, hits + misses),
+        'far': ratio(false_alarms, hits + false_alarms),
+        'csi': ratio(hits, hits + misses + false_alarms)
+      }
+
+    return metrics
+
+
+def region_mask(lat, lon, lat_bounds, lon_bounds):
+  ''' The pixels of a swath inside a bounding box, or all the pixels if no bounds are given. '''
+
+  if lat_bounds is None or lon_bounds is None:
+    return np.ones(lat.shape, dtype=bool)
+
+  return (lat >= lat_bounds[0]) & (lat <= lat_bounds[1]) & (lon >= lon_bounds[0]) & (lon <= lon_bounds[1])
+
+
+def match_scans(lat, lon, reference_lat, reference_lon, tolerance=GEOLOCATION_TOLERANCE):
+  ''' Find the scans of a (scans, pixels) swath, e.g. cropped to an area of interest, in a reference swath of the same grid.
+
+  Returns the index of the reference scan matching the first scan of the swath, a ValueError is raised if the swath
+  is not a run of scans of the reference swath. The pixels without a valid position are not compared.
+  '''
+
+  n_scans = len(lat)
+
+  if lat.shape[1:] != reference_lat.shape[1:] or n_scans > len(reference_lat):
+    raise ValueError(f'the swath {lat.shape} is not on the grid of the reference swath {reference_lat.shape}')
+
+  def matches(a, b):
+    with np.errstate(invalid='ignore'):
+      return not np.any(np.abs(a - b) > tolerance)
+
+  # the candidate positions of the first geolocated scan of the swath in the reference swath
+  located = np.flatnonzero(np.all(np.isfinite(lat) & np.isfinite(lon), axis=1))
+  if len(located) == 0:
+    raise ValueError('the swath has no geolocated scan')
+
+  scan = located[0]
+  with np.errstate(invalid='ignore'):
+    candidates = np.flatnonzero(np.all(np.abs(reference_lat - lat[scan]) <= tolerance, axis=1)) - scan
+
+  for start in candidates:
+    if start < 0 or start + n_scans > len(reference_lat):
+      continue
+
+    if matches(lat, reference_lat[start:start + n_scans]) and matches(lon, reference_lon[start:start + n_scans]):
+      return start
+
+  raise ValueError('the scans of the swath are not in the reference swath')
+
+
+# the model and precision of the worker process, set by the pool initializer
+worker_model = None
+
+# the prediction function of the worker process, loaded by the first granule without a prediction file
+predict = None
+
+
+def init_worker(models_dir, precision):
+  ''' Remember the model of the worker process, it is only loaded if a granule has to be predicted. '''
+
+  global worker_model
+  worker_model = (models_dir, precision)
+
+
+def worker_predictor():
+  ''' The prediction function of the worker process, the model is loaded once on first use. '''
+
+  global predict
+
+  if predict is None:
+    from predict_utils import load_predictor
+    models_dir, precision = worker_model
+    predict = load_predictor(models_dir, precision=precision)
+
+  return predict
+
+
+def verify_granule(orbit, tb_path, gprof_path, regions, thresholds, predictions_dir=None):
+  ''' Verify the predictions of a granule against the GPROF surface precipitation in each region, in a worker process.
+
+  The prediction file of the granule in the predictions directory is used if there is one, otherwise the granule is
+  predicted. The GPROF pixels of the scans of the prediction are verified. Returns the accumulators of the regions and the record of the granule, a failure is recorded in the
+  record rather than raised.
+  '''
+
+  from gmi_utils import read_granule
+  from output_utils import read_prediction, prediction_filename
+  from predict_utils import predict_granule
+
+  accumulators = {name: SkillAccumulator(thresholds) for name in regions}
+  record = {'orbit': orbit, 'granule': tb_path, 'gprof': gprof_path, 'status': 'ok', 'source': None, 'n_verified': 0, 'seconds': None, 'error': None}
+
+  start = time.perf_counter()
+
+  try:
+    prediction_path = os.path.join(predictions_dir, prediction_filename(tb_path)) if predictions_dir else None
+
+    if prediction_path and os.path.exists(prediction_path):
+      prediction = read_prediction(prediction_path)
+      record['source'] = prediction_path
+    else:
+      prediction = predict_granule(tb_path, worker_predictor())
+      record['source'] = 'model'
+
+    if not prediction:
+      raise ValueError('the prediction is empty')
+
+    gprof = read_granule(gprof_path, ['S1/Latitude', 'S1/Longitude', 'S1/surfacePrecipitation'])
+
+    # the scans of the GPROF granule of the prediction, which can be cropped to an area of interest
+    first_scan = match_scans(prediction['lat'], prediction['lon'], gprof['S1/Latitude'], gprof['S1/Longitude'])
+    gprof = gprof['S1/surfacePrecipitation'][first_scan:first_scan + len(prediction['rr'])]
+
+    # the linear output of the model can predict small negative rain rates, which are no rain
+    rr = np.maximum(prediction['rr'], 0)
+
+    for name, (lat_bounds, lon_bounds) in regions.items():
+      inside = region_mask(prediction['lat'], prediction['lon'], lat_bounds, lon_bounds)
+      accumulators[name].update(rr[inside], gprof[inside])
+
+    record['n_verified'] = int(np.count_nonzero(np.isfinite(rr) & np.isfinite(gprof)))
+
+  except Exception as e:
+    record['status'] = 'failed'
+    record['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+
+  record['seconds'] = time.perf_counter() - start
+
+  return accumulators, record
+
+
+def verify(pairs, regions=REGIONS, thresholds=RAIN_THRESHOLDS, models_dir=MODELS_DIR, precision='float32', predictions_dir=None, workers=None):
+  ''' Verify the paired granules in parallel worker processes and merge their accumulators as they complete.
+
+  At most twice as many granules as workers are in flight at a time so that memory use doesn't grow with the number of granules.
+  Returns the merged accumulators of the regions and the records of the granules.
+  '''
+
+  workers = workers or os.cpu_count()
+
+  accumulators = {name: SkillAccumulator(thresholds) for name in regions}
+  records = []
+
+  pending = set()
+  pairs = iter(pairs)
+
+  with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(models_dir, precision)) as executor:
+    while True:
+
+      # keep the workers busy with a bounded number of granules in flight
+      for orbit, tb_path, gprof_path in pairs:
+        pending.add(executor.submit(verify_granule, orbit, tb_path, gprof_path, regions, thresholds, predictions_dir))
+        if len(pending) >= 2 * workers:
+          break
+
+      if not pending:
+        break
+
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+      for future in done:
+        granule_accumulators, record = future.result()
+
+        for name, accumulator in granule_accumulators.items():
+          accumulators[name].merge(accumulator)
+
+        records.append(record)
+        print(f"{record['status']}: orbit {record['orbit']}, {record['n_verified']} pixels ({record['seconds']:.2f}s)")
+
+  records.sort(key=lambda record: record['orbit'])
+
+  return accumulators, records